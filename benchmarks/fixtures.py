@@ -0,0 +1,161 @@
+import glob
+import hashlib
+import io
+import os
+import shutil
+from typing import Dict, List, Tuple
+
+import numpy as np
+import ruamel.yaml as yaml
+from PIL import Image
+
+import config
+from utils.voc import VocAnnotation, VocObject, write_voc_annotation
+
+_LABEL_MAP_FILE = 'countries_label_map.pbtxt'
+
+# number of distinct synthetic photos, which are shared by all photos of a
+# benchmark dataset (serving and hashing them stays cheap at any scale)
+_NUM_PHOTO_VARIANTS = 32
+
+# sizes of synthetic photos, all of them at least MIN_IMAGE_SIZE
+_PHOTO_SIZES = (640, 480), (800, 600), (480, 640), (1024, 683)
+
+_BENCHMARK_AUTHOR = 'Flagnet benchmark'
+
+_YAML = yaml.YAML(typ='safe', pure=False)
+
+SyntheticPhoto = Tuple[bytes, Tuple[int, int], Tuple[int, int, int, int]]
+
+
+def create_synthetic_photo(seed: int) -> SyntheticPhoto:
+    """
+    Creates a JPEG photo of a gradient background with a rectangular "flag"
+    in it.
+
+    :param seed: a seed which determines the size, colors and the position of
+    the flag
+    :return: JPEG content, (width, height) of the photo and the bounding box
+    of the flag
+    """
+
+    random = np.random.RandomState(seed)
+    width, height = _PHOTO_SIZES[seed % len(_PHOTO_SIZES)]
+
+    gradient = np.linspace(0, 1, width)[np.newaxis, :, np.newaxis]
+    image = (random.randint(0, 256, 3) * gradient + random.randint(0, 128, 3)).clip(0, 255)
+    image = np.repeat(image, height, axis=0).astype(np.uint8)
+
+    xmin, ymin = random.randint(0, width // 2), random.randint(0, height // 2)
+    xmax, ymax = xmin + random.randint(width // 8, width // 2), ymin + random.randint(height // 8, height // 2)
+    image[ymin:ymax + 1, xmin:xmax + 1] = random.randint(0, 256, 3)
+
+    output = io.BytesIO()
+    Image.fromarray(image).save(output, format='JPEG', quality=85)
+
+    return output.getvalue(), (width, height), (xmin, ymin, xmax, ymax)
+
+
+def _read_countries(source_folder: str, countries: List[str] = None) -> Dict[str, dict]:
+    """
+    Reads credits of countries of a dataset.
+
+    :return: a dictionary of credits by lowercase country code
+    """
+
+    credits_by_country = {}
+
+    for credits_path in sorted(glob.glob(f'{source_folder}/*/credits.yml')):
+        country_code = os.path.basename(os.path.dirname(credits_path))
+
+        if countries is None or country_code in countries:
+            with open(credits_path) as yaml_file:
+                credits_by_country[country_code] = _YAML.load(yaml_file)
+
+    return credits_by_country
+
+
+def create_dataset(dataset_folder: str, base_url: str, scale: int, source_folder: str = config.DATASET_FOLDER,
+                   countries: List[str] = None) -> Dict[str, bytes]:
+    """
+    Creates a dataset of synthetic photos laid out like the given dataset,
+    with scale times as many photos in every country folder. Photos get
+    credits (with SHA-256 hashes and sizes) and labels, but they are not
+    written: they are downloaded from the returned files.
+
+    :param dataset_folder: a path to the new dataset folder
+    :param base_url: a URL where the returned files are served
+    :param scale: number of photos of the new dataset per photo of the given
+    dataset
+    :param source_folder: a path to the dataset whose layout is copied
+    :param countries: lowercase codes of countries to copy (all if None)
+    :return: contents of photos by URL path
+    """
+
+    variants = [create_synthetic_photo(seed) for seed in range(_NUM_PHOTO_VARIANTS)]
+    hashes = [hashlib.sha256(content).hexdigest() for content, _, _ in variants]
+    files = {}
+
+    os.makedirs(dataset_folder, exist_ok=True)
+    shutil.copy(os.path.join(source_folder, _LABEL_MAP_FILE), dataset_folder)
+
+    for country_code, data in _read_countries(source_folder, countries).items():
+        country_folder = os.path.join(dataset_folder, country_code)
+        num_photos = scale * len(data['photos'] or [])
+        photos = []
+
+        os.makedirs(country_folder, exist_ok=True)
+
+        for i in range(num_photos):
+            filename = f'{country_code}_{i:05}.jpg'
+            path = f'/photos/{country_code}/{filename}'
+            variant = len(files) % _NUM_PHOTO_VARIANTS
+            content, (width, height), bounding_box = variants[variant]
+
+            files[path] = content
+            photos.append({
+                'author': _BENCHMARK_AUTHOR,
+                'download_url': base_url + path,
+                'downloader': 'url_image',
+                'filename': filename,
+                'license': 'CC0 1.0',
+                'sha256': hashes[variant],
+                'size': len(content),
+                'url': base_url + path
+            })
+            write_voc_annotation(VocAnnotation(folder=country_code,
+                                               filename=filename,
+                                               width=width,
+                                               height=height,
+                                               depth=3,
+                                               objects=[VocObject(country_code, *bounding_box)]),
+                                 os.path.join(country_folder, filename[:-3] + 'xml'))
+
+        data['photos'] = photos or None
+
+        with open(os.path.join(country_folder, 'credits.yml'), 'w') as yaml_file:
+            yaml.dump(data, yaml_file, default_flow_style=False, allow_unicode=True, width=4096)
+
+    return files
+
+
+def create_sparql_bindings(scale: int, source_folder: str = config.DATASET_FOLDER) -> list:
+    """
+    Creates countries of the given dataset, repeated scale times with
+    distinct codes, in the form of Wikidata endpoint results.
+    """
+
+    countries = [data['country'] for data in _read_countries(source_folder).values()]
+    bindings = []
+
+    for i in range(scale):
+        for country in countries:
+            code = country['code'] if i == 0 else f'{country["code"]}{i}'
+
+            bindings.append({'code': {'value': code},
+                             'countryLabel': {'value': country['name']},
+                             'flag': {'value': country['flag']},
+                             'flagImage': {'value': 'http://commons.wikimedia.org/wiki/Special:FilePath/'
+                                                    f'Flag%20of%20{code}.svg'}})
+
+    return bindings
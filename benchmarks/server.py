@@ -0,0 +1,128 @@
+import hashlib
+import json
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict
+
+_SPARQL_PATH = '/sparql'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is not available on Python 3.6
+    daemon_threads = True
+
+    # many downloads connect at once
+    request_queue_size = 128
+
+
+class BenchmarkServer:
+    """
+    A local HTTP server which stands in for photo hosts and the Wikidata
+    endpoint during benchmarks. Files are served by URL path with HTTP range
+    requests (open-ended or bounded), and countries are served as a canned
+    SPARQL result with an ETag.
+
+    The server listens as soon as it is created, so its URL is known before
+    files are added, but it serves them from a separate process (which
+    handles every request in its own thread) once it is started. Then it
+    does not compete with the benchmarked code for the GIL, and files or
+    countries changed after the start are not served.
+    """
+
+    def __init__(self, files: Dict[str, bytes] = None, sparql_bindings: list = None):
+        self.files = files or {}
+        self.set_sparql_bindings(sparql_bindings or [])
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections alive between requests, like photo hosts do
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if self.path.split('?')[0] == _SPARQL_PATH:
+                    self._send_sparql()
+                elif self.path in server.files:
+                    self._send_file(server.files[self.path])
+                else:
+                    self.send_error(404)
+
+            def _send_sparql(self):
+                if self.headers.get('If-None-Match') == server._sparql_etag:
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self._send(200, server._sparql_content, 'application/sparql-results+json',
+                           {'ETag': server._sparql_etag})
+
+            def _send_file(self, content: bytes):
+                range_header = self.headers.get('Range')
+
+                if range_header:
+                    start, end = range_header[len('bytes='):].split('-')
+                    start, end = int(start), min(int(end) + 1 if end else len(content), len(content))
+
+                    if start >= len(content):
+                        self._send(416, b'', 'image/jpeg')
+                        return
+
+                    self._send(206, content[start:end], 'image/jpeg',
+                               {'Content-Range': f'bytes {start}-{end - 1}/{len(content)}'})
+                else:
+                    self._send(200, content, 'image/jpeg')
+
+            def _send(self, status: int, content: bytes, content_type: str, headers: dict = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._process = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    @property
+    def sparql_url(self) -> str:
+        return self.base_url + _SPARQL_PATH
+
+    def set_sparql_bindings(self, bindings: list):
+        """
+        Replaces the countries served by the SPARQL endpoint stub.
+
+        :param bindings: results in the form of Wikidata endpoint results
+        """
+
+        self._sparql_content = json.dumps({'results': {'bindings': bindings}}).encode('utf-8')
+        self._sparql_etag = f'"{hashlib.sha1(self._sparql_content).hexdigest()}"'
+
+    def start(self):
+        self._process = multiprocessing.Process(target=self._server.serve_forever, daemon=True)
+        self._process.start()
+
+    def close(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
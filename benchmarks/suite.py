@@ -0,0 +1,336 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from typing import Callable, List
+
+import config
+from benchmarks.fixtures import create_dataset, create_sparql_bindings
+from benchmarks.server import BenchmarkServer
+from download.archive import build_archives, fetch_archives
+from download.download_dataset import PhotoItem, download_photos, download_photos_async
+from download.scheduler import HostLimits
+from flagnet.__main__ import SUBCOMMANDS
+from utils import country
+from utils.credits import create_all_markdowns
+from utils.manifest import Manifest
+from utils.validate import validate_dataset
+
+_RESULTS_VERSION = 1
+
+_IMPORT_TIME_SCRIPT = """\
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+BenchmarkResult = namedtuple('BenchmarkResult', ['stage', 'scale', 'num_items', 'seconds'])
+BenchmarkComparison = namedtuple('BenchmarkComparison', ['stage', 'scale', 'old_seconds', 'new_seconds', 'ratio'])
+
+
+def _measure(run: Callable[[], int], setup: Callable[[], None] = None, repeat: int = 1):
+    """
+    Runs a benchmarked function a number of times and keeps the fastest run,
+    which is the least disturbed by other processes.
+
+    :param run: a function which returns number of items it processed
+    :param setup: a function which prepares every run and is not measured
+    :param repeat: number of runs
+    :return: number of processed items and the time of the fastest run in
+    seconds
+    """
+
+    num_items, best_seconds = 0, float('inf')
+
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        num_items = run()
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+
+    return num_items, best_seconds
+
+
+@contextlib.contextmanager
+def _quiet():
+    # downloaders print a line for every photo
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _benchmark_downloads(dataset_folder: str, work_folder: str, repeat: int) -> list:
+    photo_paths = f'{dataset_folder}/*/*.jpg'
+    archives_folder = os.path.join(work_folder, 'archives')
+    manifest = None
+
+    def build_manifest():
+        nonlocal manifest
+        manifest = Manifest.build(dataset_folder)
+        return len(manifest)
+
+    def remove_photos():
+        for path in glob.glob(photo_paths):
+            os.remove(path)
+
+    def download(engine: Callable[..., None]) -> Callable[[], int]:
+        def run():
+            items = [PhotoItem(downloader=image.downloader,
+                               download_url=image.download_url,
+                               path=manifest.path(image),
+                               sha256=image.sha256,
+                               size=image.size)
+                     for image in manifest]
+
+            # all photos come from the local server, which is not rate limited
+            with _quiet():
+                engine(items, limits=HostLimits(rate=None))
+
+            # failed downloads are only reported, so count what arrived
+            return len(glob.glob(photo_paths))
+
+        return run
+
+    def build():
+        return build_archives(dataset_folder, archives_folder, manifest_path=os.path.join(work_folder, 'manifest.json'))
+
+    def fetch():
+        with _quiet():
+            return fetch_archives(archives_folder, dataset_folder).num_extracted
+
+    return [
+        ('manifest_build',) + _measure(build_manifest, repeat=repeat),
+        ('download_threads',) + _measure(download(download_photos), setup=remove_photos, repeat=repeat),
+        ('download_async',) + _measure(download(download_photos_async), setup=remove_photos, repeat=repeat),
+        # all photos are in place, so they are only verified against their hashes
+        ('download_verify',) + _measure(download(download_photos_async), repeat=repeat),
+        ('archive_build',) + _measure(build, repeat=repeat),
+        ('archive_fetch',) + _measure(fetch, setup=remove_photos, repeat=repeat)
+    ]
+
+
+def _benchmark_validation(dataset_folder: str, work_folder: str, repeat: int) -> list:
+    cache_path = os.path.join(work_folder, 'validation.json')
+
+    def validate(path: str = None) -> Callable[[], int]:
+        def run():
+            validate_dataset(dataset_folder, cache_path=path)
+            return len(glob.glob(f'{dataset_folder}/*/*.jpg'))
+
+        return run
+
+    return [
+        ('validate',) + _measure(validate(), repeat=repeat),
+        ('validate_cached',) + _measure(validate(cache_path), setup=validate(cache_path), repeat=repeat)
+    ]
+
+
+def _benchmark_credits(dataset_folder: str, work_folder: str, repeat: int) -> list:
+    num_countries = len(glob.glob(f'{dataset_folder}/*/credits.yml'))
+    manifest_path = os.path.join(work_folder, 'manifest.json')
+
+    def render(forced: bool) -> Callable[[], int]:
+        def run():
+            create_all_markdowns(dataset_folder, forced=forced, manifest_path=manifest_path)
+            return num_countries
+
+        return run
+
+    return [
+        ('credits_render',) + _measure(render(True), repeat=repeat),
+        ('credits_up_to_date',) + _measure(render(False), repeat=repeat)
+    ]
+
+
+def _benchmark_countries(server: BenchmarkServer, work_folder: str, repeat: int) -> list:
+    cache_path = os.path.join(work_folder, 'countries.json')
+    shared_registry = country._registry
+
+    def use_registry():
+        # load_countries goes through the registry shared by the process
+        country._registry = country.CountryRegistry(server.sparql_url, cache_path, refresh_interval=0)
+
+    def fetch():
+        return len(country.load_countries(forced=True))
+
+    def load_cached():
+        use_registry()
+        return len(country.load_countries())
+
+    def refresh_not_modified():
+        country.get_registry().refresh()
+        return len(country.get_registry())
+
+    try:
+        use_registry()
+
+        return [
+            ('countries_fetch',) + _measure(fetch, repeat=repeat),
+            ('countries_cached',) + _measure(load_cached, repeat=repeat),
+            ('countries_not_modified',) + _measure(refresh_not_modified, setup=use_registry, repeat=repeat)
+        ]
+    finally:
+        country._registry = shared_registry
+
+
+def measure_import_time(module: str, repeat: int = 1) -> float:
+    """
+    Measures how long a module takes to import in a fresh interpreter, i.e.
+    the cold start cost of the module and its dependencies.
+
+    :param module: a name of the module
+    :param repeat: number of interpreters started (the fastest one is kept)
+    :return: the import time in seconds
+    """
+
+    script = _IMPORT_TIME_SCRIPT.format(module=module)
+
+    return min(float(subprocess.check_output([sys.executable, '-c', script], cwd=config.PROJECT_ROOT or '.'))
+               for _ in range(repeat))
+
+
+def run_startup_benchmarks(repeat: int = 5) -> List[BenchmarkResult]:
+    """
+    Measures import times of the flagnet entry point and of the module of
+    every subcommand (see: flagnet.__main__).
+
+    :param repeat: number of measurements of every module
+    :return: results of import_<subcommand> stages
+    """
+
+    modules = [('flagnet', 'flagnet.__main__')] + [(name, module) for name, (module, _) in SUBCOMMANDS.items()]
+    results = []
+
+    for name, module in modules:
+        results.append(BenchmarkResult(f'import_{name}', 1, 1, measure_import_time(module, repeat)))
+        print(f'{results[-1].stage:>24}: {results[-1].seconds * 1000:8.1f} ms', file=sys.stderr)
+
+    return results
+
+
+def run_benchmarks(scales: List[int] = config.BENCHMARK_SCALES, repeat: int = 1, countries: List[str] = None,
+                   work_folder: str = None) -> List[BenchmarkResult]:
+    """
+    Measures downloading, validation, photo credits rendering and country
+    loading on synthetic datasets laid out like the dataset, scaled by every
+    given factor. Photos and countries are served by a local HTTP server, so
+    no benchmark touches the network.
+
+    :param scales: numbers of synthetic photos per photo of the dataset
+    :param repeat: number of runs of every stage (the fastest one is kept)
+    :param countries: lowercase codes of countries to benchmark (all if None)
+    :param work_folder: a folder where synthetic datasets are created (if
+    None, a temporary folder in the cache folder is used)
+    :return: results of every stage for every scale
+    """
+
+    results = []
+
+    if work_folder is None:
+        os.makedirs(config.CACHE_FOLDER, exist_ok=True)
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory(dir=work_folder or config.CACHE_FOLDER) as scale_folder:
+            dataset_folder = os.path.join(scale_folder, 'dataset')
+            server = BenchmarkServer(sparql_bindings=create_sparql_bindings(scale))
+            server.files = create_dataset(dataset_folder, server.base_url, scale, countries=countries)
+
+            with server:
+                stage_results = (_benchmark_downloads(dataset_folder, scale_folder, repeat)
+                                 + _benchmark_validation(dataset_folder, scale_folder, repeat)
+                                 + _benchmark_credits(dataset_folder, scale_folder, repeat)
+                                 + _benchmark_countries(server, scale_folder, repeat))
+
+            for stage, num_items, seconds in stage_results:
+                results.append(BenchmarkResult(stage, scale, num_items, seconds))
+                print(f'{stage:>24} {scale:>4}x: {num_items:>8} items in {seconds:8.3f}s '
+                      f'({num_items / max(seconds, 1e-9):10.1f} items/s)', file=sys.stderr)
+
+    return results
+
+
+def save_results(results: List[BenchmarkResult], path: str):
+    """
+    Saves benchmark results as a JSON file, together with the environment
+    they were measured in.
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with open(path, 'w') as file:
+        json.dump({
+            'version': _RESULTS_VERSION,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': [result._asdict() for result in results]
+        }, file, indent=2)
+
+
+def load_results(path: str) -> List[BenchmarkResult]:
+    with open(path) as file:
+        return [BenchmarkResult(**result) for result in json.load(file)['results']]
+
+
+def compare_results(old_results: List[BenchmarkResult],
+                    new_results: List[BenchmarkResult]) -> List[BenchmarkComparison]:
+    """
+    Compares times of stages measured in both runs at the same scale.
+
+    :return: comparisons with the ratio of the new time to the old time (a
+    ratio above 1 is a slowdown)
+    """
+
+    old_seconds = {(result.stage, result.scale): result.seconds for result in old_results}
+
+    return [BenchmarkComparison(result.stage, result.scale, old_seconds[result.stage, result.scale], result.seconds,
+                                result.seconds / max(old_seconds[result.stage, result.scale], 1e-9))
+            for result in new_results if (result.stage, result.scale) in old_seconds]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the dataset pipeline against a local HTTP server.')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(config.BENCHMARK_SCALES),
+                        help='numbers of synthetic photos per photo of the dataset')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of every stage')
+    parser.add_argument('--countries', nargs='+', help='lowercase codes of countries to benchmark')
+    parser.add_argument('--startup-only', action='store_true',
+                        help='only measure import times of flagnet subcommands')
+    parser.add_argument('--output', default=os.path.join(config.BENCHMARKS_FOLDER,
+                                                         time.strftime('%Y%m%d-%H%M%S') + '.json'),
+                        help='a path to the JSON file with results')
+    parser.add_argument('--compare', help='a JSON file with results of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio of times above which a stage is reported as a regression')
+    args = parser.parse_args()
+
+    # cold start is measured several times even in a single run, since it
+    # is short and noisy
+    benchmark_results = run_startup_benchmarks(repeat=max(args.repeat, 5))
+
+    if not args.startup_only:
+        benchmark_results += run_benchmarks(args.scales, repeat=args.repeat, countries=args.countries)
+
+    save_results(benchmark_results, args.output)
+    print(f'Saved results to {args.output}')
+
+    if args.compare:
+        regressions = 0
+
+        for comparison in compare_results(load_results(args.compare), benchmark_results):
+            regressed = comparison.ratio > args.threshold
+            regressions += regressed
+            print(f'{comparison.stage:>24} {comparison.scale:>4}x: {comparison.old_seconds:8.3f}s -> '
+                  f'{comparison.new_seconds:8.3f}s ({comparison.ratio:5.2f}x){" REGRESSION" if regressed else ""}')
+
+        sys.exit(1 if regressions else 0)
@@ -5,11 +5,150 @@ PROJECT_ROOT = os.path.dirname(__file__)
 DATASET_FOLDER = os.path.join(PROJECT_ROOT, 'dataset')
 CACHE_FOLDER = os.path.join(PROJECT_ROOT, '.cache')
 
-# minimum size of images in the dataset
+# number of seconds after which the list of countries is requested from Wikidata again (see: utils.country)
+COUNTRIES_REFRESH_INTERVAL = 7 * 24 * 60 * 60
+
+# timeout in seconds of requesting countries from Wikidata, after which the cached countries are used
+COUNTRIES_REQUEST_TIMEOUT = 30
+
+# minimum size of images in the dataset (and the size of images fed to the network)
 MIN_IMAGE_SIZE = 416, 416
 
+# folder where images resized to the minimum size are cached (see: utils.image_cache)
+IMAGE_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'images')
+
+# number of parallel workers when decoding and resizing images of the dataset
+NUM_IMAGE_CACHE_WORKERS = os.cpu_count() or 1
+
+# number of images in a training batch (see: utils.loader)
+LOADER_BATCH_SIZE = 16
+
+# number of parallel workers decoding and augmenting training batches
+NUM_LOADER_WORKERS = os.cpu_count() or 1
+
+# maximum number of training batches loaded ahead of the training loop
+LOADER_PREFETCH = 4
+
+# folder where the packed dataset shards are written (see: utils.pack)
+PACKED_DATASET_FOLDER = os.path.join(CACHE_FOLDER, 'packed')
+
+# size in bytes after which a new packed dataset shard is started
+PACKED_SHARD_SIZE = 64 * 1024 * 1024
+
+# fractions of images of every country and source (real or synthetic) in validation and test splits (see: utils.splits)
+VALIDATION_SPLIT_FRACTION = 0.1
+TEST_SPLIT_FRACTION = 0.1
+
+# folder where PNG flag images from Wikimedia Commons are cached (see: utils.synthesize)
+FLAG_IMAGES_FOLDER = os.path.join(CACHE_FOLDER, 'flags')
+
+# size of images of waving flags rendered without a browser
+SYNTHETIC_IMAGE_SIZE = 800, 600
+
+# number of rendered images of waving flags of every country
+NUM_SYNTHETIC_IMAGES = 20
+
+# number of parallel workers when rendering images of waving flags
+NUM_SYNTHESIS_WORKERS = os.cpu_count() or 1
+
+# number of parallel workers when validating the dataset
+NUM_VALIDATION_WORKERS = os.cpu_count() or 1
+
+# perceptual hash near-duplicate images are found by, 'dhash' or 'phash' (see: utils.phash)
+DUPLICATE_HASH_TYPE = 'phash'
+
+# maximum Hamming distance between 64-bit hashes of near-duplicate images
+DUPLICATE_HAMMING_RADIUS = 6
+
+# number of parallel workers when hashing images of the dataset
+NUM_PHASH_WORKERS = os.cpu_count() or 1
+
 # size of generated images from Flagwaver website
 SCREENSHOT_IMAGE_SIZE = 800, 600
 
+# number of browser instances taking screenshots from Flagwaver website in parallel
+NUM_SCREENSHOT_WORKERS = 4
+
+# number of pages a browser instance loads before it is restarted (keeps browser memory leaks bounded)
+SCREENSHOT_DRIVER_MAX_PAGES = 60
+
+# how to wait for Flagwaver before taking a screenshot: 'ready' polls the page until the flag image is loaded and
+# rendered frames stop changing, 'fixed' always waits for SCREENSHOT_TIMEOUT seconds
+SCREENSHOT_WAIT_MODE = 'ready'
+
+# maximum time in seconds to wait for Flagwaver to render the flag before taking a screenshot
+SCREENSHOT_TIMEOUT = 6
+
+# wind directions (in degrees) and flag top edges every flag is rendered with on Flagwaver website
+SCREENSHOT_WIND_DIRECTIONS = 90, 270
+SCREENSHOT_FLAG_TOP_EDGES = 'top', 'left', 'right'
+
+# times in seconds after the flag is rendered when screenshots are taken (for every direction and top edge)
+SCREENSHOT_TIME_OFFSETS = 0,
+
+# take all screenshots of a flag in a single page session instead of reloading Flagwaver for every screenshot
+SCREENSHOT_BATCH_CAPTURE = True
+
+# label flags in taken screenshots by comparing them to a screenshot of Flagwaver without the flag
+SCREENSHOT_AUTOLABEL = True
+
+# how browsers capture screenshots: 'png' through WebDriver (encoded as JPEG afterwards), or 'jpeg' straight from the
+# DevTools protocol of Chrome (saved as it is)
+SCREENSHOT_CAPTURE_FORMAT = 'png'
+
+# JPEG quality of saved screenshots
+SCREENSHOT_QUALITY = 100
+
+# number of processes encoding and saving screenshots while browsers capture the next ones
+NUM_SCREENSHOT_ENCODERS = os.cpu_count() or 1
+
+# maximum number of captured screenshots waiting for encoding (capturing blocks when the queue is full)
+SCREENSHOT_ENCODER_QUEUE_SIZE = 32
+
 # number of parallel workers when downloading the dataset
 NUM_DOWNLOAD_WORKERS = 8
+
+# maximum number of downloads in flight when downloading the dataset with the asyncio engine
+NUM_DOWNLOADS_IN_FLIGHT = 256
+
+# maximum number of downloads in flight to a single host when downloading the dataset
+NUM_CONNECTIONS_PER_HOST = 8
+
+# maximum number of requests per second to a single host when downloading the dataset (see: download.scheduler)
+DOWNLOAD_RATE_PER_HOST = 20
+
+# number of requests to a single host which can be sent at once, before the rate applies
+DOWNLOAD_BURST_PER_HOST = 20
+
+# requests per second to hosts which allow a different rate than DOWNLOAD_RATE_PER_HOST
+DOWNLOAD_HOST_RATES = {'upload.wikimedia.org': 10}
+
+# maximum number of retries of a failed download (connection errors, timeouts, throttling and server errors)
+DOWNLOAD_MAX_RETRIES = 5
+
+# upper bounds in seconds of the random delay before the first retry, and of every retry after it (the bound doubles
+# with every retry)
+DOWNLOAD_BACKOFF_BASE = 1
+DOWNLOAD_BACKOFF_MAX = 60
+
+# timeouts in seconds of connecting to a host and of reading from it, after which a download is retried
+DOWNLOAD_CONNECT_TIMEOUT = 10
+DOWNLOAD_READ_TIMEOUT = 30
+
+# folder where tar archives of the downloaded dataset are written (see: download.archive)
+ARCHIVES_FOLDER = os.path.join(CACHE_FOLDER, 'archives')
+
+# size in bytes after which a new archive shard is started
+ARCHIVE_SHARD_SIZE = 64 * 1024 * 1024
+
+# maximum number of bytes of up-to-date photos read through to extract two missing photos of a shard in one request
+ARCHIVE_MAX_RANGE_GAP = 1024 * 1024
+
+# size in bytes of chunks downloaded images are written in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# folder where benchmark results are saved (see: benchmarks.suite)
+BENCHMARKS_FOLDER = os.path.join(CACHE_FOLDER, 'benchmarks')
+
+# sizes of synthetic benchmark datasets, relative to the size of the dataset
+BENCHMARK_SCALES = 1, 10, 100
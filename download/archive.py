@@ -0,0 +1,341 @@
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+from collections import namedtuple
+from typing import Iterator, List, Tuple
+
+import requests
+
+import config
+from download.image_dowloader import CorruptImageException, compute_sha256
+from utils.manifest import Manifest
+
+ARCHIVE_INDEX_FILE = 'index.json'
+_ARCHIVE_SHARD_FILE = 'shard-{:05}.tar'
+_ARCHIVE_INDEX_VERSION = 1
+
+_HTTP_PARTIAL_CONTENT = 206
+
+# names of shards and members the index may list, so an index from an
+# untrusted location can neither read nor write outside of its folders
+_SHARD_NAME_PATTERN = re.compile(r'shard-\d{5}\.tar')
+_MEMBER_NAME_PATTERN = re.compile(r'[a-z]{2}/[A-Za-z0-9_-]+\.jpg')
+
+ArchiveMember = namedtuple('ArchiveMember', ['name', 'shard', 'offset', 'size', 'sha256'])
+FetchResult = namedtuple('FetchResult', ['num_members', 'num_extracted', 'num_requests', 'num_bytes', 'failed'])
+
+
+def build_archives(dataset_folder: str = config.DATASET_FOLDER, output_folder: str = config.ARCHIVES_FOLDER,
+                   shard_size: int = config.ARCHIVE_SHARD_SIZE, manifest_path: str = None) -> int:
+    """
+    Archives all downloaded photos of the dataset into tar shards of the
+    given size, sorted by country, with a central index of the offset, size
+    and SHA-256 hash of every photo within its shard. Shards are plain tar
+    files (they can be extracted with tar), and the index lets the fetcher
+    read single photos out of them.
+
+    :param dataset_folder: a path to the dataset folder
+    :param output_folder: a path to the folder where shards and the index
+    are written
+    :param shard_size: size in bytes after which a new shard is started
+    :param manifest_path: a path to the manifest file of the dataset (if
+    None, the manifest in the cache folder is used)
+    :return: number of archived photos
+    """
+
+    if shard_size <= 0:
+        raise ValueError(f'Shard size has to be a positive number, passed {shard_size}')
+
+    manifest = Manifest.load(dataset_folder, manifest_path)
+    images = sorted((image for image in manifest if os.path.isfile(manifest.path(image))),
+                    key=lambda image: (image.country, image.filename))
+
+    # remove shards of the previous build
+    os.makedirs(output_folder, exist_ok=True)
+
+    for path in glob.glob(f'{output_folder}/shard-*.tar'):
+        os.remove(path)
+
+    shards = []
+    members = []
+    shard_file = None
+
+    def close_shard():
+        shard_file.close()
+        path = f'{output_folder}/{_ARCHIVE_SHARD_FILE.format(len(shards))}'
+        shards.append({'name': os.path.basename(path), 'size': os.path.getsize(path)})
+
+    for image in images:
+        if shard_file is not None and shard_file.offset >= shard_size:
+            close_shard()
+            shard_file = None
+
+        if shard_file is None:
+            shard_file = tarfile.open(f'{output_folder}/{_ARCHIVE_SHARD_FILE.format(len(shards))}', 'w',
+                                      format=tarfile.PAX_FORMAT)
+
+        name = f'{image.country}/{image.filename}'
+
+        with open(manifest.path(image), 'rb') as image_file:
+            content = image_file.read()
+
+        # members carry no timestamps or owners, so archives of the same
+        # photos are identical
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size = len(content)
+        shard_file.addfile(tar_info, io.BytesIO(content))
+
+        # the content ends the member, padded to whole tar blocks
+        offset = shard_file.offset - -(-len(content) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        members.append([name, len(shards), offset, len(content), hashlib.sha256(content).hexdigest()])
+
+    if shard_file is not None:
+        close_shard()
+
+    with open(f'{output_folder}/{ARCHIVE_INDEX_FILE}', 'w') as file:
+        json.dump({'version': _ARCHIVE_INDEX_VERSION, 'shards': shards, 'members': members}, file)
+
+    return len(images)
+
+
+def _is_url(location: str) -> bool:
+    return location.startswith(('http://', 'https://'))
+
+
+def _read_index(location: str, dataset_folder: str) -> Tuple[List[str], List[ArchiveMember]]:
+    """
+    Reads the index of archives from a local folder or a URL, and checks
+    that every shard is a file of the archives folder and every member is a
+    photo of a country folder of the dataset.
+
+    :param location: a path to the folder of archives, or its URL
+    :param dataset_folder: a path to the dataset folder members are
+    extracted to
+    :return: names of shards, and members of all shards
+    """
+
+    if _is_url(location):
+        response = requests.get(f'{location.rstrip("/")}/{ARCHIVE_INDEX_FILE}',
+                                timeout=(config.DOWNLOAD_CONNECT_TIMEOUT, config.DOWNLOAD_READ_TIMEOUT))
+        response.raise_for_status()
+        index = response.json()
+    else:
+        with open(os.path.join(location, ARCHIVE_INDEX_FILE)) as file:
+            index = json.load(file)
+
+    if index.get('version') != _ARCHIVE_INDEX_VERSION:
+        raise ValueError(f'Unsupported archive index version {index.get("version")} in {location}')
+
+    shards = [shard['name'] for shard in index['shards']]
+    members = [ArchiveMember(*member) for member in index['members']]
+    dataset_path = os.path.realpath(dataset_folder)
+
+    for shard in shards:
+        if not _SHARD_NAME_PATTERN.fullmatch(str(shard)):
+            raise ValueError(f'Invalid shard name {shard!r} in the archive index of {location}')
+
+    for member in members:
+        path = os.path.realpath(os.path.join(dataset_folder, str(member.name)))
+        inside_dataset = os.path.commonpath([dataset_path, path]) == dataset_path
+
+        if not (_MEMBER_NAME_PATTERN.fullmatch(str(member.name)) and inside_dataset
+                and isinstance(member.shard, int) and 0 <= member.shard < len(shards)):
+            raise ValueError(f'Invalid member {member.name!r} in the archive index of {location}')
+
+    return shards, members
+
+
+def _read_range(location: str, shard: str, start: int, end: int) -> Iterator[bytes]:
+    """
+    Reads a range of bytes of a shard in chunks, from a local file or with
+    an HTTP range request.
+
+    :param location: a path to the folder of archives, or its URL
+    :param shard: a name of the shard
+    :param start: the first byte of the range
+    :param end: the byte after the last byte of the range
+    :return: an iterator of chunks of the range
+    """
+
+    if not _is_url(location):
+        with open(os.path.join(location, shard), 'rb') as file:
+            file.seek(start)
+
+            while start < end:
+                chunk = file.read(min(config.DOWNLOAD_CHUNK_SIZE, end - start))
+
+                if not chunk:
+                    raise CorruptImageException(f'Archive {shard} is shorter than its index')
+
+                start += len(chunk)
+                yield chunk
+
+        return
+
+    with requests.get(f'{location.rstrip("/")}/{shard}', headers={'Range': f'bytes={start}-{end - 1}'}, stream=True,
+                      timeout=(config.DOWNLOAD_CONNECT_TIMEOUT, config.DOWNLOAD_READ_TIMEOUT)) as response:
+        response.raise_for_status()
+
+        if response.status_code != _HTTP_PARTIAL_CONTENT:
+            raise requests.HTTPError(f'{location} does not serve range requests (HTTP {response.status_code})',
+                                     response=response)
+
+        yield from response.iter_content(config.DOWNLOAD_CHUNK_SIZE)
+
+
+class _ChunkReader:
+    """
+    Reads exact numbers of bytes from an iterator of chunks.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, size: int) -> Iterator[bytes]:
+        while size > 0:
+            if not self._buffer:
+                self._buffer = next(self._chunks, b'')
+
+                if not self._buffer:
+                    raise CorruptImageException('Archive range ended before all of its members were read')
+
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+            size -= len(chunk)
+            yield chunk
+
+
+def _is_up_to_date(path: str, member: ArchiveMember) -> bool:
+    return os.path.isfile(path) and os.path.getsize(path) == member.size and compute_sha256(path) == member.sha256
+
+
+def _group_ranges(members: List[ArchiveMember], max_gap: int) -> List[List[ArchiveMember]]:
+    """
+    Groups members of a shard, sorted by offset, into ranges which are read
+    in a single request. Members are read in the same range if the gap
+    between them is at most max_gap bytes, since reading through a small gap
+    is faster than another request.
+    """
+
+    groups = []
+
+    for member in members:
+        if groups and member.offset - (groups[-1][-1].offset + groups[-1][-1].size) <= max_gap:
+            groups[-1].append(member)
+        else:
+            groups.append([member])
+
+    return groups
+
+
+def _extract_member(reader: _ChunkReader, member: ArchiveMember, path: str) -> bool:
+    """
+    Writes a member from the reader to its path, if it matches its SHA-256
+    hash. The member is written to a temporary file first, which is removed
+    if the member does not match or cannot be read.
+
+    :return: an indicator whether the member was extracted
+    """
+
+    temporary_path = f'{path}.part'
+    sha256 = hashlib.sha256()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    try:
+        with open(temporary_path, 'wb') as file:
+            for chunk in reader.read(member.size):
+                sha256.update(chunk)
+                file.write(chunk)
+    except Exception:
+        os.remove(temporary_path)
+        raise
+
+    if sha256.hexdigest() != member.sha256:
+        os.remove(temporary_path)
+        print(f'{member.name} does not match its SHA-256 hash in the archive index')
+        return False
+
+    os.replace(temporary_path, path)
+    print(f'Extracted {path}')
+
+    return True
+
+
+def fetch_archives(location: str, dataset_folder: str = config.DATASET_FOLDER,
+                   max_gap: int = config.ARCHIVE_MAX_RANGE_GAP) -> FetchResult:
+    """
+    Extracts photos which are missing from the dataset folder, or do not
+    match the archive index, from archives in a local folder or at a URL.
+    Only the needed parts of shards are read: members are grouped into
+    ranges (see: max_gap), and every range is read in one sequential pass
+    (a single HTTP range request) and extracted while it is read. A new
+    machine thus reads every shard in one request, instead of requesting
+    every photo on its own.
+
+    Members which are corrupt, or whose range cannot be read (from a local
+    or remote shard), are only reported, so they can be downloaded one by
+    one afterwards.
+
+    :param location: a path to the folder of archives, or its URL
+    :param dataset_folder: a path to the dataset folder
+    :param max_gap: maximum number of unneeded bytes between two members
+    which are read in the same range
+    :return: the number of members of the index and of extracted photos,
+    the number of reads (requests) and of bytes read, and names of members
+    which were not extracted
+    """
+
+    shards, members = _read_index(location, dataset_folder)
+    missing_members = [member for member in members
+                       if not _is_up_to_date(os.path.join(dataset_folder, member.name), member)]
+    num_extracted = num_requests = num_bytes = 0
+    failed = []
+
+    for shard, shard_name in enumerate(shards):
+        shard_members = sorted((member for member in missing_members if member.shard == shard),
+                               key=lambda member: member.offset)
+
+        for group in _group_ranges(shard_members, max_gap):
+            start, end = group[0].offset, group[-1].offset + group[-1].size
+            reader = _ChunkReader(_read_range(location, shard_name, start, end))
+            position = start
+            num_read = 0
+            num_requests += 1
+            num_bytes += end - start
+
+            try:
+                for member in group:
+                    for _ in reader.read(member.offset - position):
+                        pass
+
+                    if _extract_member(reader, member, os.path.join(dataset_folder, member.name)):
+                        num_extracted += 1
+                    else:
+                        failed.append(member.name)
+
+                    position = member.offset + member.size
+                    num_read += 1
+            except (CorruptImageException, requests.RequestException, OSError) as err:
+                # the rest of the range cannot be read (e.g. a local shard is
+                # missing)
+                print(f'Reading {shard_name} failed: {err!r}')
+                failed.extend(member.name for member in group[num_read:])
+
+    return FetchResult(num_members=len(members), num_extracted=num_extracted, num_requests=num_requests,
+                       num_bytes=num_bytes, failed=failed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archives downloaded photos of the dataset into tar shards.')
+    parser.add_argument('--output', default=config.ARCHIVES_FOLDER, help='a folder where shards are written')
+    parser.add_argument('--shard-size', type=int, default=config.ARCHIVE_SHARD_SIZE,
+                        help='size in bytes after which a new shard is started')
+    args = parser.parse_args()
+
+    num_photos = build_archives(output_folder=args.output, shard_size=args.shard_size)
+    print(f'Archived {num_photos} photos into {args.output}')
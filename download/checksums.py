@@ -0,0 +1,55 @@
+import argparse
+import glob
+import os
+
+import ruamel.yaml as yaml
+
+import config
+from download.image_dowloader import compute_sha256
+
+
+def add_checksums(credits_file_path: str, forced: bool = False) -> int:
+    """
+    Adds SHA-256 hash and size of every locally available photo to the photo
+    credits, so the downloader can verify existing photos and resume
+    interrupted downloads.
+
+    :param credits_file_path: a path to the credits.yml file of a country
+    :param forced: an indicator to recalculate hashes and sizes which are
+    already in the credits
+    :return: number of photos whose hash and size were added
+    """
+
+    with open(credits_file_path) as yaml_file:
+        data = yaml.load(yaml_file, Loader=yaml.Loader)
+
+    num_updated = 0
+
+    for photo_data in data['photos'] or []:
+        photo_path = os.path.join(os.path.dirname(credits_file_path), photo_data['filename'])
+
+        if not os.path.isfile(photo_path) or (not forced and 'sha256' in photo_data and 'size' in photo_data):
+            continue
+
+        photo_data['sha256'] = compute_sha256(photo_path)
+        photo_data['size'] = os.path.getsize(photo_path)
+        num_updated += 1
+
+    if num_updated:
+        with open(credits_file_path, 'w') as yaml_file:
+            yaml.dump(data, yaml_file, default_flow_style=False, allow_unicode=True, width=4096)
+
+    return num_updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adds SHA-256 hashes and sizes of downloaded photos to credits.')
+    parser.add_argument('--forced', action='store_true',
+                        help='recalculate hashes and sizes which are already in the credits')
+    args = parser.parse_args()
+
+    for photo_credits in sorted(glob.glob(f'{config.DATASET_FOLDER}/*/credits.yml')):
+        num_photos = add_checksums(photo_credits, forced=args.forced)
+
+        if num_photos:
+            print(f'Added checksums of {num_photos} photos to {photo_credits}')
@@ -1,53 +1,336 @@
-import glob
-from collections import namedtuple
+import argparse
+import asyncio
+import queue
+import sys
+import time
+from collections import defaultdict, namedtuple
 from multiprocessing.pool import ThreadPool
-
-import ruamel.yaml as yaml
+from typing import TYPE_CHECKING, List
 
 import config
+from download.archive import fetch_archives
+from download.image_dowloader import ThrottledException
+from download.metrics import DOWNLOADED, DownloadMetrics, DownloadResult, create_download_result
+from download.scheduler import HostLimits, HostScheduler, host_of, retry_delay
 from download.url_image_downloader import UrlImageDownloader
+from utils.manifest import Manifest
+
+if TYPE_CHECKING:
+    import aiohttp
 
-PhotoItem = namedtuple('PhotoItem', ['downloader', 'download_url', 'path'])
+PhotoItem = namedtuple('PhotoItem', ['downloader', 'download_url', 'path', 'sha256', 'size'])
+PhotoItem.__new__.__defaults__ = (None, None)
 
 DOWNLOADERS = {downloader.type: downloader for downloader in (UrlImageDownloader,)}
 
 
-def _download_single_photo(item: PhotoItem):
+class _PhotoDownload:
+    """
+    A download of a single photo over all its attempts. A failed attempt is
+    recorded instead of raised, so it does not stop other downloads.
+    """
+
+    def __init__(self, item: PhotoItem):
+        """
+        :param item: a tuple which contains downloader name, download URL,
+        local path, and optionally the expected SHA-256 hash and size of the
+        photo
+        """
+
+        self.item = item
+        self.host = host_of(item.download_url)
+        self.downloader = DOWNLOADERS[item.downloader](item.download_url, item.path, sha256=item.sha256, size=item.size)
+        self.downloaded = False
+        self.error = None
+
+        # the clock starts with every attempt, once the download got its
+        # connection and its turn of the rate limit, so waiting in a queue is
+        # not measured as latency
+        self.started_at = None
+        self.seconds = 0.0
+        self._first_start = None
+
+    @property
+    def throttled(self) -> bool:
+        return isinstance(self.error, ThrottledException)
+
+    def _start_attempt(self) -> float:
+        self.started_at, start = time.time(), time.perf_counter()
+
+        if self._first_start is None:
+            self._first_start = start
+
+        return start
+
+    def skip(self) -> bool:
+        """
+        Finishes the download without a request if the photo is already
+        downloaded and valid, so it does not wait for the rate limit of its
+        host. The photo is checked before the first attempt only.
+
+        :return: an indicator whether the download was skipped
+        """
+
+        if self._first_start is not None:
+            return False
+
+        start = self._start_attempt()
+
+        try:
+            skipped = self.downloader.is_downloaded()
+        except OSError:
+            # the photo cannot be read, so the attempt replaces it
+            skipped = False
+
+        self.seconds = time.perf_counter() - start
+
+        if skipped:
+            print(f'Download of {self.item.path} is skipped')
+
+        return skipped
+
+    def attempt(self):
+        start = self._start_attempt()
+
+        try:
+            self.downloaded, self.error = self.downloader.download(), None
+        except Exception as err:
+            self.downloaded, self.error = False, err
+
+        self.seconds = time.perf_counter() - start
+
+    async def attempt_async(self, session: 'aiohttp.ClientSession'):
+        start = self._start_attempt()
+
+        try:
+            self.downloaded, self.error = await self.downloader.download_async(session), None
+        except Exception as err:
+            self.downloaded, self.error = False, err
+
+        self.seconds = time.perf_counter() - start
+
+    def next_retry(self) -> float:
+        """
+        Decides whether the last failed attempt is retried (see:
+        download.scheduler.retry_delay).
+
+        :return: number of seconds to wait before the next attempt, or None
+        if the download is finished
+        """
+
+        delay = retry_delay(self.error, self.downloader.num_retries)
+
+        if delay is not None:
+            print(f'Download of {self.item.path} failed: {self.error!r}, retrying in {delay:.1f}s')
+            self.downloader.num_retries += 1
+        elif self.error is not None:
+            print(f'Download of {self.item.path} failed: {self.error!r}')
+
+        return delay
+
+    def result(self) -> DownloadResult:
+        return create_download_result(self.downloader, self.downloaded, self.started_at, self.seconds,
+                                      total_seconds=time.perf_counter() - self._first_start, error=self.error)
+
+
+def load_photo_items(dataset_folder: str = config.DATASET_FOLDER) -> List[PhotoItem]:
+    """
+    Returns a list of photos which make the dataset, from the manifest of
+    the dataset.
+
+    :param dataset_folder: a path to the dataset folder
+    :return: a list of photo items with downloader name, download URL, local
+    path, and the expected SHA-256 hash and size (if known) of every photo
+    """
+
+    manifest = Manifest.load(dataset_folder)
+
+    return [PhotoItem(downloader=image.downloader,
+                      download_url=image.download_url,
+                      path=manifest.path(image),
+                      sha256=image.sha256,
+                      size=image.size)
+            for image in manifest]
+
+
+def download_photos(photo_items: List[PhotoItem], num_workers: int = config.NUM_DOWNLOAD_WORKERS,
+                    num_connections_per_host: int = config.NUM_CONNECTIONS_PER_HOST, limits: HostLimits = None,
+                    metrics: DownloadMetrics = None) -> List[DownloadResult]:
     """
-    Downloads a single photo with the given downloader, the URL to download
-    from and the local path where to store the downloaded photo.
+    Downloads photos in parallel on a pool of threads, one download per
+    thread at a time. Downloads are scheduled by host (see:
+    download.scheduler.HostScheduler), so every host gets at most its number
+    of connections and requests per second, and failed downloads are
+    retried with backoff.
 
-    :param item: a tuple which contains downloader name, download URL and
-    local path
+    :param photo_items: photos to download
+    :param num_workers: number of threads
+    :param num_connections_per_host: maximum number of downloads in flight
+    to a single host
+    :param limits: rate limits of hosts (if None, the configured ones)
+    :param metrics: metrics which record the result of every download
+    :return: results of all downloads, in the order they finished
     """
 
-    downloader = DOWNLOADERS[item.downloader](item.download_url, item.path)
-    downloader.download()
+    downloads = [_PhotoDownload(item) for item in photo_items]
+    scheduler = HostScheduler(downloads, lambda download: download.item.download_url,
+                              max_connections=num_connections_per_host, limits=limits)
+    finished = queue.Queue()
+    results = []
+
+    def work(_):
+        try:
+            while True:
+                download = scheduler.acquire()
+
+                if download is None:
+                    return
+
+                # photos which are already downloaded are finished without
+                # taking a token of their host
+                if download.skip():
+                    delay = None
+                else:
+                    time.sleep(scheduler.reserve(download))
+                    download.attempt()
+                    delay = download.next_retry()
+
+                scheduler.release(download, retry_in=delay, throttled=download.throttled)
+
+                if delay is None:
+                    finished.put(download.result())
+        except Exception as err:
+            # failed attempts are recorded by downloads, so this is a bug
+            # which is raised in the main thread instead of leaving it to
+            # wait for results forever
+            scheduler.cancel()
+            finished.put(err)
+
+    with ThreadPool(num_workers) as pool:
+        pool.map_async(work, range(num_workers))
+
+        for _ in photo_items:
+            result = finished.get()
+
+            if isinstance(result, Exception):
+                raise result
+
+            results.append(result)
+
+            if metrics is not None:
+                metrics.record(result)
+
+    return results
+
+
+def download_photos_async(photo_items: List[PhotoItem], num_in_flight: int = config.NUM_DOWNLOADS_IN_FLIGHT,
+                          num_connections_per_host: int = config.NUM_CONNECTIONS_PER_HOST, limits: HostLimits = None,
+                          metrics: DownloadMetrics = None) -> List[DownloadResult]:
+    """
+    Downloads photos concurrently in a single thread with an asyncio event
+    loop. All downloads share a pool of keep-alive connections per host,
+    every host gets at most its number of requests per second, and failed
+    downloads are retried with backoff.
+
+    :param photo_items: photos to download
+    :param num_in_flight: maximum number of downloads in flight
+    :param num_connections_per_host: maximum number of open connections to
+    a single host
+    :param limits: rate limits of hosts (if None, the configured ones)
+    :param metrics: metrics which record the result of every download
+    :return: results of all downloads, in the order they finished
+    """
+
+    # aiohttp takes long to import, so it is imported only by this engine
+    import aiohttp
+
+    limits = limits or HostLimits()
+    results = []
+
+    async def download_all():
+        semaphore = asyncio.Semaphore(num_in_flight)
+        host_semaphores = defaultdict(lambda: asyncio.Semaphore(num_connections_per_host))
+        connector = aiohttp.TCPConnector(limit=num_in_flight, limit_per_host=num_connections_per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=config.DOWNLOAD_CONNECT_TIMEOUT,
+                                        sock_read=config.DOWNLOAD_READ_TIMEOUT)
+
+        async def download_photo(item: PhotoItem):
+            download = _PhotoDownload(item)
+            bucket = limits.bucket(download.host)
+
+            # photos which are already downloaded are finished without taking
+            # a token of their host
+            skipped = download.skip()
+
+            while not skipped:
+                # a download waits for its host first, so it does not take
+                # a slot of other hosts in the meantime
+                async with host_semaphores[download.host], semaphore:
+                    await asyncio.sleep(bucket.reserve())
+                    await download.attempt_async(session)
+
+                delay = download.next_retry()
+
+                if delay is None:
+                    break
+
+                if download.throttled:
+                    bucket.pause(delay)
+
+                await asyncio.sleep(delay)
+
+            result = download.result()
+            results.append(result)
+
+            if metrics is not None:
+                metrics.record(result)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[download_photo(item) for item in photo_items])
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        loop.run_until_complete(download_all())
+    finally:
+        loop.close()
+
+    return results
 
 
 if __name__ == '__main__':
-    photo_items = []
-
-    for photo_credits in glob.glob(f'{config.DATASET_FOLDER}/*/credits.yml'):
-        # read all photos for a single country
-        with open(photo_credits) as yaml_file:
-            data = yaml.load(yaml_file, Loader=yaml.Loader)
-
-        for photo_data in data['photos']:
-            downloader_type = photo_data['downloader']
-            download_url = photo_data['download_url']
-            path = photo_credits.replace('credits.yml', photo_data['filename'])
-
-            item = PhotoItem(
-                downloader=downloader_type,
-                download_url=download_url,
-                path=path
-            )
-            photo_items.append(item)
-
-    # download photos in parallel
-    results = ThreadPool(config.NUM_DOWNLOAD_WORKERS).imap_unordered(_download_single_photo, photo_items)
-
-    # wait all downloads to finish
-    for _ in results:
-        pass
+    parser = argparse.ArgumentParser(description='Downloads photos of the dataset.')
+    parser.add_argument('--engine', choices=['async', 'threads'], default='async',
+                        help='download photos concurrently with asyncio or on a pool of threads')
+    parser.add_argument('--trace', help='a path to a JSON-lines file where the result of every download is written')
+    parser.add_argument('--archives', help='a folder or URL of dataset archives (see: download.archive) photos are '
+                                           'extracted from before they are downloaded one by one')
+    args = parser.parse_args()
+
+    if args.archives:
+        fetch_result = fetch_archives(args.archives)
+        print(f'Extracted {fetch_result.num_extracted} of {fetch_result.num_members} archived photos in '
+              f'{fetch_result.num_requests} reads ({fetch_result.num_bytes / 1e6:.1f} MB)')
+
+        # photos which were not extracted are downloaded one by one
+        for name in fetch_result.failed:
+            print(f'Extraction of {name} failed')
+
+    all_photo_items = load_photo_items()
+
+    with DownloadMetrics(args.trace) as download_metrics:
+        if args.engine == 'async':
+            download_photos_async(all_photo_items, metrics=download_metrics)
+        else:
+            download_photos(all_photo_items, metrics=download_metrics)
+
+    print(download_metrics.summary())
+
+    # downloaded photos are checked for near-duplicates (the hashing module is
+    # imported here, since NumPy and Pillow slow down the start of the tool)
+    from utils.phash import HashIndex, print_near_duplicates
+    print_near_duplicates(HashIndex().add_images([result.path for result in download_metrics.results
+                                                  if result.status == DOWNLOADED],
+                                                 num_workers=config.NUM_PHASH_WORKERS))
+
+    sys.exit(1 if download_metrics.failed else 0)
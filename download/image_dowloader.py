@@ -1,28 +1,189 @@
 import abc
+import hashlib
 import os
 
+import config
+
+
+class CorruptImageException(Exception):
+    """
+    Simple exception class to indicate that a downloaded image does not match
+    its expected size or SHA-256 hash.
+    """
+    pass
+
+
+class UnexpectedContentException(Exception):
+    """
+    Simple exception class to indicate a response which is not an image,
+    e.g. an error page of a host.
+    """
+    pass
+
+
+class ThrottledException(Exception):
+    """
+    Simple exception class to indicate that a host refused a download
+    because of too many requests. The host may tell the number of seconds to
+    wait before the next request.
+    """
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def compute_sha256(path: str) -> str:
+    """
+    Calculates SHA-256 hash of a file without loading the whole file into
+    memory.
+
+    :param path: a path to the file
+    :return: a hex digest of the file content
+    """
+
+    sha256 = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(config.DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
 
 class ImageDownloader(abc.ABC):
     """
-    An abstract image downloader.
+    An abstract image downloader. If the expected size and/or SHA-256 hash of
+    the image are known, an existing image is downloaded again only if it
+    does not match them, and an interrupted download is resumed from where
+    it stopped.
     """
 
-    def __init__(self, url: str, path: str, forced: bool = False):
+    def __init__(self, url: str, path: str, forced: bool = False, sha256: str = None, size: int = None):
         self.url = url
         self.path = path
         self.forced = forced
+        self.sha256 = sha256
+        self.size = size
+
+        # details of the last download, which are recorded by download metrics
+        self.http_status = None
+        self.num_bytes = 0
+        self.num_retries = 0
+
+    @property
+    def temporary_path(self) -> str:
+        """
+        A path where the image is written while it is being downloaded. Once
+        the download is finished, the file is atomically renamed to the
+        image path, so an interrupted download never leaves a truncated
+        image behind.
+        """
+
+        return f'{self.path}.part'
+
+    def download(self) -> bool:
+        """
+        Downloads the image, unless it is already downloaded.
 
-    def download(self):
-        if self.forced or not os.path.isfile(self.path):
+        :return: an indicator whether the image was downloaded
+        """
+
+        if self._should_download():
             print(f'Downloading {self.path}...')
             self._download_from_url()
-        else:
-            print(f'Download of {self.path} is skipped')
+            return True
+
+        print(f'Download of {self.path} is skipped')
+        return False
+
+    async def download_async(self, session) -> bool:
+        """
+        Downloads the image within an asyncio event loop.
+
+        :param session: an HTTP client session shared by all downloads
+        :return: an indicator whether the image was downloaded
+        """
+
+        if self._should_download():
+            print(f'Downloading {self.path}...')
+            await self._download_from_url_async(session)
+            return True
+
+        print(f'Download of {self.path} is skipped')
+        return False
+
+    def is_downloaded(self) -> bool:
+        """
+        Checks whether the image is already downloaded and matches its
+        expected size and SHA-256 hash (if they are known), so no request is
+        needed.
+        """
+
+        return not self._should_download()
+
+    def _should_download(self) -> bool:
+        if self.forced:
+            # never resume a forced download
+            if os.path.isfile(self.temporary_path):
+                os.remove(self.temporary_path)
+
+            return True
+
+        if not os.path.isfile(self.path):
+            return True
+
+        if not self._is_valid(self.path):
+            print(f'{self.path} is corrupt')
+            return True
+
+        return False
+
+    def _is_valid(self, path: str) -> bool:
+        """
+        Checks whether a file matches the expected size and SHA-256 hash of
+        the image (if they are known).
+        """
+
+        if self.size is not None and os.path.getsize(path) != self.size:
+            return False
+
+        return self.sha256 is None or compute_sha256(path) == self.sha256
+
+    def _resume_offset(self) -> int:
+        """
+        Returns the number of bytes downloaded by a previous, interrupted
+        download. A download is resumed only if it can be verified after it
+        finishes, i.e. if the expected size or SHA-256 hash is known.
+
+        :return: the offset in bytes to resume the download from
+        """
+
+        if (self.size is None and self.sha256 is None) or not os.path.isfile(self.temporary_path):
+            return 0
+
+        offset = os.path.getsize(self.temporary_path)
+
+        if self.size is not None and offset >= self.size:
+            os.remove(self.temporary_path)
+            return 0
+
+        return offset
+
+    def _finish_download(self):
+        if not self._is_valid(self.temporary_path):
+            os.remove(self.temporary_path)
+            raise CorruptImageException(f'Downloaded image {self.path} does not match its size or SHA-256 hash')
+
+        os.replace(self.temporary_path, self.path)
 
     @abc.abstractmethod
     def _download_from_url(self):
         pass
 
+    async def _download_from_url_async(self, session):
+        raise NotImplementedError(f'{type(self).__name__} does not support asynchronous downloads')
+
     @property
     def type(self):
         raise NotImplementedError
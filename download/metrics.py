@@ -0,0 +1,192 @@
+import json
+import time
+from collections import defaultdict, namedtuple
+from typing import List
+from urllib.parse import urlparse
+
+from download.image_dowloader import ImageDownloader
+
+DOWNLOADED = 'downloaded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+DownloadResult = namedtuple('DownloadResult', ['path', 'url', 'host', 'status', 'http_status', 'num_bytes',
+                                               'started_at', 'seconds', 'total_seconds', 'num_retries', 'error'])
+HostSummary = namedtuple('HostSummary', ['host', 'num_downloaded', 'num_skipped', 'num_failed', 'num_bytes',
+                                         'bytes_per_second', 'p50_seconds', 'p95_seconds', 'p99_seconds'])
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """
+    Calculates a percentile of values with linear interpolation between the
+    closest ranks (like numpy.percentile, which is not imported by the
+    downloader to keep its start fast).
+    """
+
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def create_download_result(downloader: ImageDownloader, downloaded: bool, started_at: float, seconds: float,
+                           total_seconds: float = None, error: Exception = None) -> DownloadResult:
+    """
+    Creates the result of a single download from the downloader which made
+    it.
+
+    :param downloader: the downloader of the photo
+    :param downloaded: an indicator whether the photo was downloaded (or
+    skipped because it was already downloaded)
+    :param started_at: a timestamp when the last attempt of the download
+    started
+    :param seconds: duration of the last attempt in seconds (the latency of
+    the download, without waiting for a connection, rate limits or retries)
+    :param total_seconds: duration of all attempts of the download in
+    seconds, with backoff between them (if None, the duration of the last
+    attempt)
+    :param error: an exception the download failed with
+    :return: the result of the download
+    """
+
+    if error is not None:
+        status = FAILED
+    else:
+        status = DOWNLOADED if downloaded else SKIPPED
+
+    return DownloadResult(path=downloader.path,
+                          url=downloader.url,
+                          host=urlparse(downloader.url).netloc,
+                          status=status,
+                          http_status=downloader.http_status,
+                          num_bytes=downloader.num_bytes,
+                          started_at=started_at,
+                          seconds=seconds,
+                          total_seconds=seconds if total_seconds is None else total_seconds,
+                          num_retries=downloader.num_retries,
+                          error=repr(error) if error is not None else None)
+
+
+class DownloadMetrics:
+    """
+    Collects results of downloads of a dataset run, and summarizes them per
+    host: number of downloaded, skipped and failed photos, bytes, throughput
+    and percentiles of download latency. Results can also be traced to a
+    JSON-lines file as they arrive, one result per line.
+    """
+
+    def __init__(self, trace_path: str = None):
+        """
+        :param trace_path: a path to the JSON-lines trace file (if None, no
+        trace is written)
+        """
+
+        self.results = []
+        self._started_at = time.time()
+        self._finished_at = None
+        self._trace_file = open(trace_path, 'w') if trace_path is not None else None
+
+    def record(self, result: DownloadResult):
+        self.results.append(result)
+
+        if self._trace_file is not None:
+            self._trace_file.write(json.dumps(result._asdict()) + '\n')
+            self._trace_file.flush()
+
+    @property
+    def seconds(self) -> float:
+        """
+        Wall time of the run in seconds, until the metrics are closed.
+        """
+
+        return (self._finished_at or time.time()) - self._started_at
+
+    @property
+    def failed(self) -> List[DownloadResult]:
+        return [result for result in self.results if result.status == FAILED]
+
+    def host_summaries(self) -> List[HostSummary]:
+        """
+        Summarizes results per host. Throughput of a host is the number of
+        bytes downloaded from the host per second of the whole run, and
+        latency percentiles are calculated only from downloaded photos.
+
+        :return: summaries of hosts, sorted by host
+        """
+
+        results_by_host = defaultdict(list)
+
+        for result in self.results:
+            results_by_host[result.host].append(result)
+
+        summaries = []
+        seconds = max(self.seconds, 1e-9)
+
+        for host, results in sorted(results_by_host.items()):
+            num_statuses = defaultdict(int)
+
+            for result in results:
+                num_statuses[result.status] += 1
+
+            latencies = [result.seconds for result in results if result.status == DOWNLOADED]
+            p50, p95, p99 = [_percentile(latencies, percent) if latencies else None for percent in (50, 95, 99)]
+            num_bytes = sum(result.num_bytes for result in results)
+
+            summaries.append(HostSummary(host=host,
+                                         num_downloaded=num_statuses[DOWNLOADED],
+                                         num_skipped=num_statuses[SKIPPED],
+                                         num_failed=num_statuses[FAILED],
+                                         num_bytes=num_bytes,
+                                         bytes_per_second=num_bytes / seconds,
+                                         p50_seconds=p50,
+                                         p95_seconds=p95,
+                                         p99_seconds=p99))
+
+        return summaries
+
+    def summary(self) -> str:
+        """
+        Formats a table of host summaries, the totals of the run, and the
+        failed downloads.
+        """
+
+        def format_seconds(value: float) -> str:
+            return '-' if value is None else f'{value:.3f}'
+
+        lines = [f'{"host":<32} {"downloaded":>10} {"skipped":>8} {"failed":>7} {"MB":>9} {"MB/s":>7} '
+                 f'{"p50 (s)":>8} {"p95 (s)":>8} {"p99 (s)":>8}']
+
+        for host in self.host_summaries():
+            lines.append(f'{host.host[:32]:<32} {host.num_downloaded:>10} {host.num_skipped:>8} {host.num_failed:>7} '
+                         f'{host.num_bytes / 1e6:>9.1f} {host.bytes_per_second / 1e6:>7.2f} '
+                         f'{format_seconds(host.p50_seconds):>8} {format_seconds(host.p95_seconds):>8} '
+                         f'{format_seconds(host.p99_seconds):>8}')
+
+        num_downloaded = sum(result.status == DOWNLOADED for result in self.results)
+        num_bytes = sum(result.num_bytes for result in self.results)
+        seconds = max(self.seconds, 1e-9)
+
+        lines.append(f'Downloaded {num_downloaded} of {len(self.results)} photos ({num_bytes / 1e6:.1f} MB) in '
+                     f'{seconds:.1f}s: {num_downloaded / seconds:.1f} photos/s, {num_bytes / 1e6 / seconds:.2f} MB/s, '
+                     f'{sum(result.num_retries for result in self.results)} retries')
+
+        for result in self.failed:
+            lines.append(f'Failed {result.path} ({result.url}): {result.error}')
+
+        return '\n'.join(lines)
+
+    def close(self):
+        if self._finished_at is None:
+            self._finished_at = time.time()
+
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
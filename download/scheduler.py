@@ -0,0 +1,289 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, Iterable
+from urllib.parse import urlparse
+
+import requests
+
+import config
+from download.image_dowloader import CorruptImageException, ThrottledException
+
+# HTTP statuses of failed requests which may succeed when they are repeated
+_RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+@functools.lru_cache(maxsize=None)
+def _retryable_errors() -> tuple:
+    """
+    Returns errors of connections which broke or timed out. aiohttp is
+    imported only when the first download fails, so the threads engine does
+    not wait for it to load.
+    """
+
+    import aiohttp
+
+    return (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+            aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError,
+            CorruptImageException, ThrottledException)
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc
+
+
+class TokenBucket:
+    """
+    A token bucket which limits the rate of requests to a host. Up to burst
+    requests are sent at once, and then rate requests per second. Requests
+    reserve their token and wait for it on their own, so the bucket is shared
+    by threads and coroutines alike.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: number of requests per second (if None, requests are
+        not limited)
+        :param burst: number of requests which can be sent at once
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Takes a token for a request.
+
+        :return: number of seconds to wait before the request is sent
+        """
+
+        if self.rate is None:
+            return 0.0
+
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+
+            return max(0.0, -self._tokens / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Holds back all requests for the given number of seconds, e.g. when
+        the host asks to retry later.
+        """
+
+        if self.rate is None:
+            return
+
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class HostLimits:
+    """
+    Token buckets of all hosts, created when a host is first requested. Every
+    host has the default rate unless its own rate is configured.
+    """
+
+    def __init__(self, rate: float = config.DOWNLOAD_RATE_PER_HOST, burst: int = config.DOWNLOAD_BURST_PER_HOST,
+                 host_rates: Dict[str, float] = config.DOWNLOAD_HOST_RATES):
+        """
+        :param rate: number of requests per second to a single host (if
+        None, requests are not limited)
+        :param burst: number of requests to a single host which can be sent
+        at once
+        :param host_rates: rates of hosts which differ from the default one
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = host_rates
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.host_rates.get(host, self.rate), self.burst)
+
+            return self._buckets[host]
+
+
+def backoff_delay(num_retries: int, base: float = config.DOWNLOAD_BACKOFF_BASE,
+                  maximum: float = config.DOWNLOAD_BACKOFF_MAX) -> float:
+    """
+    Returns a random delay before a retry, with an exponentially growing
+    upper bound ("full jitter"), so retries of many downloads spread out
+    instead of hitting the host at the same time.
+
+    :param num_retries: number of retries made so far
+    :param base: upper bound of the delay of the first retry in seconds
+    :param maximum: maximum delay in seconds
+    :return: the delay in seconds
+    """
+
+    return random.uniform(0, min(maximum, base * 2 ** num_retries))
+
+
+def retry_delay(error: Exception, num_retries: int, max_retries: int = config.DOWNLOAD_MAX_RETRIES) -> float:
+    """
+    Decides whether a failed download is retried, and when.
+
+    :param error: an exception the download failed with (None if it did not
+    fail)
+    :param num_retries: number of retries made so far
+    :param max_retries: maximum number of retries of a single download
+    :return: number of seconds to wait before the retry, or None if the
+    download is not retried
+    """
+
+    if error is None or num_retries >= max_retries:
+        return None
+
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'status', None)
+
+    if not isinstance(error, _retryable_errors()) and status not in _RETRYABLE_STATUSES:
+        return None
+
+    delay = backoff_delay(num_retries)
+
+    if isinstance(error, ThrottledException) and error.retry_after is not None:
+        delay = max(delay, min(error.retry_after, config.DOWNLOAD_BACKOFF_MAX))
+
+    return delay
+
+
+class HostScheduler:
+    """
+    Hands out downloads to worker threads, so that no host gets more
+    connections or requests per second than its limits allow. Downloads are
+    grouped by host and a worker gets the next download of any host with a
+    free connection (hosts take turns), so a slow or throttled host does not
+    hold up workers which could download from other hosts. Retried downloads
+    are handed out again once their backoff elapses.
+    """
+
+    def __init__(self, downloads: Iterable[Any], get_url: Callable[[Any], str],
+                 max_connections: int = config.NUM_CONNECTIONS_PER_HOST, limits: HostLimits = None):
+        """
+        :param downloads: downloads to schedule (of any type)
+        :param get_url: a function which returns the URL of a download
+        :param max_connections: maximum number of downloads in flight to a
+        single host
+        :param limits: rate limits of hosts
+        """
+
+        self.max_connections = max_connections
+        self.limits = limits or HostLimits()
+        self._get_url = get_url
+        self._queues = defaultdict(deque)
+        self._in_flight = defaultdict(int)
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._num_pending = 0
+        self._cancelled = False
+        self._condition = threading.Condition()
+
+        for download in downloads:
+            self._queues[host_of(get_url(download))].append(download)
+            self._num_pending += 1
+
+        self._hosts = deque(self._queues)
+
+    def _release_delayed(self):
+        now = time.monotonic()
+
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, host, download = heapq.heappop(self._delayed)
+            self._queues[host].append(download)
+
+    def acquire(self) -> Any:
+        """
+        Waits for a download whose host has a free connection. The download
+        takes its turn of the rate limit of the host only once it is sent
+        (see: reserve), so downloads which are skipped are not held back.
+
+        :return: the download, or None when all downloads are finished or the
+        scheduler is cancelled
+        """
+
+        with self._condition:
+            while self._num_pending and not self._cancelled:
+                self._release_delayed()
+
+                for _ in range(len(self._hosts)):
+                    host = self._hosts[0]
+                    self._hosts.rotate(-1)
+
+                    if self._queues[host] and self._in_flight[host] < self.max_connections:
+                        self._in_flight[host] += 1
+                        return self._queues[host].popleft()
+
+                timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                self._condition.wait(timeout)
+
+            return None
+
+    def reserve(self, download: Any) -> float:
+        """
+        Takes a token of the host of a download, right before its request is
+        sent.
+
+        :param download: a download handed out by acquire
+        :return: number of seconds to wait before the request is sent (see:
+        TokenBucket)
+        """
+
+        return self.limits.bucket(host_of(self._get_url(download))).reserve()
+
+    def release(self, download: Any, retry_in: float = None, throttled: bool = False):
+        """
+        Frees the connection of a download, which is either finished or
+        retried later.
+
+        :param download: a download handed out by acquire
+        :param retry_in: number of seconds after which the download is
+        retried (if None, the download is finished)
+        :param throttled: an indicator that the host refused the download
+        because of its rate, so no download is sent to the host until the
+        retry
+        """
+
+        host = host_of(self._get_url(download))
+
+        with self._condition:
+            self._in_flight[host] -= 1
+
+            if retry_in is None:
+                self._num_pending -= 1
+            else:
+                heapq.heappush(self._delayed, (time.monotonic() + retry_in, next(self._sequence), host, download))
+
+                if throttled:
+                    self.limits.bucket(host).pause(retry_in)
+
+            self._condition.notify_all()
+
+    def cancel(self):
+        """
+        Stops handing out downloads, e.g. when a worker failed, so the other
+        workers stop as well.
+        """
+
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
@@ -1,18 +1,134 @@
+import email.utils
+import os
+import threading
+import time
+from typing import Mapping, Tuple
+
 import requests
 
-from download.image_dowloader import ImageDownloader
+import config
+from download.image_dowloader import ImageDownloader, ThrottledException, UnexpectedContentException
+
+_HTTP_PARTIAL_CONTENT = 206
+_HTTP_RANGE_NOT_SATISFIABLE = 416
+
+# statuses of hosts which refuse requests because of their rate
+_HTTP_THROTTLED_STATUSES = {429, 503}
+
+# every worker thread keeps its own session, so connections to the same host
+# are reused between downloads instead of opening a new one for every image
+_thread_data = threading.local()
+
+
+def _get_session() -> requests.Session:
+    if not hasattr(_thread_data, 'session'):
+        _thread_data.session = requests.Session()
+
+    return _thread_data.session
+
+
+def parse_retry_after(value: str) -> float:
+    """
+    Parses the Retry-After HTTP header, which is either a number of seconds
+    or an HTTP date.
+
+    :param value: a value of the header
+    :return: number of seconds to wait, or None if the value is missing or
+    invalid
+    """
+
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        return float(value)
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 class UrlImageDownloader(ImageDownloader):
     """
-    An image downloader from URL.
+    An image downloader from URL. Interrupted downloads are resumed with HTTP
+    range requests.
     """
 
     type = 'url_image'
 
-    def __init__(self, url: str, path: str):
-        super().__init__(url, path)
+    def __init__(self, url: str, path: str, sha256: str = None, size: int = None):
+        super().__init__(url, path, sha256=sha256, size=size)
+
+    def _range_headers(self) -> Tuple[int, dict]:
+        offset = self._resume_offset()
+        return offset, {'Range': f'bytes={offset}-'} if offset else {}
+
+    def _check_response(self, status: int, headers: Mapping[str, str]):
+        """
+        Refuses responses of throttled requests and responses which are not
+        images (e.g. error pages served with a successful status), before
+        anything is written to the image file.
+        """
+
+        if status in _HTTP_THROTTLED_STATUSES:
+            raise ThrottledException(f'{self.url} was refused with HTTP {status}',
+                                     retry_after=parse_retry_after(headers.get('Retry-After')))
+
+        content_type = headers.get('Content-Type', '')
+
+        if 200 <= status < 300 and not content_type.startswith('image/'):
+            raise UnexpectedContentException(f'{self.url} is not an image ({content_type or "no content type"})')
+
+    def _restart_download(self):
+        # the partially downloaded file is longer than the image on the
+        # server, so the image has to be downloaded from scratch
+        os.remove(self.temporary_path)
+        self.num_retries += 1
 
     def _download_from_url(self):
-        with open(self.path, 'wb') as image:
-            image.write(requests.get(self.url).content)
+        offset, headers = self._range_headers()
+
+        timeout = config.DOWNLOAD_CONNECT_TIMEOUT, config.DOWNLOAD_READ_TIMEOUT
+
+        with _get_session().get(self.url, headers=headers, stream=True, timeout=timeout) as response:
+            self.http_status = response.status_code
+
+            if offset and response.status_code == _HTTP_RANGE_NOT_SATISFIABLE:
+                self._restart_download()
+                return self._download_from_url()
+
+            self._check_response(response.status_code, response.headers)
+            response.raise_for_status()
+
+            # append to the partially downloaded file only if the server
+            # responded with the requested range
+            mode = 'ab' if offset and response.status_code == _HTTP_PARTIAL_CONTENT else 'wb'
+
+            with open(self.temporary_path, mode) as image:
+                for chunk in response.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+                    image.write(chunk)
+                    self.num_bytes += len(chunk)
+
+        self._finish_download()
+
+    async def _download_from_url_async(self, session):
+        offset, headers = self._range_headers()
+
+        async with session.get(self.url, headers=headers) as response:
+            self.http_status = response.status
+
+            if offset and response.status == _HTTP_RANGE_NOT_SATISFIABLE:
+                self._restart_download()
+                return await self._download_from_url_async(session)
+
+            self._check_response(response.status, response.headers)
+            response.raise_for_status()
+            mode = 'ab' if offset and response.status == _HTTP_PARTIAL_CONTENT else 'wb'
+
+            with open(self.temporary_path, mode) as image:
+                async for chunk in response.content.iter_chunked(config.DOWNLOAD_CHUNK_SIZE):
+                    image.write(chunk)
+                    self.num_bytes += len(chunk)
+
+        self._finish_download()
@@ -0,0 +1,46 @@
+import argparse
+import runpy
+import sys
+from typing import List
+
+# modules of subcommands, which are imported only when their subcommand runs,
+# so the entry point starts without loading dependencies of other tools
+SUBCOMMANDS = {
+    'countries': ('utils.country', 'create country folders and the label map from the list of countries'),
+    'credits': ('utils.credits', 'render photo credits in Markdown'),
+    'download': ('download.download_dataset', 'download photos of the dataset'),
+    'screenshots': ('utils.screenshot', 'take screenshots of waving flags'),
+    'validate': ('utils.validate', 'validate credits, labels and image sizes of the dataset')
+}
+
+
+def main(args: List[str] = None):
+    """
+    Runs a subcommand as if its module was run with python -m, with the
+    remaining arguments.
+
+    :param args: command line arguments (if None, the arguments of the
+    process)
+    """
+
+    parser = argparse.ArgumentParser(prog='flagnet', description='Builds and maintains the Flagnet dataset.')
+    subparsers = parser.add_subparsers(dest='subcommand', metavar='subcommand')
+
+    for name, (_, description) in SUBCOMMANDS.items():
+        # arguments of subcommands are parsed by their modules
+        subparsers.add_parser(name, help=description, add_help=False)
+
+    args = sys.argv[1:] if args is None else args
+    subcommand = parser.parse_args(args[:1]).subcommand
+
+    if subcommand is None:
+        parser.print_help()
+        sys.exit(2)
+
+    module = SUBCOMMANDS[subcommand][0]
+    sys.argv = [f'flagnet {subcommand}'] + args[1:]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+if __name__ == '__main__':
+    main()
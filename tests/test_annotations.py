@@ -0,0 +1,31 @@
+import numpy as np
+
+from utils.annotations import AnnotationStore
+
+
+def _create_store() -> AnnotationStore:
+    return AnnotationStore(boxes=[[100, 100, 300, 200], [0, 0, 400, 300], [10, 10, 900, 20], [50, 50, 50, 60]],
+                           label_ids=[1, 1, 2, 2],
+                           image_index=[0, 0, 1, 2],
+                           image_sizes=[[800, 600], [800, 600], [400, 300]],
+                           image_names=['rs/rs_00000.jpg', 'fr/fr_00000.jpg', 'fr/fr_00001.jpg'])
+
+
+def test_annotation_checks_and_conversions(tmp_path):
+    store = _create_store()
+
+    assert store.invalid_boxes().tolist() == [False, False, True, True]
+    assert store.invalid_images().tolist() == ['fr/fr_00000.jpg', 'fr/fr_00001.jpg']
+    assert np.allclose(store.to_coco()[0], [100, 100, 200, 100])
+    assert np.allclose(store.to_yolo()[0], [200 / 800, 150 / 600, 200 / 800, 100 / 600])
+
+    stats = store.stats_by_label()
+    assert stats[1]['count'] == 2 and stats[2]['count'] == 0
+    assert np.isclose(stats[1]['aspect_ratio_mean'], (2 + 4 / 3) / 2)
+    assert np.isclose(stats[1]['relative_area_mean'], (20000 / 480000 + 120000 / 480000) / 2)
+
+    store.save(str(tmp_path / 'annotations.npz'))
+    loaded = AnnotationStore.load(str(tmp_path / 'annotations.npz'))
+
+    for name in ('boxes', 'label_ids', 'image_index', 'image_sizes', 'image_names'):
+        assert np.array_equal(getattr(loaded, name), getattr(store, name))
@@ -0,0 +1,161 @@
+import json
+import os
+import tarfile
+
+import pytest
+
+from benchmarks.server import BenchmarkServer
+from download.archive import ARCHIVE_INDEX_FILE, build_archives, fetch_archives
+
+
+_LABEL_MAP = """\
+item {
+  id: 1
+  name: "rs"
+  display_name: "Serbia"
+}
+item {
+  id: 2
+  name: "fr"
+  display_name: "France"
+}
+"""
+
+
+def _create_dataset(dataset_folder) -> dict:
+    dataset_folder.mkdir()
+    (dataset_folder / 'countries_label_map.pbtxt').write_text(_LABEL_MAP)
+    photos = {}
+
+    for country in ('fr', 'rs'):
+        os.makedirs(dataset_folder / country)
+        (dataset_folder / country / 'credits.yml').write_text(
+            'photos:\n' + ''.join(f'- filename: {country}_{i:05}.jpg\n' for i in range(5)))
+
+        for i in range(5):
+            name = f'{country}/{country}_{i:05}.jpg'
+            photos[name] = os.urandom(1000 + 700 * i)
+            (dataset_folder / name).write_bytes(photos[name])
+
+    return photos
+
+
+def _read_dataset(dataset_folder, photos: dict) -> dict:
+    return {name: (dataset_folder / name).read_bytes() for name in photos if (dataset_folder / name).exists()}
+
+
+def test_build_and_fetch_archives(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    archives_folder = tmp_path / 'archives'
+    photos = _create_dataset(dataset_folder)
+
+    # small shards make the dataset span multiple shards
+    assert build_archives(str(dataset_folder), str(archives_folder), shard_size=8000,
+                          manifest_path=str(tmp_path / 'manifest.json')) == len(photos)
+
+    shards = sorted(path.name for path in archives_folder.glob('shard-*.tar'))
+    assert len(shards) > 1
+
+    # shards are plain tar files
+    with tarfile.open(str(archives_folder / shards[0])) as shard:
+        assert shard.extractfile(shard.getmembers()[0]).read() == photos['fr/fr_00000.jpg']
+
+    # a new machine extracts every photo, reading every shard at once
+    new_folder = tmp_path / 'new'
+    result = fetch_archives(str(archives_folder), str(new_folder))
+
+    assert _read_dataset(new_folder, photos) == photos
+    assert result.num_extracted == len(photos) and result.num_requests == len(shards)
+
+    # only missing and modified photos are extracted
+    (new_folder / 'fr' / 'fr_00001.jpg').unlink()
+    (new_folder / 'rs' / 'rs_00004.jpg').write_bytes(b'modified')
+    result = fetch_archives(str(archives_folder), str(new_folder), max_gap=0)
+
+    assert _read_dataset(new_folder, photos) == photos
+    assert result.num_extracted == result.num_requests == 2
+    assert result.num_bytes == len(photos['fr/fr_00001.jpg']) + len(photos['rs/rs_00004.jpg'])
+    assert fetch_archives(str(archives_folder), str(new_folder)).num_extracted == 0
+
+    # archives are also read over HTTP with range requests
+    files = {f'/archives/{path.name}': path.read_bytes() for path in archives_folder.iterdir()}
+
+    with BenchmarkServer(files) as server:
+        http_folder = tmp_path / 'http'
+        result = fetch_archives(f'{server.base_url}/archives', str(http_folder))
+
+        (http_folder / 'rs' / 'rs_00002.jpg').unlink()
+        assert fetch_archives(f'{server.base_url}/archives', str(http_folder)).num_extracted == 1
+
+    assert _read_dataset(http_folder, photos) == photos
+    assert result.num_requests == len(shards)
+
+    with open(archives_folder / ARCHIVE_INDEX_FILE) as index_file:
+        assert len(json.load(index_file)['members']) == len(photos)
+
+
+def _build(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    archives_folder = tmp_path / 'archives'
+    photos = _create_dataset(dataset_folder)
+    build_archives(str(dataset_folder), str(archives_folder), manifest_path=str(tmp_path / 'manifest.json'))
+
+    with open(archives_folder / ARCHIVE_INDEX_FILE) as index_file:
+        index = json.load(index_file)
+
+    return photos, archives_folder, index
+
+
+def test_invalid_archive_index(tmp_path):
+    _, archives_folder, index = _build(tmp_path)
+
+    # members outside of country folders of the dataset are refused before
+    # anything is written
+    for name in ('../../escaped.jpg', '/tmp/escaped.jpg', 'rs/../../escaped.jpg', 'rs/credits.yml'):
+        index['members'][-1][0] = name
+
+        with open(archives_folder / ARCHIVE_INDEX_FILE, 'w') as index_file:
+            json.dump(index, index_file)
+
+        with pytest.raises(ValueError):
+            fetch_archives(str(archives_folder), str(tmp_path / 'new'))
+
+        assert not (tmp_path / 'new').exists() and not (tmp_path / 'escaped.jpg').exists()
+
+
+def test_corrupt_archive_members(tmp_path):
+    photos, archives_folder, index = _build(tmp_path)
+    members = {member[0]: member for member in index['members']}
+
+    # a corrupt member is skipped, and other members are still extracted
+    name, _, offset, _, _ = members['fr/fr_00002.jpg']
+
+    with open(archives_folder / 'shard-00000.tar', 'r+b') as shard:
+        shard.seek(offset)
+        shard.write(b'corrupt')
+
+    new_folder = tmp_path / 'new'
+    result = fetch_archives(str(archives_folder), str(new_folder))
+
+    assert result.failed == [name] and result.num_extracted == len(photos) - 1
+    assert sorted(_read_dataset(new_folder, photos)) == sorted(set(photos) - {name})
+
+    # a truncated shard leaves no partially extracted photos behind
+    name, _, offset, _, _ = members['rs/rs_00003.jpg']
+
+    with open(archives_folder / 'shard-00000.tar', 'r+b') as shard:
+        shard.truncate(offset + 100)
+
+    for path in new_folder.glob('rs/*.jpg'):
+        path.unlink()
+
+    result = fetch_archives(str(archives_folder), str(new_folder))
+
+    assert result.failed == ['fr/fr_00002.jpg', 'rs/rs_00003.jpg', 'rs/rs_00004.jpg']
+    assert not list(new_folder.glob('*/*.part'))
+
+    # members of a missing shard are reported as well
+    (archives_folder / 'shard-00000.tar').unlink()
+    result = fetch_archives(str(archives_folder), str(new_folder))
+
+    assert result.failed == ['fr/fr_00002.jpg', 'rs/rs_00003.jpg', 'rs/rs_00004.jpg'] and result.num_extracted == 0
@@ -0,0 +1,60 @@
+import numpy as np
+from PIL import Image
+
+from utils import autolabel
+from utils.autolabel import compute_bounding_boxes, label_images
+from utils.synthesize import synthesize_flag
+from utils.voc import read_voc_annotation
+
+
+def test_compute_bounding_boxes():
+    flag = Image.new('RGBA', (900, 600), (200, 30, 30, 255))
+    background, _ = synthesize_flag(Image.new('RGBA', (900, 600)), (400, 300), np.random.RandomState(0))
+    image, bounding_box = synthesize_flag(flag, (400, 300), np.random.RandomState(0))
+
+    # an image without the flag, with a little noise
+    noisy_background = background.copy()
+    noisy_background[10, 10] = 255 - noisy_background[10, 10]
+
+    bounding_boxes = compute_bounding_boxes(np.stack([image, noisy_background]), background)
+    assert bounding_boxes.tolist() == [list(bounding_box), [-1, -1, -1, -1]]
+
+
+def test_label_images(tmp_path):
+    (tmp_path / 'rs').mkdir()
+    background, _ = synthesize_flag(Image.new('RGBA', (900, 600)), (400, 300), np.random.RandomState(1))
+    image, bounding_box = synthesize_flag(Image.new('RGBA', (900, 600), 'blue'), (400, 300), np.random.RandomState(1))
+    Image.fromarray(background).save(str(tmp_path / 'background.png'))
+    Image.fromarray(image).save(str(tmp_path / 'rs' / 'rs_00000.jpg'), quality=90)
+
+    assert label_images([str(tmp_path / 'rs' / 'rs_00000.jpg')], str(tmp_path / 'background.png')) == 1
+
+    annotation = read_voc_annotation(str(tmp_path / 'rs' / 'rs_00000.xml'))
+    assert (annotation.folder, annotation.filename) == ('rs', 'rs_00000.jpg')
+    assert (annotation.width, annotation.height) == (400, 300)
+    assert annotation.objects[0].name == 'rs'
+    assert np.abs(np.array(annotation.objects[0][1:]) - bounding_box).max() <= 2
+
+
+def test_label_images_in_batches(tmp_path, monkeypatch):
+    (tmp_path / 'rs').mkdir()
+    background, _ = synthesize_flag(Image.new('RGBA', (900, 600)), (400, 300), np.random.RandomState(2))
+    Image.fromarray(background).save(str(tmp_path / 'background.png'))
+    image_paths = []
+
+    for i in range(5):
+        image, _ = synthesize_flag(Image.new('RGBA', (900, 600), 'red'), (400, 300), np.random.RandomState(2))
+        image_paths.append(str(tmp_path / 'rs' / f'rs_0000{i}.jpg'))
+        Image.fromarray(image).save(image_paths[-1], quality=90)
+
+    # every batch is compared to the background in a single pass
+    batch_shapes = []
+
+    def count_batches(images, background):
+        batch_shapes.append(images.shape)
+        return compute_bounding_boxes(images, background)
+
+    monkeypatch.setattr(autolabel, 'compute_bounding_boxes', count_batches)
+    assert label_images(image_paths, str(tmp_path / 'background.png'), batch_size=2) == 5
+    assert batch_shapes == [(2, 300, 400, 3), (2, 300, 400, 3), (1, 300, 400, 3)]
+    assert all((tmp_path / 'rs' / f'rs_0000{i}.xml').exists() for i in range(5))
@@ -0,0 +1,43 @@
+import requests
+
+from benchmarks.fixtures import create_sparql_bindings
+from benchmarks.server import BenchmarkServer
+from benchmarks.suite import compare_results, load_results, run_benchmarks, save_results
+
+STAGES = ['manifest_build', 'download_threads', 'download_async', 'download_verify', 'archive_build', 'archive_fetch',
+          'validate', 'validate_cached', 'credits_render', 'credits_up_to_date', 'countries_fetch', 'countries_cached',
+          'countries_not_modified']
+
+
+def test_benchmark_server():
+    server = BenchmarkServer({'/image.jpg': b'0123456789'}, create_sparql_bindings(2))
+
+    with server:
+        assert requests.get(server.base_url + '/image.jpg', headers={'Range': 'bytes=4-'}).content == b'456789'
+        assert requests.get(server.base_url + '/image.jpg', headers={'Range': 'bytes=2-4'}).content == b'234'
+        assert requests.get(server.base_url + '/missing.jpg').status_code == 404
+
+        response = requests.get(server.sparql_url, params={'format': 'json'})
+        codes = [binding['code']['value'] for binding in response.json()['results']['bindings']]
+        assert len(codes) == len(set(codes)) == 2 * 193
+
+        response = requests.get(server.sparql_url, headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
+
+def test_run_and_compare_benchmarks(tmp_path):
+    results = run_benchmarks([1, 2], countries=['ad', 'rs'], work_folder=str(tmp_path))
+    num_photos = {result.scale: result.num_items for result in results if result.stage == 'manifest_build'}
+
+    assert [result.stage for result in results] == STAGES * 2
+    assert all(result.num_items == num_photos[result.scale]
+               for result in results if result.stage.startswith(('download', 'validate')))
+    assert num_photos[2] == 2 * num_photos[1] > 0
+    assert all(result.num_items == 193 * result.scale for result in results if result.stage.startswith('countries'))
+
+    # nothing is left behind in the work folder
+    assert list(tmp_path.iterdir()) == []
+
+    save_results(results, str(tmp_path / 'results.json'))
+    comparisons = compare_results(load_results(str(tmp_path / 'results.json')), results[:3])
+    assert [comparison.ratio for comparison in comparisons] == [1.0, 1.0, 1.0]
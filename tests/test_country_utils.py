@@ -1,7 +1,186 @@
-from utils.country import load_countries
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import config
+from utils import country
+from utils.country import Country, CountryRegistry, NoCountriesException
+from utils.label_map import load_label_map
 
 NUM_COUNTRIES = 193  # number of state members of the United Nations
 
 
-def test_num_countries():
-    assert len(load_countries(True)) == NUM_COUNTRIES
+def _read_label_map_countries() -> list:
+    """
+    Reads codes and names of all countries from the label map of the dataset,
+    in the form of Wikidata endpoint results.
+    """
+
+    with open(f'{config.DATASET_FOLDER}/countries_label_map.pbtxt') as file:
+        items = re.findall(r'name:\s*"([^"]*)"\s*display_name:\s*"([^"]*)"', file.read())
+
+    return [{'code': {'value': code.upper()},
+             'countryLabel': {'value': name},
+             'flag': {'value': ''.join(chr(0x1F1E6 + ord(letter) - ord('a')) for letter in code)},
+             'flagImage': {'value': f'http://commons.wikimedia.org/wiki/Special:FilePath/Flag_of_{code}.svg'}}
+            for code, name in items]
+
+
+def _serve_countries(bindings: list) -> HTTPServer:
+    """
+    Starts a local SPARQL endpoint stub in a background thread which serves
+    the given results with an ETag (after the delay set on the server), and
+    counts requests it receives and requests it answers with 304 Not
+    Modified.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.num_requests += 1
+            time.sleep(server.delay)
+            content = json.dumps({'results': {'bindings': bindings}}).encode('utf-8')
+            etag = f'"{hash(content)}"'
+
+            if self.headers.get('If-None-Match') == etag:
+                server.num_not_modified += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/sparql-results+json')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.num_requests = 0
+    server.num_not_modified = 0
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def test_parse_countries_and_refresh_with_etag(tmp_path):
+    bindings = [{'code': {'value': code}, 'countryLabel': {'value': name}, 'flag': {'value': flag},
+                 'flagImage': {'value': f'http://commons.wikimedia.org/wiki/Special:FilePath/Flag_of_{code}.svg'}}
+                for code, name, flag in (('FR', 'France', '🇫🇷'), ('RS', 'Serbia', '🇷🇸'))]
+    server = _serve_countries(bindings)
+    endpoint_url = f'http://127.0.0.1:{server.server_port}'
+    cache_path = str(tmp_path / 'countries.json')
+
+    try:
+        registry = CountryRegistry(endpoint_url, cache_path)
+        diff = registry.refresh(forced=True)
+
+        # codes, names, emojis and flag images are parsed from the endpoint results
+        assert [tuple(country) for country in registry] == [
+            ('FR', 'France', '🇫🇷', 'http://commons.wikimedia.org/wiki/Special:FilePath/Flag_of_FR.svg'),
+            ('RS', 'Serbia', '🇷🇸', 'http://commons.wikimedia.org/wiki/Special:FilePath/Flag_of_RS.svg')]
+        assert [country.code for country in diff.added] == ['FR', 'RS'] and not diff.removed
+        assert server.num_requests == 1 and server.num_not_modified == 0
+
+        # an expired list is requested with its ETag, which the endpoint
+        # answers with 304, so the list is not fetched again
+        registry.refresh_interval = 0
+        assert registry.refresh() == ([], [], [])
+        assert server.num_requests == 2 and server.num_not_modified == 1
+
+        # the ETag is cached with the list
+        cached_registry = CountryRegistry(endpoint_url, cache_path)
+        cached_registry.refresh_interval = 0
+        assert cached_registry.refresh() == ([], [], []) and len(cached_registry) == 2
+        assert server.num_requests == 3 and server.num_not_modified == 2
+    finally:
+        server.shutdown()
+
+
+def test_country_lookups_and_conditional_refresh(tmp_path):
+    bindings = _read_label_map_countries()
+    server = _serve_countries(bindings)
+    endpoint_url = f'http://127.0.0.1:{server.server_port}'
+    cache_path = str(tmp_path / 'countries.json')
+
+    try:
+        registry = CountryRegistry(endpoint_url, cache_path)
+
+        assert registry.by_code('rs').name == 'Serbia' and registry.by_code('RS') is registry.by_code('rs')
+        assert all(registry.by_label_id(label_id).code.lower() == code
+                   for code, label_id in load_label_map(config.DATASET_FOLDER).items())
+        assert registry.by_code('xx') is None and registry.by_label_id(0) is None
+
+        # countries are cached, and not requested again within the refresh interval
+        assert len(CountryRegistry(endpoint_url, cache_path)) == NUM_COUNTRIES
+        assert registry.refresh() == ([], [], [])
+        assert server.num_requests == 1
+
+        # an expired list is requested again, but the endpoint reports no changes
+        registry.refresh_interval = 0
+        assert registry.refresh() == ([], [], [])
+        assert server.num_requests == 2
+
+        bindings.pop(0)
+        bindings[0]['flagImage']['value'] += '?v=2'
+        bindings.insert(100, {'code': {'value': 'KX'}, 'countryLabel': {'value': 'Kosovo'},
+                              'flag': {'value': ''}, 'flagImage': {'value': 'Flag_of_Kosovo.svg'}})
+        diff = registry.refresh()
+
+        assert [country.code for country in diff.added] == ['KX']
+        assert [country.code for country in diff.removed] == ['AD']
+        assert [country.code for country in diff.flag_changed] == ['AE']
+        assert registry.by_code('kx').name == 'Kosovo' and registry.by_code('ad') is None
+
+        # label ids keep pointing to the countries of the label map, even
+        # though countries moved in the list
+        label_map = load_label_map(config.DATASET_FOLDER)
+        assert all(registry.by_label_id(label_id).code.lower() == code
+                   for code, label_id in label_map.items() if code != 'ad')
+        assert registry.by_label_id(label_map['ad']) is None
+    finally:
+        server.shutdown()
+
+
+def test_stalled_refresh_uses_cached_countries(tmp_path):
+    bindings = _read_label_map_countries()[:3]
+    server = _serve_countries(bindings)
+    endpoint_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        registry = CountryRegistry(endpoint_url, str(tmp_path / 'countries.json'), refresh_interval=0, timeout=0.2)
+        registry.refresh(forced=True)
+
+        # a stalled endpoint times out, and the cached countries are kept
+        server.delay = 1
+        start = time.perf_counter()
+
+        assert registry.refresh() == ([], [], []) and len(registry) == 3
+        assert time.perf_counter() - start < 1
+    finally:
+        server.shutdown()
+
+    # without cached countries, the refresh fails
+    with pytest.raises(NoCountriesException):
+        CountryRegistry(endpoint_url, str(tmp_path / 'missing.json'), timeout=0.2).refresh(forced=True)
+
+
+def test_label_map_keeps_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DATASET_FOLDER', str(tmp_path))
+    france, kosovo, serbia = (Country(code, name, '', '') for code, name in (
+        ('FR', 'France'), ('KX', 'Kosovo'), ('RS', 'Serbia')))
+
+    country._create_label_map([france, serbia])
+    assert load_label_map(str(tmp_path)) == {'fr': 1, 'rs': 2}
+
+    # a country inserted in the middle of the list gets a new id, while the
+    # other countries keep theirs
+    country._create_label_map([kosovo, serbia])
+    assert load_label_map(str(tmp_path)) == {'rs': 2, 'kx': 3}
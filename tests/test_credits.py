@@ -0,0 +1,106 @@
+import os
+
+from utils import credits
+
+_LABEL_MAP = """\
+item {
+  id: 1
+  name: "fr"
+  display_name: "France"
+}
+item {
+  id: 2
+  name: "rs"
+  display_name: "Serbia"
+}
+"""
+
+_CREDITS = """\
+country:
+  code: {code}
+  flag: ''
+  name: {name}
+photos:
+- author: {author}
+  download_url: https://example.com/{filename}
+  downloader: url_image
+  filename: {filename}
+  license: CC0 Public Domain
+  url: https://example.com
+"""
+
+
+def _set_mtime(path, modified_at: float):
+    os.utime(str(path), (modified_at, modified_at))
+
+
+def _write_credits(path, author: str, modified_at: float):
+    path.write_text(_CREDITS.format(code='RS', name='Serbia', author=author, filename='rs_00000.jpg'))
+    _set_mtime(path, modified_at)
+
+
+def test_markdown_is_rendered_only_when_sources_change(tmp_path, monkeypatch):
+    # the module is replaced by a copy, so its modification time can be set
+    module_path = tmp_path / 'credits.py'
+    module_path.write_text('')
+    _set_mtime(module_path, 1000)
+    monkeypatch.setattr(credits, '__file__', str(module_path))
+
+    yaml_path = tmp_path / 'credits.yml'
+    markdown_path = tmp_path / 'credits.md'
+    _write_credits(yaml_path, 'First Author', 2000)
+
+    assert credits._create_markdown_from_yaml(str(yaml_path))
+    assert 'by First Author' in markdown_path.read_text()
+
+    # a Markdown file newer than the YAML file and the module is skipped,
+    # even if it differs from the rendering
+    markdown_path.write_text('edited')
+    _set_mtime(markdown_path, 3000)
+    assert not credits._create_markdown_from_yaml(str(yaml_path))
+    assert markdown_path.read_text() == 'edited'
+
+    # a newer YAML file is rendered, and the Markdown file is rewritten only
+    # if its content changes
+    _write_credits(yaml_path, 'Second Author', 4000)
+    assert credits._create_markdown_from_yaml(str(yaml_path))
+    assert 'by Second Author' in markdown_path.read_text()
+
+    # an unchanged file is not written, only marked as up to date
+    _set_mtime(markdown_path, 3000)
+    _set_mtime(yaml_path, 5000)
+    assert not credits._create_markdown_from_yaml(str(yaml_path))
+    assert os.path.getmtime(str(markdown_path)) > 5000
+
+    # a newer module (i.e. template) renders the file again
+    markdown_path.write_text('edited')
+    _set_mtime(markdown_path, 6000)
+    _set_mtime(module_path, 7000)
+    assert credits._create_markdown_from_yaml(str(yaml_path))
+    assert 'by Second Author' in markdown_path.read_text()
+
+    # a forced rendering writes an up-to-date file with the same content
+    _set_mtime(markdown_path, 8000)
+    assert credits._create_markdown_from_yaml(str(yaml_path), forced=True)
+    assert os.path.getmtime(str(markdown_path)) > 8000
+
+
+def test_create_all_markdowns(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    dataset_folder.mkdir()
+    (dataset_folder / 'countries_label_map.pbtxt').write_text(_LABEL_MAP)
+
+    for code, name in (('fr', 'France'), ('rs', 'Serbia')):
+        (dataset_folder / code).mkdir()
+        (dataset_folder / code / 'credits.yml').write_text(
+            _CREDITS.format(code=code.upper(), name=name, author='Author', filename=f'{code}_00000.jpg'))
+
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    assert credits.create_all_markdowns(str(dataset_folder), manifest_path=manifest_path) == 2
+    assert 'France (FR)' in (dataset_folder / 'fr' / 'credits.md').read_text()
+
+    # up-to-date files are skipped, unless rendering is forced
+    assert credits.create_all_markdowns(str(dataset_folder), manifest_path=manifest_path) == 0
+    assert credits.create_all_markdowns(str(dataset_folder), forced=True, num_workers=2,
+                                        manifest_path=manifest_path) == 2
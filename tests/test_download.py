@@ -1,6 +1,12 @@
-import os
 import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
+from download.download_dataset import PhotoItem, download_photos, download_photos_async
+from download.image_dowloader import compute_sha256
+from download.metrics import DownloadMetrics
 from download.url_image_downloader import UrlImageDownloader
 
 
@@ -25,3 +31,128 @@ def test_download_image_from_url():
 
     # remove the downloaded image
     os.remove(image_path)
+
+
+def _serve_files(files: dict) -> HTTPServer:
+    """
+    Starts a local HTTP server in a background thread which serves the given
+    file contents by URL path.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in files:
+                self.send_error(404)
+                return
+
+            content = files[self.path]
+            range_header = self.headers.get('Range')
+
+            if range_header:
+                content = content[int(range_header[len('bytes='):-1]):]
+                self.send_response(206)
+            else:
+                self.send_response(200)
+
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def test_download_photos_from_local_server(tmp_path):
+    files = {f'/{i}.jpg': os.urandom(100_000 + i) for i in range(20)}
+    server = _serve_files(files)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        for engine, download in (('async', download_photos_async), ('threads', download_photos)):
+            items = [PhotoItem(downloader='url_image', download_url=base_url + path,
+                               path=str(tmp_path / f'{engine}_{path[1:]}'))
+                     for path in files]
+            download(items)
+
+            for item, content in zip(items, files.values()):
+                with open(item.path, 'rb') as file:
+                    assert file.read() == content
+
+                assert not os.path.exists(item.path + '.part')
+    finally:
+        server.shutdown()
+
+
+def test_resume_and_repair_downloads(tmp_path):
+    content = os.urandom(300_000)
+    server = _serve_files({'/image.jpg': content})
+    url = f'http://127.0.0.1:{server.server_port}/image.jpg'
+    image_path = str(tmp_path / 'image.jpg')
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    try:
+        for engine, download in (('async', download_photos_async), ('threads', download_photos)):
+            item = PhotoItem(downloader='url_image', download_url=url, path=image_path,
+                             sha256=sha256, size=len(content))
+
+            # resume an interrupted download
+            with open(image_path + '.part', 'wb') as file:
+                file.write(content[:100_000])
+
+            download([item])
+            assert compute_sha256(image_path) == sha256
+            assert not os.path.exists(image_path + '.part')
+
+            # repair a corrupt image
+            with open(image_path, 'r+b') as file:
+                file.write(b'corrupt')
+
+            download([item])
+            assert compute_sha256(image_path) == sha256
+            os.remove(image_path)
+    finally:
+        server.shutdown()
+
+
+def test_download_metrics(tmp_path):
+    content = os.urandom(200_000)
+    server = _serve_files({'/image.jpg': content})
+    host = f'127.0.0.1:{server.server_port}'
+    trace_path = str(tmp_path / 'trace.jsonl')
+
+    try:
+        for engine, download in (('async', download_photos_async), ('threads', download_photos)):
+            items = [PhotoItem(downloader='url_image', download_url=f'http://{host}/image.jpg',
+                               path=str(tmp_path / f'{engine}.jpg'), size=len(content)),
+                     PhotoItem(downloader='url_image', download_url=f'http://{host}/missing.jpg',
+                               path=str(tmp_path / f'{engine}_missing.jpg'))]
+
+            # a failed download does not stop the others
+            with DownloadMetrics(trace_path) as metrics:
+                results = download(items, metrics=metrics)
+                download(items[:1], metrics=metrics)
+
+            results = {result.path: result for result in results}
+            downloaded, failed = results[items[0].path], results[items[1].path]
+
+            assert (downloaded.status, downloaded.http_status) == ('downloaded', 200)
+            assert downloaded.num_bytes == len(content) and downloaded.num_retries == 0
+            assert (failed.status, failed.http_status, failed.num_bytes) == ('failed', 404, 0)
+            assert 'HTTPError' in failed.error or 'ClientResponseError' in failed.error
+            assert [result.status for result in metrics.failed] == ['failed']
+
+            summary, = metrics.host_summaries()
+            assert (summary.host, summary.num_downloaded, summary.num_skipped, summary.num_failed) == (host, 1, 1, 1)
+            assert summary.num_bytes == len(content) and summary.p50_seconds == summary.p99_seconds > 0
+            assert 'Downloaded 1 of 3 photos' in metrics.summary()
+
+            with open(trace_path) as trace_file:
+                assert sorted(json.loads(line)['status'] for line in trace_file) == ['downloaded', 'failed', 'skipped']
+    finally:
+        server.shutdown()
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+import requests
+
+import config
+from download import download_dataset
+from download.download_dataset import PhotoItem, download_photos, download_photos_async
+from download.image_dowloader import ThrottledException, UnexpectedContentException
+from download.scheduler import HostLimits, HostScheduler, TokenBucket, retry_delay
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _serve_flaky_files(content: bytes) -> HTTPServer:
+    """
+    Starts a local HTTP server which throttles the first request of every
+    /throttled path, serves an error page with a successful status at /page,
+    and the content anywhere else. It tracks the highest number of requests
+    it handled at once.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with server.lock:
+                server.num_requests[self.path] += 1
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                first_request = server.num_requests[self.path] == 1
+
+            # keep requests in flight for a while, so they overlap
+            time.sleep(0.05)
+
+            if self.path.startswith('/throttled') and first_request:
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path == '/page':
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', '6')
+                self.end_headers()
+                self.wfile.write(b'<html>')
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            with server.lock:
+                server.in_flight -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.num_requests = defaultdict(int)
+    server.in_flight = server.max_in_flight = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    waits = [bucket.reserve() for _ in range(4)]
+
+    assert waits[:2] == [0, 0] and 0.05 < waits[2] < waits[3] <= 0.2
+
+    bucket.pause(1)
+    assert bucket.reserve() > 1
+    assert TokenBucket(rate=None, burst=1).reserve() == 0
+
+
+def test_retry_delay():
+    assert retry_delay(None, 0) is None
+    assert retry_delay(UnexpectedContentException(), 0) is None
+    assert 0 <= retry_delay(requests.ConnectionError(), 0) <= config.DOWNLOAD_BACKOFF_BASE
+    assert 3 <= retry_delay(ThrottledException('throttled', retry_after=3), 0) <= config.DOWNLOAD_BACKOFF_MAX
+    assert all(retry_delay(ThrottledException('throttled'), i) <= config.DOWNLOAD_BACKOFF_BASE * 2 ** i
+               for i in range(config.DOWNLOAD_MAX_RETRIES))
+    assert retry_delay(ThrottledException('throttled'), config.DOWNLOAD_MAX_RETRIES) is None
+
+
+def test_host_scheduler():
+    urls = [f'http://{host}/{i}' for host in ('a', 'b') for i in range(3)]
+    scheduler = HostScheduler(urls, lambda url: url, max_connections=1, limits=HostLimits(rate=None))
+
+    # hosts take turns, and a host with a download in flight is skipped
+    first, second = scheduler.acquire(), scheduler.acquire()
+    assert (first, second) == ('http://a/0', 'http://b/0')
+
+    scheduler.release(first, retry_in=0)
+    scheduler.release(second)
+    assert [scheduler.acquire() for _ in range(2)] == ['http://a/1', 'http://b/1']
+    assert scheduler.reserve('http://a/1') == 0
+
+
+def test_worker_errors_are_raised(tmp_path, monkeypatch):
+    content = os.urandom(1000)
+    server = _serve_flaky_files(content)
+
+    def fail(self):
+        raise RuntimeError('result failed')
+
+    # an error outside of a download attempt stops all workers, instead of
+    # leaving the caller waiting for results
+    monkeypatch.setattr(download_dataset._PhotoDownload, 'result', fail)
+    items = [PhotoItem(downloader='url_image', download_url=f'http://127.0.0.1:{server.server_port}/{i}.jpg',
+                       path=str(tmp_path / f'{i}.jpg'))
+             for i in range(4)]
+
+    try:
+        with pytest.raises(RuntimeError):
+            download_photos(items, num_workers=2, limits=HostLimits(rate=None))
+    finally:
+        server.shutdown()
+
+
+def test_throttled_and_invalid_downloads(tmp_path):
+    content = os.urandom(10_000)
+    server = _serve_flaky_files(content)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        for engine, download in (('async', download_photos_async), ('threads', download_photos)):
+            items = [PhotoItem(downloader='url_image', download_url=f'{base_url}/throttled/{engine}/{i}.jpg',
+                               path=str(tmp_path / f'{engine}_{i}.jpg'))
+                     for i in range(6)]
+            items.append(PhotoItem(downloader='url_image', download_url=f'{base_url}/page',
+                                   path=str(tmp_path / f'{engine}_page.jpg')))
+            server.max_in_flight = 0
+
+            results = {result.path: result for result in download(items, num_connections_per_host=2)}
+
+            # throttled downloads are retried, and pages are never saved as images
+            assert all(results[item.path].status == 'downloaded' and results[item.path].num_retries == 1
+                       for item in items[:-1])
+            # latency is measured per attempt, without the backoff before the retry
+            assert all(0 < results[item.path].seconds < results[item.path].total_seconds for item in items[:-1])
+            assert results[items[-1].path].status == 'failed' and not os.path.exists(items[-1].path)
+            assert 'UnexpectedContentException' in results[items[-1].path].error
+            assert server.max_in_flight <= 2
+    finally:
+        server.shutdown()
+
+
+def test_present_photos_are_not_rate_limited(tmp_path):
+    content = os.urandom(1000)
+    server = _serve_flaky_files(content)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        for engine, download in (('async', download_photos_async), ('threads', download_photos)):
+            items = [PhotoItem(downloader='url_image', download_url=f'{base_url}/{engine}/{i}.jpg',
+                               path=str(tmp_path / f'{engine}_{i}.jpg'), size=len(content))
+                     for i in range(40)]
+
+            for item in items:
+                with open(item.path, 'wb') as file:
+                    file.write(content)
+
+            # a burst of one request and one request per second would take
+            # 39 seconds if skipped photos waited for the rate limit
+            start = time.perf_counter()
+            results = download(items, limits=HostLimits(rate=1, burst=1))
+
+            assert time.perf_counter() - start < 2
+            assert all(result.status == 'skipped' for result in results) and len(results) == len(items)
+            assert not server.num_requests
+    finally:
+        server.shutdown()
@@ -0,0 +1,35 @@
+import json
+import subprocess
+import sys
+
+import config
+from flagnet.__main__ import SUBCOMMANDS
+
+# dependencies of single subcommands, which the entry point does not load
+_HEAVY_MODULES = ['aiohttp', 'numpy', 'PIL', 'requests', 'selenium']
+
+
+def _run(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=config.PROJECT_ROOT, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def test_entry_point_lists_subcommands():
+    process = _run('-m', 'flagnet', '--help')
+
+    assert process.returncode == 0
+    assert all(name in process.stdout for name in SUBCOMMANDS)
+    assert _run('-m', 'flagnet').returncode == 2
+
+
+def test_subcommand_arguments():
+    process = _run('-m', 'flagnet', 'validate', '--help')
+
+    assert process.returncode == 0 and '--no-cache' in process.stdout
+
+
+def test_entry_point_imports_no_dependencies():
+    process = _run('-c', 'import json, sys; import flagnet.__main__, utils.wikimedia; '
+                         f'print(json.dumps([name for name in {_HEAVY_MODULES!r} if name in sys.modules]))')
+
+    assert process.returncode == 0 and json.loads(process.stdout) == []
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from utils.image_cache import ImageCache, letterbox
+from utils.manifest import Manifest, ManifestImage
+
+_LABEL = """\
+<annotation>
+    <folder>rs</folder>
+    <filename>{0}</filename>
+    <size><width>800</width><height>400</height><depth>3</depth></size>
+    <object>
+        <name>rs</name>
+        <bndbox><xmin>100</xmin><ymin>100</ymin><xmax>300</xmax><ymax>200</ymax></bndbox>
+    </object>
+</annotation>
+"""
+
+
+def _create_manifest(dataset_folder) -> Manifest:
+    (dataset_folder / 'rs').mkdir(parents=True)
+    images = []
+
+    for i, color in enumerate(('red', 'blue')):
+        filename = f'rs_{i:05}.jpg'
+        Image.new('RGB', (800, 400), color).save(str(dataset_folder / 'rs' / filename))
+        (dataset_folder / 'rs' / filename.replace('.jpg', '.xml')).write_text(_LABEL.format(filename))
+        images.append(ManifestImage('rs', filename, 1, 800, 400, [[100, 100, 300, 200]],
+                                    None, None, None, None, None, None, None))
+
+    return Manifest(images, str(dataset_folder))
+
+
+def test_letterbox():
+    image, scale, padding = letterbox(Image.new('RGB', (800, 400), 'white'), (416, 416))
+
+    assert image.shape == (416, 416, 3) and image.dtype == np.uint8
+    assert scale == 416 / 800 and padding == (0, 104)
+    assert image[0, 0].tolist() == [128, 128, 128] and image[208, 208].tolist() == [255, 255, 255]
+
+
+def test_incremental_image_cache(tmp_path):
+    manifest = _create_manifest(tmp_path / 'dataset')
+    cache_folder = str(tmp_path / 'cache')
+
+    assert ImageCache(cache_folder).build(manifest, num_workers=2) == 2
+
+    image_cache = ImageCache(cache_folder)
+    assert image_cache.names() == ['rs/rs_00000.jpg', 'rs/rs_00001.jpg']
+    assert np.allclose(image_cache.boxes('rs/rs_00000.jpg'), [[52, 156, 156, 208]])
+    assert image_cache.images()[image_cache.slot('rs/rs_00001.jpg'), 208, 208, 2] > 200
+
+    # nothing changed, so nothing is decoded again
+    assert image_cache.build(manifest, num_workers=2) == 0
+
+    image_path = manifest.path(manifest.by_file('rs_00000.jpg'))
+    Image.new('RGB', (800, 400), 'green').save(image_path)
+    os.utime(image_path, ns=(0, 0))
+
+    assert ImageCache(cache_folder).build(manifest, num_workers=2) == 1
+    assert ImageCache(cache_folder).images()[image_cache.slot('rs/rs_00000.jpg'), 208, 208, 1] > 100
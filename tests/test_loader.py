@@ -0,0 +1,46 @@
+import numpy as np
+from PIL import Image
+
+from utils.loader import BatchLoader
+from utils.manifest import Manifest, ManifestImage
+
+
+def _create_manifest(dataset_folder) -> Manifest:
+    (dataset_folder / 'rs').mkdir(parents=True)
+    images = []
+
+    for i, boxes in enumerate(([[100, 100, 300, 200]], [[0, 0, 400, 200], [400, 200, 800, 400]], [[10, 10, 20, 20]])):
+        filename = f'rs_{i:05}.jpg'
+        Image.new('RGB', (800, 400), (i * 100, 0, 0)).save(str(dataset_folder / 'rs' / filename))
+        images.append(ManifestImage('rs', filename, 7, 800, 400, boxes, None, None, None, None, None, None, None))
+
+    return Manifest(images, str(dataset_folder))
+
+
+def test_batches_without_augmentation(tmp_path):
+    manifest = _create_manifest(tmp_path / 'dataset')
+
+    with BatchLoader(manifest, batch_size=2, size=(416, 416), num_workers=2, shuffle=False, augment=False) as loader:
+        batches = [(images.copy(), boxes, labels) for images, boxes, labels in loader]
+
+    assert len(loader) == 2 and [len(images) for images, _, _ in batches] == [2, 1]
+
+    images, boxes, labels = batches[0]
+    assert images.shape == (2, 416, 416, 3) and images.dtype == np.uint8
+    assert np.allclose(boxes[0], [[52, 156, 156, 208], [0, 0, 0, 0]])
+    assert labels.tolist() == [[7, 0], [7, 7]]
+
+
+def test_deterministic_shuffling_and_augmentation(tmp_path):
+    manifest = _create_manifest(tmp_path / 'dataset')
+
+    def load_epochs(seed):
+        with BatchLoader(manifest, batch_size=2, size=(64, 64), num_workers=2, prefetch=1, seed=seed) as loader:
+            # stopping an epoch early does not affect the next one
+            next(iter(loader))
+            return [(images.copy(), boxes) for images, boxes, _ in loader]
+
+    first, second, other = load_epochs(1), load_epochs(1), load_epochs(2)
+
+    assert all(np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1]) for a, b in zip(first, second))
+    assert not all(np.array_equal(a[1], b[1]) for a, b in zip(first, other))
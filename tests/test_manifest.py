@@ -0,0 +1,82 @@
+import pytest
+
+from utils.manifest import Manifest, UnknownCountryException
+
+_LABEL_MAP = """\
+item {
+  id: 1
+  name: "fr"
+  display_name: "France"
+}
+item {
+  id: 2
+  name: "rs"
+  display_name: "Serbia"
+}
+"""
+
+_LABEL = """\
+<annotation>
+    <folder>rs</folder>
+    <filename>rs_00000.jpg</filename>
+    <size><width>800</width><height>600</height><depth>3</depth></size>
+    <object>
+        <name>rs</name>
+        <bndbox><xmin>10</xmin><ymin>20</ymin><xmax>300</xmax><ymax>400</ymax></bndbox>
+    </object>
+</annotation>
+"""
+
+_PHOTO = """\
+- author: Author
+  download_url: https://example.com/{0}
+  downloader: url_image
+  filename: {0}
+  license: CC0 Public Domain
+  url: https://example.com
+"""
+
+
+def test_manifest_lookups_and_incremental_load(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    for country in ('fr', 'rs'):
+        (dataset_folder / country).mkdir(parents=True)
+        (dataset_folder / country / 'credits.yml').write_text('photos:\n' + _PHOTO.format(f'{country}_00000.jpg'))
+
+    (dataset_folder / 'countries_label_map.pbtxt').write_text(_LABEL_MAP)
+    (dataset_folder / 'rs' / 'rs_00000.xml').write_text(_LABEL)
+
+    manifest = Manifest.load(str(dataset_folder), manifest_path)
+
+    assert manifest.countries() == ['fr', 'rs']
+    assert manifest.by_file('rs_00000.jpg').boxes == [[10, 20, 300, 400]]
+    assert manifest.by_file('rs_00000.jpg').width == 800
+    assert [image.filename for image in manifest.by_label(1)] == ['fr_00000.jpg']
+    assert [image.filename for image in manifest.images_with_boxes()] == ['rs_00000.jpg']
+
+    # add a photo to a single country
+    (dataset_folder / 'fr' / 'credits.yml').write_text('photos:\n' + _PHOTO.format('fr_00000.jpg')
+                                                       + _PHOTO.format('fr_00001.jpg'))
+    (dataset_folder / 'fr' / 'fr_00001.xml').write_text(_LABEL.replace('rs', 'fr'))
+
+    manifest = Manifest.load(str(dataset_folder), manifest_path)
+
+    assert [image.filename for image in manifest.by_country('FR')] == ['fr_00000.jpg', 'fr_00001.jpg']
+    assert Manifest.load(str(dataset_folder), manifest_path).images == manifest.images
+    assert Manifest.build(str(dataset_folder)).images == manifest.images
+
+    # countries without photos are listed as well (e.g. to render their
+    # credits)
+    (dataset_folder / 'kn').mkdir()
+    (dataset_folder / 'kn' / 'credits.yml').write_text('photos:\n')
+
+    assert Manifest.load(str(dataset_folder), manifest_path).countries() == ['fr', 'kn', 'rs']
+    assert Manifest.build(str(dataset_folder)).countries() == ['fr', 'kn', 'rs']
+
+    # photos of a country missing from the label map have no label id
+    (dataset_folder / 'kn' / 'credits.yml').write_text('photos:\n' + _PHOTO.format('kn_00000.jpg'))
+
+    with pytest.raises(UnknownCountryException, match='kn'):
+        Manifest.load(str(dataset_folder), manifest_path)
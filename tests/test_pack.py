@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+from utils.pack import PackedDataset, pack_dataset
+
+_LABEL_MAP = """\
+item {
+  id: 1
+  name: "rs"
+  display_name: "Serbia"
+}
+item {
+  id: 2
+  name: "fr"
+  display_name: "France"
+}
+"""
+
+_LABEL = """\
+<annotation>
+    <folder>{folder}</folder>
+    <filename>{filename}</filename>
+    <size><width>800</width><height>600</height><depth>3</depth></size>
+    <object>
+        <name>{folder}</name>
+        <bndbox><xmin>{i}</xmin><ymin>20</ymin><xmax>300</xmax><ymax>400</ymax></bndbox>
+    </object>
+</annotation>
+"""
+
+
+def test_pack_and_read_dataset(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    dataset_folder.mkdir()
+    (dataset_folder / 'countries_label_map.pbtxt').write_text(_LABEL_MAP)
+    images = {}
+
+    for country in ('fr', 'rs'):
+        os.makedirs(dataset_folder / country)
+        # a name longer than 64 bytes in UTF-8 is not truncated
+        filenames = [f'{country}_{i:05}.jpg' for i in range(4)] + [f'{country}_{"ž" * 40}_00004.jpg']
+        (dataset_folder / country / 'credits.yml').write_text(
+            'photos:\n' + ''.join(f'- filename: {filename}\n' for filename in filenames), encoding='utf-8')
+
+        for i, filename in enumerate(filenames):
+            images[f'{country}/{filename}'] = os.urandom(1000 + 13 * i)
+            (dataset_folder / country / filename).write_bytes(images[f'{country}/{filename}'])
+            (dataset_folder / country / filename.replace('.jpg', '.xml')).write_text(
+                _LABEL.format(folder=country, filename=filename, i=i))
+
+    # small shards make the dataset span multiple shards
+    assert pack_dataset(str(dataset_folder), str(tmp_path / 'packed'), shard_size=3000,
+                        manifest_path=str(tmp_path / 'manifest.json')) == len(images)
+
+    with PackedDataset(str(tmp_path / 'packed')) as dataset:
+        assert len(dataset.shards) > 1
+        assert [record.name for record in dataset] == sorted(images)
+
+        for i, record in enumerate(dataset):
+            assert bytes(record.image) == images[record.name]
+            assert dataset[i].name == record.name
+            assert record.width == 800 and record.height == 600
+            assert np.array_equal(record.boxes, [[int(record.name[-5]), 20, 300, 400]])
+            assert record.label_ids.tolist() == [1 if record.name.startswith('rs') else 2]
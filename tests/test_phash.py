@@ -0,0 +1,110 @@
+import numpy as np
+from PIL import Image
+
+from utils.phash import BKTree, HashIndex, compute_hashes, hamming_distance
+
+
+def _create_image(seed: int, size=(640, 480)) -> Image.Image:
+    random = np.random.RandomState(seed)
+    image = Image.new('RGB', size, tuple(random.randint(0, 256, 3)))
+
+    for _ in range(6):
+        x, y = random.randint(0, size[0] - 100), random.randint(0, size[1] - 100)
+        image.paste(tuple(random.randint(0, 256, 3)), (x, y, x + random.randint(50, 300), y + random.randint(50, 300)))
+
+    return image
+
+
+def test_bk_tree_matches_linear_search():
+    random = np.random.RandomState(0)
+    values = [int(value) for value in random.randint(0, 2 ** 62, 2000, dtype=np.int64)]
+    # near-duplicates of every hash, and an exact duplicate
+    values += [value ^ (1 << (i % 64)) ^ (1 << (i * 7 % 64)) for i, value in enumerate(values)] + values[:1]
+    tree = BKTree()
+
+    for i, value in enumerate(values):
+        tree.add(value, i)
+
+    assert len(tree) == len(values)
+
+    for value in values[:50]:
+        for radius in (0, 2, 12):
+            expected = [i for i, other in enumerate(values) if hamming_distance(value, other) <= radius]
+            found = tree.query(value, radius)
+
+            assert sorted(item for _, item in found) == expected
+            distances = [distance for distance, _ in found]
+            assert distances == sorted(hamming_distance(value, values[item]) for _, item in found)
+
+
+def test_hash_index(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    (dataset_folder / 'rs').mkdir(parents=True)
+    (dataset_folder / 'fr').mkdir()
+
+    # a resized and recompressed copy is a near-duplicate, other images are not
+    _create_image(0).save(str(dataset_folder / 'rs' / 'rs_00000.jpg'), quality=95)
+    _create_image(0).resize((800, 600)).save(str(dataset_folder / 'rs' / 'rs_00001.jpg'), quality=60)
+    _create_image(1).save(str(dataset_folder / 'rs' / 'rs_00002.jpg'))
+    _create_image(2).save(str(dataset_folder / 'fr' / 'fr_00000.jpg'))
+    _create_image(3).save(str(tmp_path / 'new.jpg'))
+
+    index_path = str(tmp_path / 'phash.json')
+    index = HashIndex(str(dataset_folder), path=index_path)
+
+    assert index.update(num_workers=2) == 4
+    assert index.clusters() == {'rs': [['rs/rs_00000.jpg', 'rs/rs_00001.jpg']]}
+
+    # new images are checked against the index, without hashing the dataset
+    assert [name for _, name in index.query(str(dataset_folder / 'rs' / 'rs_00001.jpg'))] == [
+        'rs/rs_00001.jpg', 'rs/rs_00000.jpg']
+    assert index.query(str(tmp_path / 'new.jpg')) == []
+
+    # only modified images are hashed again
+    (dataset_folder / 'fr' / 'fr_00000.jpg').unlink()
+    _create_image(0).save(str(dataset_folder / 'fr' / 'fr_00001.jpg'))
+    index = HashIndex(str(dataset_folder), path=index_path)
+
+    assert len(index) == 4 and index.update(num_workers=1) == 1 and len(index) == 4
+    assert list(index.clusters()) == ['rs']
+    assert index.hash_of('fr/fr_00001.jpg') == compute_hashes(str(dataset_folder / 'fr' / 'fr_00001.jpg'))[1]
+
+
+def test_add_images(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    (dataset_folder / 'rs').mkdir(parents=True)
+    (dataset_folder / 'fr').mkdir()
+
+    _create_image(0).save(str(dataset_folder / 'rs' / 'rs_00000.jpg'))
+    _create_image(1).save(str(dataset_folder / 'rs' / 'rs_00001.jpg'))
+    _create_image(2).save(str(dataset_folder / 'rs' / 'rs_00002.jpg'))
+    index_path = str(tmp_path / 'phash.json')
+    HashIndex(str(dataset_folder), path=index_path).update(num_workers=1)
+
+    # new images are checked against the index and against each other, but
+    # not against images of other countries
+    _create_image(0).resize((800, 600)).save(str(dataset_folder / 'rs' / 'rs_00003.jpg'), quality=60)
+    _create_image(3).save(str(dataset_folder / 'rs' / 'rs_00004.jpg'))
+    _create_image(3).save(str(dataset_folder / 'rs' / 'rs_00005.jpg'), quality=70)
+    _create_image(1).save(str(dataset_folder / 'fr' / 'fr_00000.jpg'))
+    new_paths = [str(dataset_folder / 'rs' / f'rs_0000{i}.jpg') for i in (3, 4, 5)] + [
+        str(dataset_folder / 'fr' / 'fr_00000.jpg')]
+    index = HashIndex(str(dataset_folder), path=index_path)
+    near_duplicates = index.add_images(new_paths, num_workers=2)
+
+    assert {name: [other_name for _, other_name in duplicates] for name, duplicates in near_duplicates.items()} == {
+        'rs/rs_00003.jpg': ['rs/rs_00000.jpg'], 'rs/rs_00005.jpg': ['rs/rs_00004.jpg']}
+
+    # added images are saved, so updating the index does not hash them again
+    index = HashIndex(str(dataset_folder), path=index_path)
+    assert len(index) == 7 and index.update(num_workers=1) == 0
+
+    # a replaced image is not compared to its previous version, and removed
+    # images are not reported
+    (dataset_folder / 'rs' / 'rs_00000.jpg').unlink()
+    _create_image(2).save(str(dataset_folder / 'rs' / 'rs_00001.jpg'), quality=70)
+    near_duplicates = index.add_images([str(dataset_folder / 'rs' / 'rs_00001.jpg'),
+                                        str(dataset_folder / 'rs' / 'rs_00003.jpg')])
+
+    assert {name: [other_name for _, other_name in duplicates] for name, duplicates in near_duplicates.items()} == {
+        'rs/rs_00001.jpg': ['rs/rs_00002.jpg']}
@@ -1,45 +1,271 @@
-import urllib.parse
-
-from utils.screenshot import convert_wikicommons_url_to_png_url
-
-
-def test_wikimedia_commons_url_conversion():
-    image_width = 1000
-    commons_urls = [
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Serbia.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20France.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Russia.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20the%20People\'s%20Republic%20of%20China.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20the%20United%20Kingdom.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20the%20United%20States.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Venezuela.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20New%20Zealand.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Kenya.svg',
-        'https://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Brazil.svg'
-    ]
-    png_version_urls = [
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/f/ff/Flag_of_Serbia.svg/{image_width}px-Flag_of_Serbia'
-         '.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/c/c3/Flag_of_France.svg/{image_width}px-Flag_of_France'
-         '.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/f/f3/Flag_of_Russia.svg/{image_width}px-Flag_of_Russia'
-         '.svg.png'),
-        ('https://upload.wikimedia.org/wikipedia/commons/thumb/f/fa/Flag_of_the_People%27s_Republic_of_China.svg/'
-         f'{image_width}px-Flag_of_the_People%27s_Republic_of_China.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/a/ae/Flag_of_the_United_Kingdom.svg/{image_width}px'
-         '-Flag_of_the_United_Kingdom.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/a/a4/Flag_of_the_United_States.svg/{image_width}px-Flag'
-         '_of_the_United_States.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/0/06/Flag_of_Venezuela.svg/{image_width}px-Flag_of'
-         '_Venezuela.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/3/3e/Flag_of_New_Zealand.svg/{image_width}px-Flag_of'
-         '_New_Zealand.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/4/49/Flag_of_Kenya.svg/{image_width}px-Flag_of_Kenya'
-         '.svg.png'),
-        (f'https://upload.wikimedia.org/wikipedia/commons/thumb/0/05/Flag_of_Brazil.svg/{image_width}px-Flag_of_Brazil'
-         '.svg.png')
+import io
+import threading
+import time
+
+import ruamel.yaml as yaml
+from PIL import Image
+
+import pytest
+
+import config
+from download.image_dowloader import compute_sha256
+from utils import screenshot
+from utils.country import Country
+from utils.voc import VocObject, read_voc_annotation
+
+_CREDITS = """\
+country:
+  code: RS
+  flag: 🇷🇸
+  name: Serbia
+photos:
+- author: Vukašin Manojlović
+  download_url: https://raw.githubusercontent.com/iamvukasin/flagnet/master/dataset/rs/rs_00000.jpg
+  downloader: url_image
+  filename: rs_00000.jpg
+  license: CC0 Public Domain
+  url: https://iamvukasin.github.com/flagwaver
+- author: Serbian Armed Forces
+  download_url: https://example.com/rs_00001.jpg
+  downloader: url_image
+  filename: rs_00001.jpg
+  license: CC BY-SA 4.0
+  url: https://example.com
+- author: Vukašin Manojlović
+  download_url: https://raw.githubusercontent.com/iamvukasin/flagnet/master/dataset/rs/rs_00002.jpg
+  downloader: url_image
+  filename: rs_00002.jpg
+  license: CC0 Public Domain
+  url: https://iamvukasin.github.com/flagwaver
+"""
+
+
+class _FakeWebDriver:
+    """
+    A stand-in for a Selenium driver, which records pages it is asked to load
+    and scripts it runs, follows a redirect of the page, and returns
+    scripted screenshots and results of checks whether the flag image is
+    loaded.
+    """
+
+    def __init__(self, frames=(), redirect=None, image_loaded=()):
+        self.calls = []
+        self.frames = iter(frames)
+        self.redirect = redirect
+        self.image_loaded = iter(image_loaded)
+        self.current_url = None
+        self.num_captures = 0
+
+    def get(self, url: str):
+        self.calls.append(('get', url))
+        self.current_url = url.replace(*self.redirect) if self.redirect else url
+
+    def execute_script(self, script: str, *args):
+        self.calls.append(('execute_script', args))
+
+        if script == screenshot._FLAG_IMAGE_LOADED_SCRIPT:
+            return next(self.image_loaded, True)
+
+    def get_screenshot_as_png(self) -> bytes:
+        self.num_captures += 1
+        return next(self.frames)
+
+    def quit(self):
+        self.calls.append(('quit',))
+
+
+def _png(color) -> bytes:
+    png = io.BytesIO()
+    Image.new('RGB', (80, 60), color).save(png, format='PNG')
+    return png.getvalue()
+
+
+def _patch_drivers(monkeypatch, **kwargs) -> list:
+    drivers = []
+
+    def create_driver():
+        drivers.append(_FakeWebDriver(**kwargs))
+        return drivers[-1]
+
+    monkeypatch.setattr(screenshot, '_create_driver', create_driver)
+    return drivers
+
+
+def test_is_same_page():
+    assert screenshot._is_same_page('https://example.com/flagwaver/#?a=1', 'https://example.com/flagwaver#?a=2')
+    assert screenshot._is_same_page('https://example.com/flagwaver', 'https://example.com/flagwaver/#?a=2')
+    assert not screenshot._is_same_page('https://example.com/flagwaver/#?a=1', 'https://example.com/other/#?a=1')
+    assert not screenshot._is_same_page('https://example.com/flagwaver?a=1', 'https://example.com/flagwaver?a=2')
+
+
+def test_pooled_driver_restarts_after_max_pages(monkeypatch):
+    drivers = _patch_drivers(monkeypatch)
+    driver = screenshot.PooledDriver(max_pages=2)
+
+    for i in range(3):
+        driver.load(f'https://example.com/{i}')
+
+    assert len(drivers) == 2 and drivers[0].calls[-1] == ('quit',)
+    assert [call[1] for call in drivers[1].calls] == ['https://example.com/2']
+
+    # a browser is never restarted in the middle of a session
+    with driver.session():
+        for i in range(3, 6):
+            driver.load(f'https://example.com/{i}')
+
+    assert len(drivers) == 2
+    driver.load('https://example.com/6')
+    assert len(drivers) == 3
+
+
+def test_pooled_driver_changes_hash_of_redirected_page(monkeypatch):
+    # the page redirects, so the URL the browser shows differs from the
+    # requested one
+    drivers = _patch_drivers(monkeypatch, redirect=('github.com', 'github.io'))
+    driver = screenshot.PooledDriver()
+
+    driver.load('https://example.github.com/flagwaver/#?direction=90')
+    driver.load('https://example.github.com/flagwaver/#?direction=270')
+    driver.load('https://example.github.com/flagwaver/#?direction=270', reload=True)
+    driver.load('https://example.github.com/other/#?direction=270')
+
+    assert [call[0] for call in drivers[0].calls] == ['get', 'execute_script', 'get', 'get']
+    assert drivers[0].calls[1][1] == ('?direction=270',)
+
+
+def test_wait_until_rendered(monkeypatch):
+    monkeypatch.setattr(screenshot, '_READY_POLL_INTERVAL', 0)
+    previous, moving, settled = _png('red'), _png('gray'), _png('blue')
+    drivers = _patch_drivers(monkeypatch, frames=[previous, previous, moving, previous, previous, moving, settled,
+                                                  settled],
+                             image_loaded=[False])
+    driver = screenshot.PooledDriver()
+    driver.load('https://example.com/flagwaver/#?direction=90')
+
+    # frames are captured only once the flag image is loaded, and until two
+    # consecutive frames do not differ
+    assert screenshot._wait_until_rendered(driver, 'flag.png', timeout=10) == previous
+    assert drivers[0].num_captures == 2
+
+    # after the hash changes, frames which still show the previous flag are
+    # not stable, even two in a row
+    driver.load('https://example.com/flagwaver/#?direction=270')
+    assert screenshot._wait_until_rendered(driver, 'flag.png', timeout=10) == settled
+    assert drivers[0].num_captures == 8
+
+
+def test_wait_until_rendered_times_out(monkeypatch):
+    monkeypatch.setattr(screenshot, '_READY_POLL_INTERVAL', 0.01)
+    colors = ('red', 'blue')
+    drivers = _patch_drivers(monkeypatch, frames=(_png(colors[i % 2]) for i in range(10_000)))
+    driver = screenshot.PooledDriver()
+    driver.load('https://example.com/flagwaver/')
+
+    # a flag which never settles is captured once the timeout expires
+    start = time.perf_counter()
+    screenshot._wait_until_rendered(driver, None, timeout=0.2)
+
+    assert 0.2 <= time.perf_counter() - start < 2
+    assert 2 < drivers[0].num_captures < 100
+
+
+def test_driver_pool(monkeypatch):
+    drivers = _patch_drivers(monkeypatch)
+
+    with pytest.raises(ValueError):
+        screenshot.DriverPool(size=0)
+
+    with screenshot.DriverPool(size=2) as pool:
+        # a borrowed driver is not handed out again until it is returned
+        with pool.acquire() as first, pool.acquire() as second:
+            assert first is not second
+
+        lock = threading.Lock()
+        in_use = set()
+        max_in_use = 0
+
+        def load(driver, i):
+            nonlocal max_in_use
+
+            with lock:
+                assert driver not in in_use
+                in_use.add(driver)
+                max_in_use = max(max_in_use, len(in_use))
+
+            driver.load(f'https://example.com/{i}')
+            time.sleep(0.01)
+
+            with lock:
+                in_use.remove(driver)
+
+            return i
+
+        assert sorted(pool.map(load, range(10))) == list(range(10))
+        assert max_in_use <= 2 and len(drivers) <= 2
+        assert pool._idle_drivers.qsize() == 2
+
+    # closing the pool quits all started browsers
+    assert all(driver.calls[-1] == ('quit',) for driver in drivers)
+
+
+def test_screenshots_keep_other_photos(tmp_path, monkeypatch):
+    country_folder = tmp_path / 'rs'
+    country_folder.mkdir()
+    (country_folder / 'credits.yml').write_text(_CREDITS)
+
+    for file_name in ('rs_00000.jpg', 'rs_00000.xml', 'rs_00001.jpg', 'rs_00002.jpg', 'rs_00002.xml', 'rs_00003.jpg'):
+        (country_folder / file_name).write_bytes(b'')
+
+    png = io.BytesIO()
+    Image.new('RGB', (8, 6)).save(png, format='PNG')
+
+    def capture_flag_variants(num_screenshots, **kwargs):
+        return [(png.getvalue(), 0.5)] * num_screenshots
+
+    # the whole black screenshot differs from the white background
+    png_background = io.BytesIO()
+    Image.new('RGB', (8, 6), 'white').save(png_background, format='PNG')
+    monkeypatch.setattr(screenshot, '_capture_background', lambda *args: png_background.getvalue())
+
+    monkeypatch.setattr(config, 'DATASET_FOLDER', str(tmp_path))
+    country = Country('RS', 'Serbia', '🇷🇸', 'http://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Serbia.svg')
+
+    # more screenshots reuse file names of previous screenshots and take the
+    # first free file names (rs_00003.jpg exists, but is not credited)
+    monkeypatch.setattr(screenshot, '_capture_flag_variants', lambda **kwargs: capture_flag_variants(3))
+
+    with screenshot.ScreenshotEncoder(num_workers=2, queue_size=1) as encoder:
+        wait_times = screenshot._take_country_screenshots(None, encoder, country)
+
+    with open(country_folder / 'credits.yml') as credits_file:
+        photos = yaml.load(credits_file, Loader=yaml.Loader)['photos']
+
+    assert sorted(wait_times) == ['rs_00000.jpg', 'rs_00002.jpg', 'rs_00004.jpg']
+    assert [photo['filename'] for photo in photos] == ['rs_00000.jpg', 'rs_00001.jpg', 'rs_00002.jpg', 'rs_00004.jpg']
+    assert photos[1]['author'] == 'Serbian Armed Forces' and photos[3]['size'] > 0
+    assert photos[3]['sha256'] == compute_sha256(str(country_folder / 'rs_00004.jpg'))
+    assert set(encoder.stage_times) == {'queue', 'decode', 'encode', 'write', 'label'}
+    assert read_voc_annotation(str(country_folder / 'rs_00004.xml')).objects == [VocObject('rs', 0, 0, 7, 5)]
+
+    # fewer screenshots remove previous screenshots and their labels
+    monkeypatch.setattr(screenshot, '_capture_flag_variants', lambda **kwargs: capture_flag_variants(1))
+
+    with screenshot.ScreenshotEncoder(num_workers=1) as encoder:
+        screenshot._take_country_screenshots(None, encoder, country)
+
+    with open(country_folder / 'credits.yml') as credits_file:
+        photos = yaml.load(credits_file, Loader=yaml.Loader)['photos']
+
+    assert [photo['filename'] for photo in photos] == ['rs_00000.jpg', 'rs_00001.jpg']
+    assert sorted(path.name for path in country_folder.iterdir()) == [
+        'credits.yml', 'rs_00000.jpg', 'rs_00000.xml', 'rs_00001.jpg', 'rs_00003.jpg'
     ]
 
-    for commons_url, png_url in zip(commons_urls, png_version_urls):
-        converted_url = convert_wikicommons_url_to_png_url(commons_url, image_width=image_width)
-        assert urllib.parse.unquote(converted_url) == urllib.parse.unquote(png_url)
+    # labels of re-rendered screenshots are removed when they are not
+    # labeled again
+    monkeypatch.setattr(config, 'SCREENSHOT_AUTOLABEL', False)
+
+    with screenshot.ScreenshotEncoder(num_workers=1) as encoder:
+        screenshot._take_country_screenshots(None, encoder, country)
+
+    assert not (country_folder / 'rs_00000.xml').exists()
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from utils.manifest import Manifest, ManifestImage
+from utils.splits import SOURCES, AliasSampler, DatasetSplits, image_source
+
+
+def _create_manifest() -> Manifest:
+    images = []
+
+    # countries with very different numbers of real photos, and generated
+    # screenshots of every country
+    for label_id, (country, num_real) in enumerate((('rs', 40), ('fr', 10), ('kn', 0)), 1):
+        for i in range(num_real + 6):
+            author, url = (('Photographer', 'https://example.com') if i < num_real else
+                           ('Vukašin Manojlović', 'https://iamvukasin.github.com/flagwaver'))
+            images.append(ManifestImage(country, f'{country}_{i:05}.jpg', label_id, 800, 600, [[0, 0, 10, 10]],
+                                        author, 'CC0 Public Domain', url, None, 'url_image', None, None))
+
+    return Manifest(images, 'dataset')
+
+
+def test_alias_sampler():
+    weights = np.array([5, 0, 1, 3, 1], dtype=np.float64)
+    sampler = AliasSampler(weights)
+    samples = sampler.sample(200_000, np.random.RandomState(0))
+
+    assert samples.dtype == np.int64 and samples.shape == (200_000,)
+    assert np.allclose(np.bincount(samples, minlength=len(weights)) / len(samples), weights / weights.sum(), atol=0.005)
+    assert np.array_equal(AliasSampler([2]).sample(3), [0, 0, 0])
+
+    with pytest.raises(ValueError):
+        AliasSampler([0, 0])
+
+
+def test_stratified_splits(tmp_path, monkeypatch):
+    manifest = _create_manifest()
+    splits = DatasetSplits.from_manifest(manifest, val_fraction=0.1, test_fraction=0.2, seed=1)
+
+    assert image_source(manifest.images[0]) == 'real' and image_source(manifest.images[-1]) == 'synthetic'
+
+    # splits cover every image exactly once
+    all_indices = np.concatenate([splits.indices[split] for split in ('train', 'val', 'test')])
+    assert np.array_equal(np.sort(all_indices), np.arange(len(manifest)))
+
+    # every country and source is split by the same fractions
+    test_images = set(splits.image_names[splits.indices['test']])
+    assert sum(name.startswith('rs') and name < 'rs/rs_00040' for name in test_images) == 8
+    assert sum(name.startswith('fr') and name < 'fr/fr_00010' for name in test_images) == 2
+    assert all(sum(name.startswith(country) and name >= f'{country}/{country}_{num_real:05}' for name in test_images)
+               == 1 for country, num_real in (('rs', 40), ('fr', 10), ('kn', 0)))
+
+    # splits can be saved to a file of the working directory
+    monkeypatch.chdir(tmp_path)
+    splits.save('splits.npz')
+    loaded = DatasetSplits.load(str(tmp_path / 'splits.npz'))
+
+    assert all(np.array_equal(loaded.indices[split], splits.indices[split]) for split in splits.indices)
+    assert np.array_equal(loaded.image_names, splits.image_names) and np.array_equal(loaded.sources, splits.sources)
+    assert len(splits.manifest(manifest, 'val')) == len(splits.indices['val'])
+    assert splits.counts()[:2] == [('train', SOURCES[0], 28 + 7), ('train', SOURCES[1], 3 * 4)]
+
+
+def test_balanced_sampling():
+    splits = DatasetSplits.from_manifest(_create_manifest(), seed=0)
+    samples = splits.sample('train', 90_000, seed=3)
+
+    # every drawn image is a training image, and countries are drawn equally
+    # often, however many images they have
+    assert np.isin(samples, splits.indices['train']).all()
+    _, counts = np.unique(splits.countries[samples], return_counts=True)
+    assert np.allclose(counts / len(samples), 1 / 3, atol=0.01)
+    assert np.array_equal(samples, splits.sample('train', 90_000, seed=3))
+
+    # real and synthetic images of every country are drawn equally often
+    samples = splits.sample('train', 100_000, seed=3, by_source=True)
+    _, counts = np.unique(np.char.add(splits.countries[samples], splits.sources[samples].astype(str)),
+                          return_counts=True)
+    assert np.allclose(counts / len(samples), 1 / 5, atol=0.01)
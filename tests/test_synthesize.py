@@ -0,0 +1,103 @@
+import numpy as np
+import ruamel.yaml as yaml
+from PIL import Image
+
+from utils.country import Country
+from utils.phash import HashIndex
+from utils.synthesize import synthesize_dataset, synthesize_flag
+from utils.validate import validate_country_folder
+from utils.voc import read_voc_annotation
+
+_CREDITS = """\
+country:
+  code: RS
+  flag: 🇷🇸
+  name: Serbia
+photos:
+- author: Serbian Armed Forces
+  download_url: https://example.com/rs_00000.jpg
+  downloader: url_image
+  filename: rs_00000.jpg
+  license: CC BY-SA 4.0
+  url: https://example.com
+"""
+
+
+def _create_flag() -> Image.Image:
+    flag = Image.new('RGBA', (900, 600), (200, 30, 30, 255))
+    flag.paste((30, 30, 200, 255), (0, 200, 900, 400))
+    return flag
+
+
+def test_synthesize_flag():
+    image, bounding_box = synthesize_flag(_create_flag(), (400, 300), np.random.RandomState(0))
+    same_image, _ = synthesize_flag(_create_flag(), (400, 300), np.random.RandomState(0))
+    xmin, ymin, xmax, ymax = bounding_box
+
+    assert image.shape == (300, 400, 3) and np.array_equal(image, same_image)
+    assert 0 <= xmin < xmax < 400 and 0 <= ymin < ymax < 300
+
+    # a transparent flag renders the same background, so the flag covers
+    # exactly the pixels which differ
+    background, _ = synthesize_flag(Image.new('RGBA', (900, 600)), (400, 300), np.random.RandomState(0))
+    flag_mask = np.any(image != background, axis=2)
+    columns, rows = np.flatnonzero(flag_mask.any(axis=0)), np.flatnonzero(flag_mask.any(axis=1))
+    assert (columns[0], rows[0], columns[-1], rows[-1]) == bounding_box
+
+
+def test_synthesize_dataset(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    flags_folder = tmp_path / 'flags'
+    (dataset_folder / 'rs').mkdir(parents=True)
+    (dataset_folder / 'rs' / 'credits.yml').write_text(_CREDITS)
+    Image.new('RGB', (800, 600)).save(str(dataset_folder / 'rs' / 'rs_00000.jpg'))
+    flags_folder.mkdir()
+    _create_flag().save(str(flags_folder / 'rs.png'))
+
+    country = Country('RS', 'Serbia', '🇷🇸', 'http://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Serbia.svg')
+    hash_index = HashIndex(str(dataset_folder), path=str(tmp_path / 'phash.json'))
+    num_images = synthesize_dataset([country], num_images=3, dataset_folder=str(dataset_folder),
+                                    flags_folder=str(flags_folder), size=(416, 416), num_workers=2,
+                                    hash_index=hash_index)
+
+    with open(dataset_folder / 'rs' / 'credits.yml') as credits_file:
+        photos = yaml.load(credits_file, Loader=yaml.Loader)['photos']
+
+    assert num_images == 3
+    assert [photo['filename'] for photo in photos] == ['rs_00000.jpg', 'rs_00001.jpg', 'rs_00002.jpg', 'rs_00003.jpg']
+    assert photos[0]['author'] == 'Serbian Armed Forces' and photos[1]['url'] == country.flag_image
+
+    # rendered images are checked and added to the index as they are written
+    assert sorted(HashIndex(str(dataset_folder), path=str(tmp_path / 'phash.json')).entries) == [
+        'rs/rs_00001.jpg', 'rs/rs_00002.jpg', 'rs/rs_00003.jpg']
+
+    annotation = read_voc_annotation(str(dataset_folder / 'rs' / 'rs_00002.xml'))
+    assert (annotation.folder, annotation.width, annotation.height) == ('rs', 416, 416)
+    assert len(annotation.objects) == 1 and annotation.objects[0].name == 'rs'
+
+    # synthesized images are valid dataset images (the other photo has no label)
+    problems = validate_country_folder(str(dataset_folder / 'rs'))
+    assert {problem_type: paths for problem_type, paths in problems.items() if paths} == {
+        'images_without_labels': [str(dataset_folder / 'rs' / 'rs_00000.jpg')]
+    }
+
+
+def test_synthesize_dataset_skips_images_without_flag(tmp_path):
+    dataset_folder = tmp_path / 'dataset'
+    flags_folder = tmp_path / 'flags'
+    (dataset_folder / 'rs').mkdir(parents=True)
+    (dataset_folder / 'rs' / 'credits.yml').write_text(_CREDITS)
+    flags_folder.mkdir()
+
+    # a transparent flag has no pixels in any rendering
+    Image.new('RGBA', (900, 600)).save(str(flags_folder / 'rs.png'))
+
+    country = Country('RS', 'Serbia', '🇷🇸', 'http://commons.wikimedia.org/wiki/Special:FilePath/Flag%20of%20Serbia.svg')
+    num_images = synthesize_dataset([country], num_images=2, dataset_folder=str(dataset_folder),
+                                    flags_folder=str(flags_folder), size=(416, 416), num_workers=1)
+
+    with open(dataset_folder / 'rs' / 'credits.yml') as credits_file:
+        photos = yaml.load(credits_file, Loader=yaml.Loader)['photos']
+
+    assert num_images == 0 and [photo['filename'] for photo in photos] == ['rs_00000.jpg']
+    assert sorted(path.name for path in (dataset_folder / 'rs').iterdir()) == ['credits.yml']
@@ -0,0 +1,84 @@
+import io
+
+import pytest
+from PIL import Image
+
+from utils.validate import InvalidImageException, read_jpeg_size, validate_country_folder, validate_dataset
+
+_LABEL = """\
+<annotation>
+    <folder>{folder}</folder>
+    <filename>{filename}</filename>
+    <object>
+        <name>{folder}</name>
+        <bndbox><xmin>1</xmin><ymin>2</ymin><xmax>3</xmax><ymax>4</ymax></bndbox>
+    </object>
+</annotation>
+"""
+
+
+def test_read_jpeg_size(tmp_path):
+    for mode, size, options in (('RGB', (800, 600), {}), ('L', (417, 1000), {}),
+                                ('RGB', (1024, 768), {'progressive': True}), ('CMYK', (500, 500), {})):
+        path = str(tmp_path / 'image.jpg')
+        Image.new(mode, size).save(path, format='JPEG', **options)
+        assert read_jpeg_size(path) == size + (len(mode),)
+
+    png = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(png, format='PNG')
+    (tmp_path / 'image.png').write_bytes(png.getvalue())
+
+    with pytest.raises(InvalidImageException):
+        read_jpeg_size(str(tmp_path / 'image.png'))
+
+
+def _create_country_folder(folder):
+    folder.mkdir(parents=True)
+    (folder / 'credits.yml').write_text("""\
+country:
+  code: RS
+photos:
+- {author: a, download_url: b, downloader: c, filename: rs_00000.jpg, license: d, url: e}
+- {author: a, download_url: b, downloader: c, filename: rs_00001.jpg, license: d, url: e}
+- {author: a, download_url: b, downloader: c, filename: rs_00003.jpg, license: d, url: e}
+""")
+
+    Image.new('RGB', (800, 600)).save(str(folder / 'rs_00000.jpg'))
+    Image.new('RGB', (100, 600)).save(str(folder / 'rs_00001.jpg'))
+    Image.new('RGB', (800, 600)).save(str(folder / 'rs_00002.jpg'))
+    (folder / 'rs_00000.xml').write_text(_LABEL.format(folder='rs', filename='rs_00000.jpg'))
+    (folder / 'rs_00001.xml').write_text(_LABEL.format(folder='fr', filename='rs_00001.jpg'))
+
+
+def test_validate_country_folder(tmp_path):
+    folder = tmp_path / 'rs'
+    _create_country_folder(folder)
+    problems = validate_country_folder(str(folder))
+
+    assert problems['invalid_image_size'] == [str(folder / 'rs_00001.jpg')]
+    assert problems['invalid_credits'] == []
+    assert problems['images_not_found'] == [str(folder / 'rs_00003.jpg')]
+    assert problems['images_without_credits'] == [str(folder / 'rs_00002.jpg')]
+    assert problems['images_without_labels'] == [str(folder / 'rs_00002.jpg')]
+    assert problems['images_with_invalid_labels'] == [str(folder / 'rs_00001.jpg')]
+
+
+def test_validation_cache(tmp_path):
+    folder = tmp_path / 'dataset' / 'rs'
+    _create_country_folder(folder)
+    cache_path = str(tmp_path / 'validation.json')
+
+    def validate():
+        problems = validate_dataset(str(tmp_path / 'dataset'), num_workers=2, cache_path=cache_path)
+        assert problems == validate_dataset(str(tmp_path / 'dataset'), num_workers=2, cache_path=None)
+        return problems
+
+    assert validate()['images_with_invalid_labels'] == [str(folder / 'rs_00001.jpg')]
+
+    # fix the label and make another image too small
+    (folder / 'rs_00001.xml').write_text(_LABEL.format(folder='rs', filename='rs_00001.jpg'))
+    Image.new('RGB', (800, 100)).save(str(folder / 'rs_00000.jpg'))
+    problems = validate()
+
+    assert problems['images_with_invalid_labels'] == []
+    assert problems['invalid_image_size'] == [str(folder / 'rs_00000.jpg'), str(folder / 'rs_00001.jpg')]
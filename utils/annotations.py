@@ -0,0 +1,172 @@
+import os
+from typing import Dict
+
+import numpy as np
+
+import config
+from utils.manifest import Manifest
+
+_ANNOTATIONS_FILE = 'annotations.npz'
+
+
+class AnnotationStore:
+    """
+    Bounding boxes of all labeled objects in the dataset, stored in
+    contiguous NumPy arrays, so checks, statistics and conversions run as
+    vectorized operations over all boxes at once.
+
+    Boxes are (xmin, ymin, xmax, ymax) rows in pixels. Every box has a label
+    id and an index of the image it belongs to, and every image has a name
+    (country/filename) and a size (width, height).
+    """
+
+    def __init__(self, boxes: np.ndarray, label_ids: np.ndarray, image_index: np.ndarray,
+                 image_sizes: np.ndarray, image_names: np.ndarray):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.label_ids = np.asarray(label_ids, dtype=np.int32)
+        self.image_index = np.asarray(image_index, dtype=np.int32)
+        self.image_sizes = np.asarray(image_sizes, dtype=np.float32).reshape(-1, 2)
+        self.image_names = np.asarray(image_names, dtype=str)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @classmethod
+    def from_manifest(cls, manifest: Manifest) -> 'AnnotationStore':
+        """
+        Collects bounding boxes of all images with labels in the manifest.
+
+        :param manifest: the manifest of the dataset
+        :return: the annotation store
+        """
+
+        images = manifest.images_with_boxes()
+        num_boxes = [len(image.boxes) for image in images]
+
+        boxes = [box for image in images for box in image.boxes]
+        label_ids = np.repeat([image.label_id for image in images], num_boxes)
+        image_index = np.repeat(np.arange(len(images)), num_boxes)
+        image_sizes = [(image.width or 0, image.height or 0) for image in images]
+        image_names = [f'{image.country}/{image.filename}' for image in images]
+
+        return cls(boxes, label_ids, image_index, image_sizes, image_names)
+
+    @classmethod
+    def build(cls, dataset_folder: str = config.DATASET_FOLDER) -> 'AnnotationStore':
+        return cls.from_manifest(Manifest.load(dataset_folder))
+
+    def save(self, path: str = os.path.join(config.CACHE_FOLDER, _ANNOTATIONS_FILE)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, boxes=self.boxes, label_ids=self.label_ids, image_index=self.image_index,
+                 image_sizes=self.image_sizes, image_names=self.image_names)
+
+    @classmethod
+    def load(cls, path: str = os.path.join(config.CACHE_FOLDER, _ANNOTATIONS_FILE)) -> 'AnnotationStore':
+        with np.load(path) as data:
+            return cls(data['boxes'], data['label_ids'], data['image_index'], data['image_sizes'],
+                       data['image_names'])
+
+    @property
+    def box_sizes(self) -> np.ndarray:
+        """
+        Widths and heights of all boxes as an [N, 2] array.
+        """
+
+        return self.boxes[:, 2:] - self.boxes[:, :2]
+
+    @property
+    def box_image_sizes(self) -> np.ndarray:
+        """
+        Widths and heights of images every box belongs to as an [N, 2] array.
+        """
+
+        return self.image_sizes[self.image_index]
+
+    def invalid_boxes(self) -> np.ndarray:
+        """
+        Finds boxes which are empty or lie (partly) outside of their image.
+
+        :return: a boolean mask of invalid boxes
+        """
+
+        image_sizes = self.box_image_sizes
+
+        return (np.any(self.box_sizes <= 0, axis=1)
+                | np.any(self.boxes < 0, axis=1)
+                | np.any(self.boxes[:, 2:] > image_sizes, axis=1)
+                | np.any(image_sizes <= 0, axis=1))
+
+    def invalid_images(self) -> np.ndarray:
+        """
+        Returns sorted names of images which have at least one invalid box.
+        """
+
+        return np.unique(self.image_names[self.image_index[self.invalid_boxes()]])
+
+    def stats_by_label(self) -> Dict[int, Dict[str, float]]:
+        """
+        Calculates the number of boxes, and the mean and standard deviation
+        of relative box sizes (box area compared to image area) and aspect
+        ratios (box width compared to box height) for every label.
+
+        :return: a dictionary of statistics by label id
+        """
+
+        if not len(self):
+            return {}
+
+        sizes = self.box_sizes
+        image_sizes = self.box_image_sizes
+        valid = ~self.invalid_boxes()
+        relative_areas = np.where(valid, np.prod(sizes, axis=1) / np.maximum(np.prod(image_sizes, axis=1), 1), 0)
+        aspect_ratios = np.where(valid, sizes[:, 0] / np.maximum(sizes[:, 1], 1), 0)
+
+        label_ids = self.label_ids
+        counts = np.bincount(label_ids, weights=valid)
+
+        def mean_and_std(values):
+            mean = np.bincount(label_ids, weights=values) / np.maximum(counts, 1)
+            variance = np.bincount(label_ids, weights=values ** 2) / np.maximum(counts, 1) - mean ** 2
+            return mean, np.sqrt(np.maximum(variance, 0))
+
+        area_mean, area_std = mean_and_std(relative_areas)
+        aspect_mean, aspect_std = mean_and_std(aspect_ratios)
+
+        return {int(label_id): {'count': int(counts[label_id]),
+                                'relative_area_mean': float(area_mean[label_id]),
+                                'relative_area_std': float(area_std[label_id]),
+                                'aspect_ratio_mean': float(aspect_mean[label_id]),
+                                'aspect_ratio_std': float(aspect_std[label_id])}
+                for label_id in np.unique(label_ids)}
+
+    def to_yolo(self) -> np.ndarray:
+        """
+        Converts boxes to YOLO format, i.e. (x center, y center, width,
+        height) rows relative to the image size.
+
+        :return: an [N, 4] array of boxes
+        """
+
+        image_sizes = np.tile(np.maximum(self.box_image_sizes, 1), 2)
+        centers = (self.boxes[:, :2] + self.boxes[:, 2:]) / 2
+
+        return np.hstack([centers, self.box_sizes]) / image_sizes
+
+    def to_coco(self) -> np.ndarray:
+        """
+        Converts boxes to COCO format, i.e. (x, y, width, height) rows in
+        pixels.
+
+        :return: an [N, 4] array of boxes
+        """
+
+        return np.hstack([self.boxes[:, :2], self.box_sizes])
+
+
+if __name__ == '__main__':
+    store = AnnotationStore.build()
+    store.save()
+    print(f'Saved {len(store)} bounding boxes of {len(store.image_names)} images')
+
+    for image_name in store.invalid_images():
+        print(f'Invalid bounding box in {image_name}')
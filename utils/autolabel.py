@@ -0,0 +1,158 @@
+import argparse
+import os
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils.voc import VocAnnotation, VocObject, write_voc_annotation
+
+# minimum difference of a color channel (0-255) between a capture and the
+# background for a pixel to belong to the flag (JPEG artifacts stay below)
+_DIFFERENCE_THRESHOLD = 40
+
+# minimum number of flag pixels in a row or a column of the bounding box, so
+# single noisy pixels do not stretch the box
+_MIN_LINE_PIXELS = 3
+
+# number of images which are compared to the background at once
+BATCH_SIZE = 16
+
+
+def compute_bounding_boxes(images: np.ndarray, background: np.ndarray) -> np.ndarray:
+    """
+    Finds bounding boxes of flags in captures of a page by comparing them to
+    a capture of the same page without the flag, e.g. Flagwaver with a
+    transparent flag image. All images are compared at once, in a single
+    pass over the whole batch.
+
+    :param images: a uint8 array of captures of shape [N, height, width, 3]
+    :param background: a uint8 array of the capture without the flag of
+    shape [height, width, 3]
+    :return: an int32 array of shape [N, 4] of (xmin, ymin, xmax, ymax) rows
+    in pixels, with -1 in rows of images where no flag was found
+    """
+
+    difference = np.abs(images.astype(np.int16) - background).max(axis=3)
+    mask = difference > _DIFFERENCE_THRESHOLD
+
+    columns = mask.sum(axis=1) >= _MIN_LINE_PIXELS
+    rows = mask.sum(axis=2) >= _MIN_LINE_PIXELS
+    found = columns.any(axis=1) & rows.any(axis=1)
+
+    # the first and the last flag column and row of every image
+    xmin = columns.argmax(axis=1)
+    xmax = columns.shape[1] - 1 - columns[:, ::-1].argmax(axis=1)
+    ymin = rows.argmax(axis=1)
+    ymax = rows.shape[1] - 1 - rows[:, ::-1].argmax(axis=1)
+
+    return np.where(found[:, np.newaxis], np.stack([xmin, ymin, xmax, ymax], axis=1), -1).astype(np.int32)
+
+
+def load_images(image_paths: List[str]) -> np.ndarray:
+    """
+    Decodes images of the same size into a single array, without stacking
+    separate copies of them.
+
+    :param image_paths: paths to images
+    :return: a uint8 array of shape [N, height, width, 3]
+    """
+
+    images = None
+
+    for i, image_path in enumerate(image_paths):
+        with Image.open(image_path) as image:
+            image = np.asarray(image.convert('RGB'))
+
+        if images is None:
+            images = np.empty((len(image_paths),) + image.shape, dtype=np.uint8)
+
+        images[i] = image
+
+    return images
+
+
+def write_labels(image_paths: List[str], bounding_boxes: np.ndarray, image_size: Tuple[int, int]) -> int:
+    """
+    Writes a Pascal VOC label file next to every image, which labels the
+    found flag as the flag of the country the image belongs to.
+
+    :param image_paths: paths to images in country folders
+    :param bounding_boxes: bounding boxes of flags (see:
+    compute_bounding_boxes)
+    :param image_size: width and height of all images
+    :return: number of written label files (images without a found flag are
+    skipped)
+    """
+
+    num_written = 0
+
+    for image_path, bounding_box in zip(image_paths, bounding_boxes):
+        if bounding_box[0] < 0:
+            continue
+
+        country_code = os.path.basename(os.path.dirname(os.path.abspath(image_path)))
+        width, height = image_size
+
+        write_voc_annotation(VocAnnotation(folder=country_code,
+                                           filename=os.path.basename(image_path),
+                                           width=width,
+                                           height=height,
+                                           depth=3,
+                                           objects=[VocObject(country_code, *map(int, bounding_box))]),
+                             image_path[:-3] + 'xml')
+        num_written += 1
+
+    return num_written
+
+
+def label_batch(image_paths: List[str], background: np.ndarray) -> int:
+    """
+    Labels flags in a batch of images, which are compared to the background
+    all at once (see: compute_bounding_boxes).
+
+    :param image_paths: paths to images in country folders, of the same size
+    as the background
+    :param background: a uint8 array of the capture without the flag of
+    shape [height, width, 3]
+    :return: number of written label files
+    """
+
+    images = load_images(image_paths)
+
+    return write_labels(image_paths, compute_bounding_boxes(images, background), (images.shape[2], images.shape[1]))
+
+
+def label_images(image_paths: List[str], background_path: str, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Labels flags in images in batches by comparing them to the background
+    image (see: label_batch).
+
+    :param image_paths: paths to images in country folders, of the same size
+    as the background image
+    :param background_path: a path to the capture without the flag
+    :param batch_size: number of images which are compared at once
+    :return: number of written label files
+    """
+
+    with Image.open(background_path) as background:
+        background = np.asarray(background.convert('RGB'))
+
+    num_written = 0
+
+    for start in range(0, len(image_paths), batch_size):
+        num_written += label_batch(image_paths[start:start + batch_size], background)
+
+    return num_written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Labels flags in captures by comparing them to the background.')
+    parser.add_argument('background', help='a capture of the same page without the flag')
+    parser.add_argument('images', nargs='+', help='captures in country folders')
+    parser.add_argument('--forced', action='store_true', help='overwrite existing label files')
+    args = parser.parse_args()
+
+    unlabeled_images = [path for path in args.images if args.forced or not os.path.isfile(path[:-3] + 'xml')]
+    num_labels = label_images(unlabeled_images, args.background)
+    print(f'Labeled {num_labels} of {len(unlabeled_images)} images')
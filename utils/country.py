@@ -1,12 +1,14 @@
 import json
 import os
+import time
 from collections import namedtuple
-from typing import List
+from typing import Iterator, List
 
 import requests
 from urllib3.exceptions import MaxRetryError
 
 import config
+from utils.label_map import load_label_map
 
 _WIKIDATA_QUERY_ENDPOINT_URL = 'https://query.wikidata.org/sparql'
 _COUNTRIES_CACHE_FILE = 'countries.json'
@@ -30,6 +32,7 @@ ORDER BY ?code
 """
 
 Country = namedtuple('Country', ['code', 'name', 'flag', 'flag_image'])
+CountryDiff = namedtuple('CountryDiff', ['added', 'removed', 'flag_changed'])
 
 
 class NoCountriesException(Exception):
@@ -40,47 +43,7 @@ class NoCountriesException(Exception):
     pass
 
 
-def load_countries(forced: bool = False) -> List[Country]:
-    """
-    Returns a list of countries from the cache folder (if it exists) or
-    requests the newest list of countries from Wikidata, creates a cached copy
-    and returns the list. It is useful because the list of countries rarely
-    changes and there is no need to get it from Wikidata.
-
-    :param forced: an indicator to skip the cached countries and to load
-    the newest list of countries from Wikidata
-    :return: a list of countries with two-letter country code, name, flag
-    emoji, and flag image URL from WikiCommons for every country
-    """
-
-    cache_file_path = f'{config.CACHE_FOLDER}/{_COUNTRIES_CACHE_FILE}'
-
-    # create cache folder or skip if it exists
-    os.makedirs(f'{config.CACHE_FOLDER}', exist_ok=True)
-
-    # load the list of countries from a JSON file located in the cache folder
-    if not forced and os.path.isfile(cache_file_path):
-        with open(cache_file_path) as file:
-            data = json.load(file)
-            return [Country(**country) for country in data['countries']]
-
-    no_connection = False
-    r = None
-
-    try:
-        r = requests.get(_WIKIDATA_QUERY_ENDPOINT_URL, params={
-            'format': 'json',
-            'query': _WIKIDATA_COUNTRIES_QUERY
-        })
-    except MaxRetryError:
-        no_connection = True
-
-    assert r is not None
-
-    if no_connection or r.status_code != 200:
-        raise NoCountriesException('Cannot load countries from Wikidata')
-
-    data = r.json()
+def _parse_countries(data: dict) -> List[Country]:
     countries = []
 
     # parse Wikidata endpoint result
@@ -95,16 +58,227 @@ def load_countries(forced: bool = False) -> List[Country]:
                           flag_image=country_flag_image)
         countries.append(country)
 
-    # save the country list as a JSON file in the cache folder
-    with open(cache_file_path, 'w') as file:
-        countries_dict = {
-            'countries': [country._asdict() for country in countries]
-        }
-        json.dump(countries_dict, file)
-
     return countries
 
 
+def diff_countries(old_countries: List[Country], new_countries: List[Country]) -> CountryDiff:
+    """
+    Compares two lists of countries.
+
+    :param old_countries: a list of countries before a change
+    :param new_countries: a list of countries after a change
+    :return: countries which were added, removed, or whose flag image
+    changed (as they are after the change)
+    """
+
+    old_by_code = {country.code: country for country in old_countries}
+    new_by_code = {country.code: country for country in new_countries}
+
+    return CountryDiff(added=[country for code, country in new_by_code.items() if code not in old_by_code],
+                       removed=[country for code, country in old_by_code.items() if code not in new_by_code],
+                       flag_changed=[country for code, country in new_by_code.items()
+                                     if code in old_by_code and old_by_code[code].flag_image != country.flag_image])
+
+
+class CountryRegistry:
+    """
+    Countries loaded once from the cache folder (or Wikidata), with lookups
+    by country code and by label id in constant time. Label ids are the ids
+    of the label map of the dataset, so they stay the same when countries
+    are added to or removed from the list.
+
+    The list is refreshed from the endpoint at most once per refresh
+    interval. A refresh is a conditional request, so the query is not
+    evaluated and sent again if the endpoint reports it has not changed
+    (see: ETag and Last-Modified HTTP headers).
+    """
+
+    def __init__(self, endpoint_url: str = _WIKIDATA_QUERY_ENDPOINT_URL,
+                 cache_path: str = os.path.join(config.CACHE_FOLDER, _COUNTRIES_CACHE_FILE),
+                 refresh_interval: float = config.COUNTRIES_REFRESH_INTERVAL,
+                 timeout: float = config.COUNTRIES_REQUEST_TIMEOUT, dataset_folder: str = config.DATASET_FOLDER):
+        """
+        :param endpoint_url: a URL of the SPARQL endpoint countries are
+        queried from
+        :param cache_path: a path to the JSON file where countries are cached
+        :param refresh_interval: number of seconds after which countries are
+        requested from the endpoint again
+        :param timeout: timeout in seconds of a request to the endpoint
+        :param dataset_folder: a path to the dataset folder with the label
+        map label ids are looked up in
+        """
+
+        self.endpoint_url = endpoint_url
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.dataset_folder = dataset_folder
+        self._countries = None
+        self._by_code = {}
+        self._codes_by_label_id = None
+        self._fetched_at = 0
+        self._etag = None
+        self._last_modified = None
+
+        if os.path.isfile(cache_path):
+            with open(cache_path) as file:
+                data = json.load(file)
+
+            self._set_countries([Country(**country) for country in data['countries']])
+            self._fetched_at = data.get('fetched_at', 0)
+            self._etag = data.get('etag')
+            self._last_modified = data.get('last_modified')
+
+    @property
+    def countries(self) -> List[Country]:
+        """
+        Returns all countries, sorted by country code. If no countries are
+        cached, they are requested from the endpoint.
+        """
+
+        if self._countries is None:
+            self.refresh(forced=True)
+
+        return self._countries
+
+    def __len__(self) -> int:
+        return len(self.countries)
+
+    def __iter__(self) -> Iterator[Country]:
+        return iter(self.countries)
+
+    def by_code(self, code: str) -> Country:
+        """
+        Returns the country with the given two-letter country code (in any
+        case), or None if there is no such country.
+        """
+
+        if self._countries is None:
+            self.refresh(forced=True)
+
+        return self._by_code.get(code.upper())
+
+    def by_label_id(self, label_id: int) -> Country:
+        """
+        Returns the country with the given label id of the label map, or None
+        if there is no such country.
+        """
+
+        if self._codes_by_label_id is None:
+            self._codes_by_label_id = {id_: code for code, id_ in load_label_map(self.dataset_folder).items()}
+
+        code = self._codes_by_label_id.get(label_id)
+
+        return self.by_code(code) if code is not None else None
+
+    def _set_countries(self, countries: List[Country]):
+        self._countries = countries
+        self._by_code = {country.code.upper(): country for country in countries}
+
+    def refresh(self, forced: bool = False) -> CountryDiff:
+        """
+        Requests countries from the endpoint if the refresh interval elapsed
+        since the last request, and caches them.
+
+        :param forced: an indicator to request the full list of countries
+        regardless of the refresh interval and the cached version
+        :return: countries which were added, removed, or whose flag image
+        changed since the previous list
+        """
+
+        unchanged = CountryDiff(added=[], removed=[], flag_changed=[])
+
+        if not forced and self._countries is not None and time.time() - self._fetched_at < self.refresh_interval:
+            return unchanged
+
+        headers = {}
+
+        if not forced and self._countries is not None:
+            if self._etag is not None:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified is not None:
+                headers['If-Modified-Since'] = self._last_modified
+
+        try:
+            r = requests.get(self.endpoint_url, params={
+                'format': 'json',
+                'query': _WIKIDATA_COUNTRIES_QUERY
+            }, headers=headers, timeout=self.timeout)
+        except (MaxRetryError, requests.RequestException) as err:
+            if self._countries is None:
+                raise NoCountriesException('Cannot load countries from Wikidata')
+
+            # the cached countries are used, and requested again next time
+            print(f'Cannot load countries from Wikidata, using cached countries: {err!r}')
+            return unchanged
+
+        if r.status_code == 304:
+            diff = unchanged
+        elif r.status_code == 200:
+            old_countries = self._countries or []
+            self._set_countries(_parse_countries(r.json()))
+            self._etag = r.headers.get('ETag')
+            self._last_modified = r.headers.get('Last-Modified')
+            diff = diff_countries(old_countries, self._countries)
+        else:
+            raise NoCountriesException('Cannot load countries from Wikidata')
+
+        self._fetched_at = time.time()
+        self._save()
+
+        return diff
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+        # save the country list as a JSON file in the cache folder
+        with open(self.cache_path, 'w') as file:
+            json.dump({
+                'countries': [country._asdict() for country in self._countries],
+                'fetched_at': self._fetched_at,
+                'etag': self._etag,
+                'last_modified': self._last_modified
+            }, file)
+
+
+_registry = None
+
+
+def get_registry() -> CountryRegistry:
+    """
+    Returns the country registry shared by the whole process, which is
+    created on the first call.
+    """
+
+    global _registry
+
+    if _registry is None:
+        _registry = CountryRegistry()
+
+    return _registry
+
+
+def load_countries(forced: bool = False) -> List[Country]:
+    """
+    Returns a list of countries from the cache folder (if it exists) or
+    requests the newest list of countries from Wikidata, creates a cached copy
+    and returns the list. It is useful because the list of countries rarely
+    changes and there is no need to get it from Wikidata.
+
+    :param forced: an indicator to skip the cached countries and to load
+    the newest list of countries from Wikidata
+    :return: a list of countries with two-letter country code, name, flag
+    emoji, and flag image URL from WikiCommons for every country
+    """
+
+    registry = get_registry()
+
+    if forced:
+        registry.refresh(forced=True)
+
+    return list(registry.countries)
+
+
 def _create_country_folders(countries: List[Country]):
     """
     Creates country folders inside the dataset folder. Every country folder
@@ -129,16 +303,33 @@ def _create_country_folders(countries: List[Country]):
 
 def _create_label_map(countries: List[Country]):
     """
-    Creates a label map for countries in protocol buffers format.
+    Creates a label map for countries in protocol buffers format. Countries
+    of an existing label map keep their ids, and new countries get ids after
+    the highest one, so labels of the dataset keep pointing to the same
+    countries.
 
     :param countries: a list of countries loaded from the cache folder or
     Wikidata
     """
 
-    with open(f'{config.DATASET_FOLDER}/countries_label_map.pbtxt', 'w') as file:
-        for id_, country in enumerate(countries):
+    label_map_path = f'{config.DATASET_FOLDER}/countries_label_map.pbtxt'
+    label_ids = load_label_map(config.DATASET_FOLDER) if os.path.isfile(label_map_path) else {}
+    next_id = max(label_ids.values(), default=0) + 1
+    items = []
+
+    for country in countries:
+        code = country.code.lower()
+
+        if code not in label_ids:
+            label_ids[code] = next_id
+            next_id += 1
+
+        items.append((label_ids[code], country))
+
+    with open(label_map_path, 'w') as file:
+        for id_, country in sorted(items):
             file.write(('item {\n'
-                        f'  id: {id_ + 1}\n'
+                        f'  id: {id_}\n'
                         f'  name: "{country.code.lower()}"\n'
                         f'  display_name: "{country.name}"\n'
                         '}\n'))
@@ -1,10 +1,15 @@
-import glob
+import argparse
+import itertools
+import os
 import re
+from multiprocessing import Pool
+from typing import Callable, Iterator, List
 
 import jinja2
 import ruamel.yaml as yaml
 
 import config
+from utils.manifest import Manifest
 
 _CREDITS_TEMPLATE = """\
 # {{country.flag}} Photo credits for flags of {{country.name}} ({{country.code}})
@@ -17,24 +22,169 @@ No photos added
 {% endif %}
 """
 
+# the template is compiled once and shared by all countries
+_TEMPLATE = jinja2.Template(_CREDITS_TEMPLATE)
 
-def _create_markdown_from_yaml(yaml_file_path: str):
+# credits are only read, so the safe loader (backed by the C extension of
+# ruamel.yaml, when available) is enough
+_YAML = yaml.YAML(typ='safe', pure=False)
+
+
+def _create_markdown_from_yaml(yaml_file_path: str, forced: bool = False) -> bool:
     """
     Creates photo credits file in Markdown from a YAML file, based on
-    predefined template.
+    predefined template. The Markdown file is skipped if it is newer than
+    both the YAML file and the template, and rewritten only if its content
+    changes (unless the rendering is forced).
 
     :param yaml_file_path: a file path of a YAML file which is used
     as a data input source
+    :param forced: an indicator to render and write the Markdown file even
+    if it is up to date
+    :return: an indicator whether the Markdown file was written
     """
 
     markdown_file_path = re.sub(r'\.ya?ml', '.md', yaml_file_path)
+    markdown_exists = os.path.isfile(markdown_file_path)
+
+    if not forced and markdown_exists:
+        sources_modified_at = max(os.path.getmtime(yaml_file_path), os.path.getmtime(__file__))
+
+        if os.path.getmtime(markdown_file_path) >= sources_modified_at:
+            return False
+
+    with open(yaml_file_path) as yaml_file:
+        data = _YAML.load(yaml_file)
+
+    markdown = _TEMPLATE.render(data)
+
+    if markdown_exists and not forced:
+        with open(markdown_file_path) as markdown_file:
+            if markdown_file.read() == markdown:
+                # mark the unchanged file as up to date, so it is not
+                # rendered again next time
+                os.utime(markdown_file_path)
+                return False
+
+    with open(markdown_file_path, 'w') as markdown_file:
+        markdown_file.write(markdown)
+
+    return True
+
+
+def allocate_photo_filenames(country_folder: str, photos: List[dict],
+                             is_replaced: Callable[[dict], bool]) -> Iterator[str]:
+    """
+    Generates file names of photos which replace a group of photos in photo
+    credits (see: merge_photo_credits). File names of the replaced photos
+    are reused first, then the first free file names (which are neither
+    credited nor present in the country folder) follow.
+
+    :param country_folder: a path to the country folder
+    :param photos: credits of all photos of the country
+    :param is_replaced: a function which tells whether a photo in the
+    credits belongs to the replaced group
+    :return: a generator of file names
+    """
+
+    yield from sorted(photo['filename'] for photo in photos if is_replaced(photo))
+
+    country_code = os.path.basename(os.path.normpath(country_folder))
+    taken_filenames = {photo['filename'] for photo in photos}
+
+    for i in itertools.count():
+        filename = f'{country_code}_{i:05}.jpg'
 
-    with open(yaml_file_path) as yaml_file, open(markdown_file_path, 'w') as markdown_file:
+        if filename not in taken_filenames and not os.path.exists(os.path.join(country_folder, filename)):
+            yield filename
+
+
+def merge_photo_credits(yaml_file_path: str, photos: List[dict], is_replaced: Callable[[dict], bool]) -> List[dict]:
+    """
+    Replaces a group of photos in photo credits (e.g. generated photos) with
+    the given photos, keeping all other photos. Photos are sorted by file
+    name.
+
+    :param yaml_file_path: a file path of a YAML file with photo credits
+    :param photos: credits of photos which replace the group
+    :param is_replaced: a function which tells whether a photo in the
+    credits belongs to the replaced group
+    :return: credits of photos of the replaced group which are not among the
+    given photos (by file name)
+    """
+
+    with open(yaml_file_path) as yaml_file:
         data = yaml.load(yaml_file, Loader=yaml.Loader)
-        template = jinja2.Template(_CREDITS_TEMPLATE)
-        markdown_file.write(template.render(data))
+
+    kept_photos = []
+    removed_photos = []
+    new_filenames = {photo['filename'] for photo in photos}
+
+    for photo in data.get('photos') or []:
+        if not is_replaced(photo):
+            kept_photos.append(photo)
+        elif photo['filename'] not in new_filenames:
+            removed_photos.append(photo)
+
+    # an empty list of photos is left empty (see: utils.country)
+    data['photos'] = sorted(kept_photos + list(photos), key=lambda photo: photo['filename']) or None
+
+    with open(yaml_file_path, 'w') as yaml_file:
+        yaml.dump(data, yaml_file, default_flow_style=False, allow_unicode=True, width=4096)
+
+    return removed_photos
+
+
+def remove_photo_files(country_folder: str, photos: List[dict]):
+    """
+    Removes files of the given photos, and their labels, from the country
+    folder (e.g. photos removed from credits by merge_photo_credits).
+    """
+
+    for photo in photos:
+        for path in (photo['filename'], photo['filename'][:-3] + 'xml'):
+            path = os.path.join(country_folder, path)
+
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def create_all_markdowns(dataset_folder: str = config.DATASET_FOLDER, forced: bool = False,
+                         num_workers: int = 1, manifest_path: str = None) -> int:
+    """
+    Creates photo credits files in Markdown for all countries of the
+    manifest. Every Markdown file is still rendered from its credits.yml,
+    since credits list the name and flag of the country, which the manifest
+    does not index.
+
+    :param dataset_folder: a path to the dataset folder
+    :param forced: an indicator to render Markdown files even if they are up
+    to date
+    :param num_workers: number of processes (1 renders in the current
+    process)
+    :param manifest_path: a path to the manifest file of the dataset (if
+    None, the manifest in the cache folder is used)
+    :return: number of written Markdown files
+    """
+
+    manifest = Manifest.load(dataset_folder, manifest_path)
+    yaml_file_paths = [os.path.join(dataset_folder, country, 'credits.yml') for country in manifest.countries()]
+    forced_flags = [forced] * len(yaml_file_paths)
+
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            written = pool.starmap(_create_markdown_from_yaml, zip(yaml_file_paths, forced_flags), chunksize=16)
+    else:
+        written = list(map(_create_markdown_from_yaml, yaml_file_paths, forced_flags))
+
+    return sum(written)
 
 
 if __name__ == '__main__':
-    for country_folder in glob.glob(f'{config.DATASET_FOLDER}/*/'):
-        _create_markdown_from_yaml(f'{country_folder}credits.yml')
+    parser = argparse.ArgumentParser(description='Creates photo credits in Markdown from credits.yml files.')
+    parser.add_argument('--forced', action='store_true', help='render credits even if they are up to date')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes')
+    args = parser.parse_args()
+
+    num_written = create_all_markdowns(forced=args.forced, num_workers=args.workers)
+    print(f'Updated {num_written} photo credits files')
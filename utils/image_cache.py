@@ -0,0 +1,217 @@
+import json
+import os
+from multiprocessing import Pool
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import config
+from utils.manifest import Manifest
+from utils.voc import read_voc_annotation
+
+_IMAGES_FILE = 'images.u8'
+_INDEX_FILE = 'index.json'
+_IMAGE_CACHE_VERSION = 1
+
+# color of the padding around letterboxed images
+_PADDING_COLOR = 128
+
+
+def letterbox(image: Image.Image, size: Tuple[int, int]) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Resizes an image to fit the given size while keeping its aspect ratio,
+    and pads it to the given size.
+
+    :param image: an image to resize
+    :param size: width and height of the resized image
+    :return: the resized image as a uint8 array of shape [height, width, 3],
+    the scale of the image and horizontal and vertical padding in pixels
+    """
+
+    width, height = size
+    scale = min(width / image.width, height / image.height)
+    resized_width = max(1, round(image.width * scale))
+    resized_height = max(1, round(image.height * scale))
+
+    # let the JPEG decoder downscale the image by a power of two first, which
+    # is much faster than decoding the image in full size
+    image.draft('RGB', (resized_width, resized_height))
+    image = image.convert('RGB').resize((resized_width, resized_height), Image.BILINEAR)
+
+    pad_x = (width - resized_width) // 2
+    pad_y = (height - resized_height) // 2
+    letterboxed = np.full((height, width, 3), _PADDING_COLOR, dtype=np.uint8)
+    letterboxed[pad_y:pad_y + resized_height, pad_x:pad_x + resized_width] = np.asarray(image)
+
+    return letterboxed, scale, (pad_x, pad_y)
+
+
+def _fingerprint(path: str) -> List[int]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _cache_image(args) -> Tuple[float, Tuple[int, int], List[List[float]]]:
+    """
+    Decodes and letterboxes a single image and writes it into its slot of
+    the memory-mapped cache.
+
+    :return: the scale and padding of the image, and its bounding boxes
+    rescaled to the letterboxed image
+    """
+
+    images_path, shape, slot, image_path = args
+    images = np.memmap(images_path, dtype=np.uint8, mode='r+', shape=shape)
+
+    with Image.open(image_path) as image:
+        images[slot], scale, padding = letterbox(image, (shape[2], shape[1]))
+
+    images.flush()
+    del images
+
+    xml_file_path = image_path[:-3] + 'xml'
+    boxes = []
+
+    if os.path.isfile(xml_file_path):
+        offsets = np.tile(padding, 2)
+        boxes = [(np.array([obj.xmin, obj.ymin, obj.xmax, obj.ymax]) * scale + offsets).tolist()
+                 for obj in read_voc_annotation(xml_file_path).objects]
+
+    return scale, padding, boxes
+
+
+class ImageCache:
+    """
+    A cache of dataset images, decoded and letterboxed to the network input
+    size once, and stored in a memory-mapped uint8 array of shape
+    [capacity, height, width, 3]. Bounding boxes are rescaled to the
+    letterboxed images. An image is decoded again only if its JPEG or label
+    file changes.
+    """
+
+    def __init__(self, folder: str = config.IMAGE_CACHE_FOLDER, size: Tuple[int, int] = config.MIN_IMAGE_SIZE):
+        self.folder = folder
+        self.size = tuple(size)
+        self.entries = {}
+        self._capacity = 0
+
+        index_path = os.path.join(folder, _INDEX_FILE)
+
+        if os.path.isfile(index_path):
+            with open(index_path) as file:
+                index = json.load(file)
+
+            if index['version'] == _IMAGE_CACHE_VERSION and tuple(index['size']) == self.size:
+                self.entries = index['entries']
+                self._capacity = index['capacity']
+
+    @property
+    def _images_path(self) -> str:
+        return os.path.join(self.folder, _IMAGES_FILE)
+
+    def _shape(self, capacity: int) -> Tuple[int, int, int, int]:
+        width, height = self.size
+        return capacity, height, width, 3
+
+    def _reserve(self, capacity: int):
+        """
+        Grows the memory-mapped file to hold at least the given number of
+        images, keeping images which are already cached.
+        """
+
+        if capacity <= self._capacity and os.path.isfile(self._images_path):
+            return
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        with open(self._images_path, 'ab') as file:
+            file.truncate(int(np.prod(self._shape(capacity))))
+
+        self._capacity = capacity
+
+    def build(self, manifest: Manifest = None, num_workers: int = config.NUM_IMAGE_CACHE_WORKERS) -> int:
+        """
+        Caches all downloaded images of the dataset. Only images which are
+        not cached yet, or whose JPEG or label file changed since they were
+        cached, are decoded (in parallel on a pool of processes).
+
+        :param manifest: the manifest of the dataset (if None, it is loaded
+        from the cache folder)
+        :param num_workers: number of processes
+        :return: number of decoded images
+        """
+
+        manifest = manifest or Manifest.load()
+        sources = {}
+
+        for image in manifest:
+            image_path = manifest.path(image)
+            image_fingerprint = _fingerprint(image_path)
+
+            if image_fingerprint is not None:
+                sources[f'{image.country}/{image.filename}'] = (image_path, image_fingerprint
+                                                                + (_fingerprint(image_path[:-3] + 'xml') or []))
+
+        # forget removed images and reuse their slots
+        self.entries = {name: entry for name, entry in self.entries.items() if name in sources}
+        used_slots = {entry['slot'] for entry in self.entries.values()}
+        free_slots = (slot for slot in range(len(sources)) if slot not in used_slots)
+        stale = []
+
+        for name, (image_path, fingerprint) in sorted(sources.items()):
+            entry = self.entries.get(name)
+
+            if entry is None or entry['fingerprint'] != fingerprint:
+                slot = entry['slot'] if entry is not None else next(free_slots)
+                self.entries[name] = {'slot': slot, 'fingerprint': fingerprint}
+                stale.append((name, image_path, slot))
+
+        self._reserve(max([entry['slot'] + 1 for entry in self.entries.values()], default=1))
+        tasks = [(self._images_path, self._shape(self._capacity), slot, image_path) for _, image_path, slot in stale]
+
+        if tasks:
+            with Pool(num_workers) as pool:
+                for (name, _, _), (scale, padding, boxes) in zip(stale, pool.imap(_cache_image, tasks, chunksize=8)):
+                    self.entries[name].update(scale=scale, padding=padding, boxes=boxes)
+
+        with open(os.path.join(self.folder, _INDEX_FILE), 'w') as file:
+            json.dump({
+                'version': _IMAGE_CACHE_VERSION,
+                'size': self.size,
+                'capacity': self._capacity,
+                'entries': self.entries
+            }, file, separators=(',', ':'))
+
+        return len(stale)
+
+    def names(self) -> List[str]:
+        return sorted(self.entries)
+
+    def images(self) -> np.ndarray:
+        """
+        Returns the read-only memory-mapped array of all cache slots (see:
+        slot).
+        """
+
+        return np.memmap(self._images_path, dtype=np.uint8, mode='r', shape=self._shape(self._capacity))
+
+    def slot(self, name: str) -> int:
+        return self.entries[name]['slot']
+
+    def boxes(self, name: str) -> np.ndarray:
+        """
+        Returns bounding boxes of an image, rescaled to the letterboxed image.
+        """
+
+        return np.array(self.entries[name]['boxes'], dtype=np.float32).reshape(-1, 4)
+
+
+if __name__ == '__main__':
+    image_cache = ImageCache()
+    num_decoded = image_cache.build()
+    print(f'Decoded {num_decoded} images, {len(image_cache.entries)} images are cached in {image_cache.folder}')
@@ -0,0 +1,20 @@
+import re
+from typing import Dict
+
+import config
+
+_LABEL_MAP_FILE = 'countries_label_map.pbtxt'
+_LABEL_MAP_ITEM_PATTERN = re.compile(r'item\s*{\s*id:\s*(\d+)\s*name:\s*"([^"]*)"')
+
+
+def load_label_map(dataset_folder: str = config.DATASET_FOLDER) -> Dict[str, int]:
+    """
+    Reads the label map of countries created by utils.country.
+
+    :param dataset_folder: a path to the dataset folder which contains the
+    label map
+    :return: a dictionary of label ids by lowercase two-letter country code
+    """
+
+    with open(f'{dataset_folder}/{_LABEL_MAP_FILE}') as file:
+        return {name: int(id_) for id_, name in _LABEL_MAP_ITEM_PATTERN.findall(file.read())}
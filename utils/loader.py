@@ -0,0 +1,240 @@
+import argparse
+import os
+import time
+from collections import deque
+from multiprocessing import Pool, RawArray
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import config
+from utils.image_cache import letterbox
+from utils.manifest import Manifest
+
+# range of random scales of images relative to the letterbox scale, and of
+# random brightness and contrast factors when augmenting images (images are
+# never flipped, because most flags are not symmetric)
+_AUGMENT_SCALE_RANGE = 0.6, 1.0
+_AUGMENT_COLOR_RANGE = 0.8, 1.2
+
+# shared batch buffers and samples of the dataset in worker processes (see:
+# _init_worker)
+_worker_buffers = None
+_worker_samples = None
+
+
+def _init_worker(buffers: List[RawArray], samples: List[Tuple[str, np.ndarray, int]]):
+    global _worker_buffers, _worker_samples
+    _worker_buffers = buffers
+    _worker_samples = samples
+
+
+def _augment(image: Image.Image, boxes: np.ndarray, size: Tuple[int, int],
+             random: np.random.RandomState) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Resizes an image by a random scale, places it at a random position of a
+    letterbox of the given size and randomly changes its brightness and
+    contrast.
+
+    :return: the augmented image as a uint8 array of shape [height, width, 3],
+    and bounding boxes moved to the augmented image
+    """
+
+    width, height = size
+    scale = min(width / image.width, height / image.height) * random.uniform(*_AUGMENT_SCALE_RANGE)
+    resized_width = max(1, round(image.width * scale))
+    resized_height = max(1, round(image.height * scale))
+
+    image.draft('RGB', (resized_width, resized_height))
+    image = image.convert('RGB').resize((resized_width, resized_height), Image.BILINEAR)
+
+    pad_x = random.randint(0, width - resized_width + 1)
+    pad_y = random.randint(0, height - resized_height + 1)
+
+    pixels = np.asarray(image, dtype=np.float32)
+    mean = pixels.mean()
+    pixels = (pixels - mean) * random.uniform(*_AUGMENT_COLOR_RANGE) + mean * random.uniform(*_AUGMENT_COLOR_RANGE)
+
+    augmented = np.full((height, width, 3), 128, dtype=np.uint8)
+    augmented[pad_y:pad_y + resized_height, pad_x:pad_x + resized_width] = np.clip(pixels, 0, 255)
+
+    return augmented, boxes * scale + np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)
+
+
+def _load_batch(args) -> Tuple[int, List[np.ndarray], List[int]]:
+    """
+    Decodes (and augments) images of a single batch in a worker process, and
+    writes them into a shared batch buffer.
+
+    :return: the buffer id, and bounding boxes and label ids of all images
+    """
+
+    buffer_id, indices, size, augment_seed = args
+    width, height = size
+    images = np.frombuffer(_worker_buffers[buffer_id], dtype=np.uint8).reshape(-1, height, width, 3)
+    batch_boxes = []
+    label_ids = []
+
+    for i, index in enumerate(indices):
+        image_path, boxes, label_id = _worker_samples[index]
+
+        with Image.open(image_path) as image:
+            if augment_seed is not None:
+                # augmentation of an image depends only on the seed, the epoch
+                # and the image, not on the worker or the batch loading it
+                random = np.random.RandomState(augment_seed + [int(index)])
+                images[i], boxes = _augment(image, boxes, size, random)
+            else:
+                images[i], scale, (pad_x, pad_y) = letterbox(image, size)
+                boxes = boxes * scale + np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)
+
+        batch_boxes.append(boxes)
+        label_ids.append(label_id)
+
+    return buffer_id, batch_boxes, label_ids
+
+
+class BatchLoader:
+    """
+    A loader of batches of labeled images of the dataset. Images are decoded
+    and augmented on a pool of processes, which write whole batches into
+    shared memory buffers, so batches are never pickled. At most
+    `prefetch` batches are loaded ahead of the consumer.
+
+    Every batch is a tuple of images (a uint8 array of shape [batch size,
+    height, width, 3]), bounding boxes (a float32 array of shape [batch size,
+    max boxes, 4] of (xmin, ymin, xmax, ymax) rows in pixels of the resized
+    images) and label ids (an int32 array of shape [batch size, max boxes]).
+    Label ids are the ids of the countries label map, and rows of images with
+    fewer boxes are padded with label id 0.
+
+    Note that images of a batch are a view into a shared buffer, which is
+    reused once the next batch is requested. Images have to be copied to be
+    kept longer.
+    """
+
+    def __init__(self, manifest: Manifest = None, batch_size: int = config.LOADER_BATCH_SIZE,
+                 size: Tuple[int, int] = config.MIN_IMAGE_SIZE, num_workers: int = config.NUM_LOADER_WORKERS,
+                 prefetch: int = config.LOADER_PREFETCH, shuffle: bool = True, augment: bool = True,
+                 seed: int = 0, drop_last: bool = False):
+        """
+        :param manifest: the manifest of the dataset (if None, it is loaded
+        from the cache folder)
+        :param batch_size: number of images in a batch
+        :param size: width and height of images in a batch
+        :param num_workers: number of processes
+        :param prefetch: maximum number of batches loaded ahead
+        :param shuffle: an indicator to shuffle images every epoch
+        :param augment: an indicator to randomly scale, move and change
+        colors of images
+        :param seed: a seed of shuffling and augmentation, the same seed
+        gives the same batches
+        :param drop_last: an indicator to drop the last batch of an epoch if
+        it is smaller than the batch size
+        """
+
+        if batch_size <= 0 or prefetch <= 0:
+            raise ValueError(f'Batch size and prefetch have to be positive numbers, '
+                             f'passed {batch_size} and {prefetch}')
+
+        manifest = manifest or Manifest.load()
+        self.samples = [(manifest.path(image), np.array(image.boxes, dtype=np.float32), image.label_id)
+                        for image in manifest.images_with_boxes() if os.path.isfile(manifest.path(image))]
+        self.batch_size = batch_size
+        self.size = tuple(size)
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.augment = augment
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        width, height = self.size
+        self._buffers = [RawArray('B', batch_size * height * width * 3) for _ in range(prefetch)]
+        self._pool = Pool(num_workers, initializer=_init_worker, initargs=(self._buffers, self.samples))
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.samples) // self.batch_size
+
+        return (len(self.samples) + self.batch_size - 1) // self.batch_size
+
+    def _batch_indices(self, epoch: int) -> List[np.ndarray]:
+        indices = np.arange(len(self.samples))
+
+        if self.shuffle:
+            np.random.RandomState([self.seed, epoch]).shuffle(indices)
+
+        return [indices[start:start + self.batch_size]
+                for start in range(0, len(self) * self.batch_size, self.batch_size)]
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Loads batches of the next epoch.
+        """
+
+        width, height = self.size
+        batches = deque(self._batch_indices(self.epoch))
+        free_buffers = deque(range(len(self._buffers)))
+        pending = deque()
+        augment_seed = [self.seed, self.epoch] if self.augment else None
+        self.epoch += 1
+
+        def submit():
+            while batches and free_buffers:
+                indices = batches.popleft()
+                pending.append((len(indices), self._pool.apply_async(
+                    _load_batch, ((free_buffers.popleft(), indices, self.size, augment_seed),))))
+
+        submit()
+
+        try:
+            while pending:
+                num_images, result = pending.popleft()
+                buffer_id, batch_boxes, label_ids = result.get()
+
+                images = np.frombuffer(self._buffers[buffer_id], dtype=np.uint8).reshape(-1, height, width, 3)
+                max_boxes = max(len(boxes) for boxes in batch_boxes)
+                boxes = np.zeros((num_images, max_boxes, 4), dtype=np.float32)
+                labels = np.zeros((num_images, max_boxes), dtype=np.int32)
+
+                for i, (image_boxes, label_id) in enumerate(zip(batch_boxes, label_ids)):
+                    boxes[i, :len(image_boxes)] = image_boxes
+                    labels[i, :len(image_boxes)] = label_id
+
+                yield images[:num_images], boxes, labels
+
+                # the consumer is done with the batch, so its buffer can be reused
+                free_buffers.append(buffer_id)
+                submit()
+        finally:
+            # when the consumer stops early, wait until workers stop writing
+            # into buffers, so the next epoch can reuse them
+            for _, result in pending:
+                result.wait()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the throughput of the batch loader over one epoch.')
+    parser.add_argument('--batch-size', type=int, default=config.LOADER_BATCH_SIZE, help='number of images in a batch')
+    parser.add_argument('--workers', type=int, default=config.NUM_LOADER_WORKERS, help='number of processes')
+    parser.add_argument('--no-augment', action='store_true', help='only letterbox images')
+    args = parser.parse_args()
+
+    with BatchLoader(batch_size=args.batch_size, num_workers=args.workers, augment=not args.no_augment) as loader:
+        start_time = time.perf_counter()
+        num_images = sum(len(images) for images, _, _ in loader)
+        duration = time.perf_counter() - start_time
+
+    print(f'Loaded {num_images} images in {duration:.1f} s ({num_images / duration:.0f} images/s)')
@@ -0,0 +1,273 @@
+import json
+import os
+from collections import defaultdict, namedtuple
+from typing import Dict, Iterator, List
+
+import ruamel.yaml as yaml
+
+import config
+from utils.label_map import load_label_map
+from utils.validate import InvalidImageException, read_jpeg_size
+from utils.voc import read_voc_annotation
+
+_MANIFEST_FILE = 'manifest.json'
+_MANIFEST_VERSION = 2
+_LABEL_MAP_FILE = 'countries_label_map.pbtxt'
+
+ManifestImage = namedtuple('ManifestImage', ['country', 'filename', 'label_id', 'width', 'height', 'boxes',
+                                             'author', 'license', 'url', 'download_url', 'downloader',
+                                             'sha256', 'size'])
+
+_YAML = yaml.YAML(typ='safe', pure=False)
+
+
+class UnknownCountryException(Exception):
+    """
+    Simple exception class to indicate photos of a country which is missing
+    from the label map of the dataset, i.e. photos without a label id.
+    """
+    pass
+
+
+def _stat_mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _stat_country_folders(dataset_folder: str) -> Dict[str, List[int]]:
+    """
+    Returns modification times of every country folder and its credits. A
+    folder changes when images or labels are added to it or removed from it,
+    and credits change when photos are added to them.
+
+    :return: a dictionary of modification times by country code
+    """
+
+    return {entry.name: [entry.stat().st_mtime_ns, _stat_mtime(os.path.join(entry.path, 'credits.yml'))]
+            for entry in os.scandir(dataset_folder) if entry.is_dir() and not entry.name.startswith('.')}
+
+
+def _read_country_images(dataset_folder: str, country: str, label_map: Dict[str, int]) -> List[ManifestImage]:
+    """
+    Reads credits and labels of all photos of a single country.
+
+    :param dataset_folder: a path to the dataset folder
+    :param country: a lowercase two-letter country code
+    :param label_map: a dictionary of label ids by country code
+    :return: a list of images of the country
+    """
+
+    country_folder = os.path.join(dataset_folder, country)
+
+    with open(os.path.join(country_folder, 'credits.yml')) as yaml_file:
+        data = _YAML.load(yaml_file)
+
+    if data['photos'] and country not in label_map:
+        raise UnknownCountryException(f'Photos of {country} have no label id, since the country is missing from '
+                                      f'the label map of {dataset_folder} (see: utils.country)')
+
+    images = []
+
+    for photo_data in data['photos'] or []:
+        image_path = os.path.join(country_folder, photo_data['filename'])
+        xml_file_path = image_path[:-3] + 'xml'
+        width = height = None
+        boxes = []
+
+        if os.path.isfile(xml_file_path):
+            annotation = read_voc_annotation(xml_file_path)
+            width, height = annotation.width, annotation.height
+            boxes = [[obj.xmin, obj.ymin, obj.xmax, obj.ymax] for obj in annotation.objects]
+
+        if width is None and os.path.isfile(image_path):
+            try:
+                width, height, _ = read_jpeg_size(image_path)
+            except InvalidImageException:
+                pass
+
+        images.append(ManifestImage(country=country,
+                                    filename=photo_data['filename'],
+                                    label_id=label_map[country],
+                                    width=width,
+                                    height=height,
+                                    boxes=boxes,
+                                    author=photo_data.get('author'),
+                                    license=photo_data.get('license'),
+                                    url=photo_data.get('url'),
+                                    download_url=photo_data.get('download_url'),
+                                    downloader=photo_data.get('downloader'),
+                                    sha256=photo_data.get('sha256'),
+                                    size=photo_data.get('size')))
+
+    return images
+
+
+class Manifest:
+    """
+    An index of all photos of the dataset, built from photo credits and
+    labels in a single walk over the dataset folder. Photos can be looked up
+    by country, file name and label id in constant time.
+    """
+
+    def __init__(self, images: List[ManifestImage], dataset_folder: str = config.DATASET_FOLDER,
+                 countries: List[str] = None):
+        """
+        :param images: images of the dataset
+        :param dataset_folder: a path to the dataset folder
+        :param countries: codes of all country folders, including those
+        without photos (if None, countries of the images)
+        """
+
+        self.images = images
+        self.dataset_folder = dataset_folder
+        self._countries = sorted(set(countries or []).union(image.country for image in images))
+        self._by_country = defaultdict(list)
+        self._by_file = {}
+        self._by_label = defaultdict(list)
+
+        for image in images:
+            self._by_country[image.country].append(image)
+            self._by_file[image.filename] = image
+            self._by_label[image.label_id].append(image)
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __iter__(self) -> Iterator[ManifestImage]:
+        return iter(self.images)
+
+    def countries(self) -> List[str]:
+        return self._countries
+
+    def by_country(self, country: str) -> List[ManifestImage]:
+        return self._by_country.get(country.lower(), [])
+
+    def by_file(self, filename: str) -> ManifestImage:
+        return self._by_file[filename]
+
+    def by_label(self, label_id: int) -> List[ManifestImage]:
+        return self._by_label.get(label_id, [])
+
+    def images_with_boxes(self) -> List[ManifestImage]:
+        return [image for image in self.images if image.boxes]
+
+    def path(self, image: ManifestImage) -> str:
+        """
+        Returns the local path of an image (which may not be downloaded).
+        """
+
+        return os.path.join(self.dataset_folder, image.country, image.filename)
+
+    @classmethod
+    def build(cls, dataset_folder: str = config.DATASET_FOLDER) -> 'Manifest':
+        """
+        Builds the manifest by reading credits and labels of all countries.
+
+        :param dataset_folder: a path to the dataset folder
+        :return: the manifest of the dataset
+        """
+
+        label_map = load_label_map(dataset_folder)
+        countries = sorted(_stat_country_folders(dataset_folder))
+        images = []
+
+        for country in countries:
+            images.extend(_read_country_images(dataset_folder, country, label_map))
+
+        return cls(images, dataset_folder, countries)
+
+    @classmethod
+    def load(cls, dataset_folder: str = config.DATASET_FOLDER,
+             path: str = None, rebuild: bool = False) -> 'Manifest':
+        """
+        Loads the manifest from the cache folder. Countries whose folder or
+        credits were modified since the manifest was saved are read again,
+        and the updated manifest is saved back.
+
+        Note that labels edited in place do not change the modification time
+        of the country folder. After such edits, the manifest has to be
+        rebuilt (see: rebuild).
+
+        :param dataset_folder: a path to the dataset folder
+        :param path: a path to the manifest file (if None, the manifest is
+        stored in the cache folder)
+        :param rebuild: an indicator to read credits and labels of all
+        countries again
+        :return: the manifest of the dataset
+        """
+
+        path = path or os.path.join(config.CACHE_FOLDER, _MANIFEST_FILE)
+        stored = {}
+
+        if not rebuild and os.path.isfile(path):
+            with open(path) as file:
+                stored = json.load(file)
+
+        label_map_mtime = _stat_mtime(os.path.join(dataset_folder, _LABEL_MAP_FILE))
+        dataset_folder_path = os.path.abspath(dataset_folder)
+
+        if (stored.get('version') != _MANIFEST_VERSION or stored.get('dataset_folder') != dataset_folder_path
+                or stored.get('label_map') != label_map_mtime):
+            stored = {'countries': {}}
+
+        country_folders = _stat_country_folders(dataset_folder)
+        label_map = None
+        images = []
+        modified = set(stored['countries']) != set(country_folders)
+
+        for country in sorted(country_folders):
+            stored_country = stored['countries'].get(country)
+
+            if stored_country is not None and stored_country['mtimes'] == country_folders[country]:
+                images.extend(ManifestImage(*row) for row in stored_country['images'])
+                continue
+
+            label_map = label_map or load_label_map(dataset_folder)
+            images.extend(_read_country_images(dataset_folder, country, label_map))
+            modified = True
+
+        manifest = cls(images, dataset_folder, list(country_folders))
+
+        if modified:
+            manifest.save(path, country_folders, label_map_mtime)
+
+        return manifest
+
+    def save(self, path: str, country_folders: Dict[str, List[int]] = None, label_map_mtime: int = None):
+        """
+        Saves the manifest as a compact JSON file with a row of values for
+        every image.
+
+        :param path: a path to the manifest file
+        :param country_folders: modification times of country folders the
+        manifest was built from (see: load)
+        :param label_map_mtime: modification time of the label map the
+        manifest was built with
+        """
+
+        if country_folders is None:
+            country_folders = _stat_country_folders(self.dataset_folder)
+            label_map_mtime = _stat_mtime(os.path.join(self.dataset_folder, _LABEL_MAP_FILE))
+
+        countries = {country: {'mtimes': mtimes, 'images': []} for country, mtimes in country_folders.items()}
+
+        for image in self.images:
+            countries[image.country]['images'].append(list(image))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'w') as file:
+            json.dump({
+                'version': _MANIFEST_VERSION,
+                'dataset_folder': os.path.abspath(self.dataset_folder),
+                'label_map': label_map_mtime,
+                'columns': list(ManifestImage._fields),
+                'countries': countries
+            }, file, separators=(',', ':'))
+
+
+if __name__ == '__main__':
+    dataset_manifest = Manifest.load(rebuild=True)
+    print(f'Indexed {len(dataset_manifest)} photos of {len(dataset_manifest.countries())} countries')
@@ -0,0 +1,233 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import config
+from utils.manifest import Manifest
+
+_INDEX_FILE = 'index.json'
+_SHARD_DATA_FILE = 'shard-{:05}.bin'
+_SHARD_INDEX_FILE = 'shard-{:05}.idx.npy'
+
+# offsets of records are aligned, so bounding boxes and label ids can be
+# viewed as int32 arrays directly in the memory-mapped shard
+_RECORD_ALIGNMENT = 8
+
+
+def _shard_index_dtype(name_size: int) -> np.dtype:
+    # names are fixed-size byte strings, sized by the longest UTF-8 encoded
+    # name of the shard, so no name is truncated
+    return np.dtype([
+        ('name', f'S{max(name_size, 1)}'),
+        ('image_offset', '<u8'),
+        ('image_size', '<u8'),
+        ('boxes_offset', '<u8'),
+        ('num_boxes', '<u4'),
+        ('width', '<u4'),
+        ('height', '<u4')
+    ])
+
+
+PackedRecord = namedtuple('PackedRecord', ['name', 'image', 'boxes', 'label_ids', 'width', 'height'])
+
+
+def _align(offset: int) -> int:
+    return (offset + _RECORD_ALIGNMENT - 1) // _RECORD_ALIGNMENT * _RECORD_ALIGNMENT
+
+
+def pack_dataset(dataset_folder: str = config.DATASET_FOLDER, output_folder: str = config.PACKED_DATASET_FOLDER,
+                 shard_size: int = config.PACKED_SHARD_SIZE, manifest_path: str = None) -> int:
+    """
+    Packs all downloaded images of the dataset, with their bounding boxes and
+    label ids, into shards of the given size. Every shard is a single binary
+    file of records (encoded JPEG bytes, followed by bounding boxes and label
+    ids) with a separate index of record offsets.
+
+    :param dataset_folder: a path to the dataset folder
+    :param output_folder: a path to the folder where shards are written
+    :param shard_size: size in bytes after which a new shard is started
+    :param manifest_path: a path to the manifest file of the dataset (if
+    None, the manifest in the cache folder is used)
+    :return: number of packed records
+    """
+
+    if shard_size <= 0:
+        raise ValueError(f'Shard size has to be a positive number, passed {shard_size}')
+
+    manifest = Manifest.load(dataset_folder, manifest_path)
+    images = sorted((image for image in manifest if os.path.isfile(manifest.path(image))),
+                    key=lambda image: (image.country, image.filename))
+
+    # remove shards of the previous packing
+    os.makedirs(output_folder, exist_ok=True)
+
+    for path in glob.glob(f'{output_folder}/shard-*'):
+        os.remove(path)
+
+    shards = []
+    shard_file = None
+    shard_index = []
+
+    def close_shard():
+        shard_file.close()
+        name_size = max(len(entry[0]) for entry in shard_index)
+        np.save(f'{output_folder}/{_SHARD_INDEX_FILE.format(len(shards))}',
+                np.array(shard_index, _shard_index_dtype(name_size)))
+        shards.append({
+            'data': _SHARD_DATA_FILE.format(len(shards)),
+            'index': _SHARD_INDEX_FILE.format(len(shards)),
+            'num_records': len(shard_index)
+        })
+
+    for image in images:
+        if shard_file is not None and shard_file.tell() >= shard_size:
+            close_shard()
+            shard_file = None
+
+        if shard_file is None:
+            shard_file = open(f'{output_folder}/{_SHARD_DATA_FILE.format(len(shards))}', 'wb')
+            shard_index = []
+
+        name = f'{image.country}/{image.filename}'
+        boxes = np.array(image.boxes, dtype=np.int32).reshape(-1, 4)
+        label_ids = np.full(len(boxes), image.label_id, dtype=np.int32)
+
+        with open(manifest.path(image), 'rb') as image_file:
+            encoded_image = image_file.read()
+
+        image_offset = shard_file.tell()
+        shard_file.write(encoded_image)
+
+        boxes_offset = _align(shard_file.tell())
+        shard_file.write(b'\0' * (boxes_offset - shard_file.tell()))
+        shard_file.write(boxes.tobytes())
+        shard_file.write(label_ids.tobytes())
+        shard_file.write(b'\0' * (_align(shard_file.tell()) - shard_file.tell()))
+
+        shard_index.append((name.encode('utf-8'), image_offset, len(encoded_image), boxes_offset, len(label_ids),
+                            image.width or 0, image.height or 0))
+
+    if shard_file is not None:
+        close_shard()
+
+    with open(f'{output_folder}/{_INDEX_FILE}', 'w') as file:
+        json.dump({'num_records': len(images), 'shards': shards}, file, indent=2)
+
+    return len(images)
+
+
+class ShardReader:
+    """
+    A reader of a single memory-mapped shard. Records are handed out as
+    zero-copy views into the shard, which stay valid until the reader is
+    closed.
+    """
+
+    def __init__(self, data_path: str, index_path: str):
+        self.index = np.load(index_path)
+        self._file = open(data_path, 'rb')
+
+        # an empty file cannot be memory-mapped
+        if os.path.getsize(data_path) > 0:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = b''
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> PackedRecord:
+        entry = self.index[i]
+        image_offset = int(entry['image_offset'])
+        boxes_offset = int(entry['boxes_offset'])
+        num_boxes = int(entry['num_boxes'])
+
+        image = memoryview(self._buffer)[image_offset:image_offset + int(entry['image_size'])]
+        boxes = np.frombuffer(self._buffer, dtype=np.int32, count=num_boxes * 4, offset=boxes_offset)
+        label_ids = np.frombuffer(self._buffer, dtype=np.int32, count=num_boxes,
+                                  offset=boxes_offset + boxes.nbytes)
+
+        return PackedRecord(name=entry['name'].decode('utf-8'),
+                            image=image,
+                            boxes=boxes.reshape(num_boxes, 4),
+                            label_ids=label_ids,
+                            width=int(entry['width']),
+                            height=int(entry['height']))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                # handed out records are still in use, the mapping is
+                # released once they are garbage collected
+                pass
+
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PackedDataset:
+    """
+    A reader of all shards of a packed dataset. Iterating over the dataset
+    reads shards sequentially.
+    """
+
+    def __init__(self, folder: str = config.PACKED_DATASET_FOLDER):
+        with open(f'{folder}/{_INDEX_FILE}') as file:
+            index = json.load(file)
+
+        self.shards = [ShardReader(f'{folder}/{shard["data"]}', f'{folder}/{shard["index"]}')
+                       for shard in index['shards']]
+        self._shard_ends = np.cumsum([len(shard) for shard in self.shards])
+
+    def __len__(self) -> int:
+        return int(self._shard_ends[-1]) if self.shards else 0
+
+    def __getitem__(self, i: int) -> PackedRecord:
+        if not 0 <= i < len(self):
+            raise IndexError(f'Record index out of range: {i}')
+
+        shard = int(np.searchsorted(self._shard_ends, i, side='right'))
+        shard_start = int(self._shard_ends[shard - 1]) if shard > 0 else 0
+
+        return self.shards[shard][i - shard_start]
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from shard
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packs the dataset into memory-mappable shards.')
+    parser.add_argument('--output', default=config.PACKED_DATASET_FOLDER, help='a folder where shards are written')
+    parser.add_argument('--shard-size', type=int, default=config.PACKED_SHARD_SIZE,
+                        help='size in bytes after which a new shard is started')
+    args = parser.parse_args()
+
+    num_records = pack_dataset(output_folder=args.output, shard_size=args.shard_size)
+    print(f'Packed {num_records} images into {args.output}')
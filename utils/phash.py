@@ -0,0 +1,451 @@
+import argparse
+import functools
+import glob
+import json
+import os
+import sys
+import threading
+from collections import defaultdict
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import config
+
+_PHASH_INDEX_FILE = 'phash.json'
+_PHASH_INDEX_VERSION = 1
+
+# side of the grayscale thumbnail the DCT of pHash is computed from, and of
+# its lowest frequencies which make the hash
+_PHASH_IMAGE_SIZE = 32
+_PHASH_SIZE = 8
+
+HASH_TYPES = ['dhash', 'phash']
+
+
+def hamming_distance(a: int, b: int) -> int:
+    # int.bit_count is not available on Python 3.6
+    return bin(a ^ b).count('1')
+
+
+def _pack_bits(bits: np.ndarray) -> int:
+    return int(''.join('1' if bit else '0' for bit in bits.flatten()), 2)
+
+
+def _load_thumbnail(image: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    # JPEG images are decoded at a reduced scale, which is much faster than
+    # decoding them at full size for a tiny thumbnail
+    image.draft('L', (size[0] * 4, size[1] * 4))
+    return np.asarray(image.convert('L').resize(size, Image.BILINEAR), dtype=np.float64)
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Calculates the difference hash of an image: whether the brightness
+    increases between neighbouring pixels of a 9x8 thumbnail.
+
+    :return: a 64-bit hash
+    """
+
+    thumbnail = _load_thumbnail(image, (_PHASH_SIZE + 1, _PHASH_SIZE))
+    return _pack_bits(thumbnail[:, 1:] > thumbnail[:, :-1])
+
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(size: int) -> np.ndarray:
+    # an orthonormal DCT-II matrix (no SciPy needed for a 32x32 transform)
+    k, n = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+
+    return matrix
+
+
+def phash(image: Image.Image) -> int:
+    """
+    Calculates the perceptual hash of an image: whether the lowest 8x8
+    frequencies of the DCT of a 32x32 thumbnail are above their median.
+
+    :return: a 64-bit hash
+    """
+
+    dct = _dct_matrix(_PHASH_IMAGE_SIZE)
+    thumbnail = _load_thumbnail(image, (_PHASH_IMAGE_SIZE, _PHASH_IMAGE_SIZE))
+    frequencies = (dct @ thumbnail @ dct.T)[:_PHASH_SIZE, :_PHASH_SIZE]
+
+    return _pack_bits(frequencies > np.median(frequencies))
+
+
+def compute_hashes(path: str) -> Tuple[int, int]:
+    """
+    Calculates both hashes of an image file.
+
+    :return: dHash and pHash of the image
+    """
+
+    with Image.open(path) as image:
+        image.draft('L', (_PHASH_IMAGE_SIZE * 4, _PHASH_IMAGE_SIZE * 4))
+        image = image.convert('L')
+
+    return dhash(image), phash(image)
+
+
+def _compute_hashes_of_file(path: str) -> Tuple[str, List[int]]:
+    try:
+        return path, list(compute_hashes(path))
+    except OSError:
+        # a corrupt image is reported by the validator
+        return path, None
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree of hashes in the Hamming space. Every child of a
+    node is keyed by its distance to the node, so a query within a radius
+    visits only children whose key is within the radius of the distance of
+    the queried hash to the node (triangle inequality), instead of every
+    hash.
+    """
+
+    def __init__(self):
+        # a node is a list of the hash, items with the hash, and children by
+        # distance
+        self._root = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item):
+        self._size += 1
+
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+
+        node = self._root
+
+        while True:
+            distance = hamming_distance(value, node[0])
+
+            if distance == 0:
+                node[1].append(item)
+                return
+
+            if distance not in node[2]:
+                node[2][distance] = [value, [item], {}]
+                return
+
+            node = node[2][distance]
+
+    def query(self, value: int, radius: int) -> List[Tuple[int, object]]:
+        """
+        Finds all items whose hash is within the radius of the given hash.
+
+        :param value: a hash
+        :param radius: maximum Hamming distance
+        :return: a list of distances and items, sorted by distance
+        """
+
+        found = []
+        nodes = [self._root] if self._root is not None else []
+
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(value, node[0])
+
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+
+            nodes.extend(child for child_distance, child in node[2].items()
+                         if distance - radius <= child_distance <= distance + radius)
+
+        return sorted(found, key=lambda result: result[0])
+
+
+class HashIndex:
+    """
+    Perceptual hashes of all images of the dataset, stored in the cache
+    folder with fingerprints of the images they were computed from, so only
+    added or modified images are hashed again. Near-duplicates are looked up
+    in a BK-tree, which is built from the stored hashes when it is first
+    queried.
+
+    Tools which add images to the dataset check them with add_images as they
+    are written, so only the new images are hashed.
+    """
+
+    def __init__(self, dataset_folder: str = config.DATASET_FOLDER, hash_type: str = config.DUPLICATE_HASH_TYPE,
+                 path: str = os.path.join(config.CACHE_FOLDER, _PHASH_INDEX_FILE)):
+        """
+        :param dataset_folder: a path to the dataset folder
+        :param hash_type: the hash near-duplicates are compared by, 'dhash'
+        or 'phash'
+        :param path: a path to the index file
+        """
+
+        if hash_type not in HASH_TYPES:
+            raise ValueError(f'Unknown hash type {hash_type}, expected one of {HASH_TYPES}')
+
+        self.dataset_folder = dataset_folder
+        self.hash_type = hash_type
+        self.path = path
+        self.entries = {}
+        self._tree = None
+        self._lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path) as file:
+                data = json.load(file)
+
+            # the index is discarded if it was made for another dataset
+            # folder or by another version
+            if (data.get('version') == _PHASH_INDEX_VERSION
+                    and data.get('dataset_folder') == os.path.abspath(dataset_folder)):
+                self.entries = data['images']
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def hash_of(self, name: str) -> int:
+        """
+        Returns the hash of an image of the index.
+
+        :param name: a path to the image relative to the dataset folder
+        """
+
+        dhash_value, phash_value = self.entries[name][2:]
+        return dhash_value if self.hash_type == 'dhash' else phash_value
+
+    @property
+    def tree(self) -> BKTree:
+        if self._tree is None:
+            self._tree = BKTree()
+
+            for name in self.entries:
+                self._tree.add(self.hash_of(name), name)
+
+        return self._tree
+
+    def update(self, num_workers: int = config.NUM_PHASH_WORKERS) -> int:
+        """
+        Hashes images which were added or modified since the index was
+        saved, on a pool of processes, drops images which were removed, and
+        saves the index.
+
+        :param num_workers: number of processes
+        :return: number of hashed images
+        """
+
+        entries = {}
+        paths = []
+
+        for path in glob.glob(os.path.join(self.dataset_folder, '*', '*.jpg')):
+            name = os.path.relpath(path, self.dataset_folder)
+            stat = os.stat(path)
+            fingerprint = [stat.st_mtime_ns, stat.st_size]
+            cached_entry = self.entries.get(name)
+
+            if cached_entry is not None and cached_entry[:2] == fingerprint:
+                entries[name] = cached_entry
+            else:
+                entries[name] = fingerprint
+                paths.append(path)
+
+        if paths:
+            with Pool(min(num_workers, len(paths))) as pool:
+                for path, hashes in pool.imap_unordered(_compute_hashes_of_file, paths, chunksize=16):
+                    name = os.path.relpath(path, self.dataset_folder)
+
+                    if hashes is None:
+                        del entries[name]
+                    else:
+                        entries[name] = entries[name] + hashes
+
+        self.entries = entries
+        self._tree = None
+        self.save()
+
+        return len(paths)
+
+    def add_images(self, paths: List[str], radius: int = config.DUPLICATE_HAMMING_RADIUS,
+                   num_workers: int = 1) -> Dict[str, List[Tuple[int, str]]]:
+        """
+        Checks new images of the dataset against the index, adds them to the
+        index and saves it. Only the new images are hashed, and every one of
+        them is looked up in the BK-tree (new images are added one by one, so
+        they are checked against each other too). An image which replaces an
+        image of the index with the same name is not compared to its previous
+        version. Images of other threads are added one call at a time.
+
+        :param paths: paths to the new images inside the dataset folder
+        :param radius: maximum Hamming distance of near-duplicates
+        :param num_workers: number of processes the images are hashed on (if
+        1, they are hashed in the calling thread)
+        :return: lists of distances and names of near-duplicates of the same
+        country, by name of every new image which has any, relative to the
+        dataset folder
+        """
+
+        if num_workers > 1 and len(paths) > 1:
+            with Pool(min(num_workers, len(paths))) as pool:
+                hashed = pool.map(_compute_hashes_of_file, paths, chunksize=16)
+        else:
+            hashed = [_compute_hashes_of_file(path) for path in paths]
+
+        near_duplicates = {}
+
+        with self._lock:
+            names = [os.path.relpath(path, self.dataset_folder) for path in paths]
+
+            # hashes cannot be removed from the tree, so it is built again
+            # without previous versions of replaced images
+            if any(name in self.entries for name in names):
+                for name in names:
+                    self.entries.pop(name, None)
+
+                self._tree = None
+
+            for name, (path, hashes) in zip(names, hashed):
+                if hashes is None:
+                    continue
+
+                value = hashes[0] if self.hash_type == 'dhash' else hashes[1]
+                duplicates = []
+
+                for distance, other_name in self.tree.query(value, radius):
+                    if os.path.dirname(other_name) != os.path.dirname(name) or other_name not in self.entries:
+                        continue
+
+                    # images removed since the index was updated are dropped
+                    if os.path.isfile(os.path.join(self.dataset_folder, other_name)):
+                        duplicates.append((distance, other_name))
+                    else:
+                        del self.entries[other_name]
+
+                if duplicates:
+                    near_duplicates[name] = duplicates
+
+                stat = os.stat(path)
+                self.entries[name] = [stat.st_mtime_ns, stat.st_size] + hashes
+                self.tree.add(value, name)
+
+            self.save()
+
+        return near_duplicates
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        with open(self.path, 'w') as file:
+            json.dump({
+                'version': _PHASH_INDEX_VERSION,
+                'dataset_folder': os.path.abspath(self.dataset_folder),
+                'images': self.entries
+            }, file)
+
+    def query(self, path: str, radius: int = config.DUPLICATE_HAMMING_RADIUS) -> List[Tuple[int, str]]:
+        """
+        Finds near-duplicates of an image (e.g. a new one, before it is added
+        to the dataset) among images of the index.
+
+        :param path: a path to the image
+        :param radius: maximum Hamming distance of near-duplicates
+        :return: a list of distances and paths of near-duplicates relative to
+        the dataset folder, sorted by distance
+        """
+
+        dhash_value, phash_value = compute_hashes(path)
+        value = dhash_value if self.hash_type == 'dhash' else phash_value
+
+        return self.tree.query(value, radius)
+
+    def clusters(self, radius: int = config.DUPLICATE_HAMMING_RADIUS) -> Dict[str, List[List[str]]]:
+        """
+        Groups images of every country into clusters of near-duplicates: two
+        images are in the same cluster if they are linked by a chain of
+        images of the country within the radius of each other.
+
+        :param radius: maximum Hamming distance of near-duplicates
+        :return: sorted lists of image paths relative to the dataset folder,
+        of clusters with more than one image, by country code
+        """
+
+        parents = {name: name for name in self.entries}
+
+        def find(name: str) -> str:
+            while parents[name] != name:
+                parents[name] = parents[parents[name]]
+                name = parents[name]
+
+            return name
+
+        for name in self.entries:
+            country = os.path.dirname(name)
+
+            for _, other_name in self.tree.query(self.hash_of(name), radius):
+                if os.path.dirname(other_name) == country:
+                    parents[find(other_name)] = find(name)
+
+        members = defaultdict(list)
+
+        for name in self.entries:
+            members[find(name)].append(name)
+
+        clusters = defaultdict(list)
+
+        for names in members.values():
+            if len(names) > 1:
+                clusters[os.path.dirname(names[0])].append(sorted(names))
+
+        return {country: sorted(country_clusters) for country, country_clusters in sorted(clusters.items())}
+
+
+def print_near_duplicates(near_duplicates: Dict[str, List[Tuple[int, str]]]):
+    """
+    Prints near-duplicates of new images (see: HashIndex.add_images).
+    """
+
+    for name, duplicates in sorted(near_duplicates.items()):
+        print(f'{name} is a near-duplicate of '
+              + ', '.join(f'{other_name} (distance {distance})' for distance, other_name in duplicates))
+
+
+def _iter_check_results(index: HashIndex, paths: List[str], radius: int) -> Iterator[Tuple[str, list]]:
+    for path in paths:
+        yield path, [[name, distance] for distance, name in index.query(path, radius)
+                     if os.path.abspath(os.path.join(index.dataset_folder, name)) != os.path.abspath(path)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finds near-duplicate images with perceptual hashes.')
+    parser.add_argument('--check', nargs='+', metavar='IMAGE',
+                        help='report near-duplicates of the given images instead of duplicates in the dataset')
+    parser.add_argument('--radius', type=int, default=config.DUPLICATE_HAMMING_RADIUS,
+                        help='maximum Hamming distance of near-duplicates')
+    parser.add_argument('--hash', choices=HASH_TYPES, default=config.DUPLICATE_HASH_TYPE,
+                        help='the hash images are compared by')
+    parser.add_argument('--workers', type=int, default=config.NUM_PHASH_WORKERS, help='number of processes')
+    args = parser.parse_args()
+
+    hash_index = HashIndex(hash_type=args.hash)
+
+    if args.check:
+        # images are checked against the saved index, which is kept up to
+        # date by the tools adding images and by runs without --check
+        if not len(hash_index):
+            print('The index is empty, run the tool without --check to hash the dataset', file=sys.stderr)
+
+        report = {path: duplicates for path, duplicates in _iter_check_results(hash_index, args.check, args.radius)
+                  if duplicates}
+    else:
+        num_hashed = hash_index.update(num_workers=args.workers)
+        print(f'Hashed {num_hashed} of {len(hash_index)} images', file=sys.stderr)
+        report = hash_index.clusters(args.radius)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    sys.exit(1 if report else 0)
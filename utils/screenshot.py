@@ -1,36 +1,77 @@
+import argparse
+import base64
+import contextlib
+import functools
 import hashlib
 import io
-import re
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
 import time
 import urllib.parse
+from collections import defaultdict
+from multiprocessing import Pool
+from multiprocessing.pool import AsyncResult, ThreadPool
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
+import numpy as np
 import ruamel.yaml as yaml
-from PIL import Image
-from selenium import webdriver
+from PIL import Image, ImageChops, ImageStat
 
 import config
-from utils.country import load_countries
+from utils.autolabel import BATCH_SIZE, label_batch
+from utils.country import Country, get_registry
+from utils.credits import allocate_photo_filenames, merge_photo_credits, remove_photo_files
+from utils.phash import HashIndex, print_near_duplicates
+from utils.sources import FLAGWAVER_URL, SCREENSHOTS_AUTHOR, is_screenshot
+from utils.wikimedia import convert_wikicommons_url_to_png_url
+
+if TYPE_CHECKING:
+    from selenium import webdriver
 
-_FLAGWAVER_URL = 'https://iamvukasin.github.com/flagwaver'
-_SCREENSHOTS_AUTHOR = 'Vukašin Manojlović'
 _SCREENSHOTS_LICENSE = 'CC0 Public Domain'
+_WAIT_TIMES_CACHE_FILE = 'screenshot_wait_times.json'
+_RENDER_KEYS_CACHE_FILE = 'screenshots.json'
+_BACKGROUND_CACHE_FILE = 'flagwaver_background.png'
+
+# a transparent 1x1 PNG image, which makes Flagwaver render only the
+# background and the pole
+_TRANSPARENT_IMAGE_SOURCE = ('data:image/png;base64,'
+                             'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNgYGBgAAAABQAB'
+                             'eqhXUAAAAABJRU5ErkJggg==')
+
+# time in seconds between two checks whether the flag is rendered
+_READY_POLL_INTERVAL = 0.25
+
+# maximum mean absolute difference of pixel intensities (0-255) between two
+# consecutive frames to consider them unchanged
+_STABLE_FRAME_THRESHOLD = 1.5
 
+# size of downscaled grayscale frames which are compared to each other
+_FRAME_THUMBNAIL_SIZE = 80, 60
 
-def _take_screenshot(url: str, screenshot_path: str, timeout: float = 0.0):
+_FLAG_IMAGE_LOADED_SCRIPT = """\
+var source = decodeURIComponent(arguments[0]);
+return performance.getEntriesByType('resource').some(function (entry) {
+    return decodeURIComponent(entry.name) === source && entry.responseEnd > 0;
+});
+"""
+
+
+def _create_driver() -> 'webdriver.Chrome':
     """
-    Takes a screenshot of a page located at the given URL and saves it onto
-    the given path. Optionally, it can wait some time after page loads, and
-    then takes a screenshot.
+    Starts a new headless Google Chrome instance with the window size of
+    the generated screenshots.
 
-    :param url: a page URL which will be saved as a screenshot
-    :param screenshot_path: a file path where the taken screenshot will be
-    saved (has to include .jpg extension)
-    :param timeout: time in seconds to wait between loading the page and
-    taking a screenshot
+    :return: a Selenium driver of the started browser
     """
 
-    if screenshot_path[-4:] != '.jpg':
-        raise ValueError('Screenshot has to be saved as a JPG file')
+    # Selenium is imported only when a browser is started, so helpers of
+    # this module load quickly
+    from selenium import webdriver
 
     # hide all Chrome UI elements (aka headless mode) and make page content
     # fill the window - this will make screenshot to be the same size as the
@@ -42,90 +83,748 @@ def _take_screenshot(url: str, screenshot_path: str, timeout: float = 0.0):
     # note: ChromeDriver has to be properly installed to make this work
     driver = 'chromedriver'
     driver = webdriver.Chrome(driver, options=options)
-
-    driver.get(url)
     driver.set_window_size(*config.SCREENSHOT_IMAGE_SIZE)
 
-    # wait before taking a screenshot
-    time.sleep(timeout)
+    return driver
+
+
+class PooledDriver:
+    """
+    A long-lived browser instance which loads a queue of pages one after
+    another. The browser is started lazily and restarted after it loads
+    the given number of pages, so memory leaks of the browser stay bounded.
+    """
+
+    def __init__(self, max_pages: int = config.SCREENSHOT_DRIVER_MAX_PAGES,
+                 capture_format: str = config.SCREENSHOT_CAPTURE_FORMAT):
+        if max_pages <= 0:
+            raise ValueError(f'Maximum number of pages has to be a positive number, passed {max_pages}')
+
+        if capture_format not in ('png', 'jpeg'):
+            raise ValueError(f'Invalid capture format passed: {capture_format}')
+
+        self.max_pages = max_pages
+        self.capture_format = capture_format
+        self.loaded_images = set()
+
+        # the last frame the flag was rendered in, which the next page shows
+        # until it renders its own flag (see: _wait_until_rendered)
+        self.last_frame = None
+
+        self._driver = None
+        self._num_pages = 0
+        self._in_session = False
+
+        # the URL the browser was last asked to load, which differs from the
+        # URL it shows if the page redirected
+        self._loaded_url = None
+
+    @property
+    def driver(self) -> 'webdriver.Chrome':
+        if self._driver is None:
+            self._driver = _create_driver()
+            self.loaded_images.clear()
+            self.last_frame = None
+            self._num_pages = 0
+            self._loaded_url = None
+
+        return self._driver
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Keeps the same browser instance (and the loaded page) for all pages
+        loaded inside the context, i.e. the browser is never restarted in
+        the middle of a session.
+        """
+
+        self._in_session = True
+
+        try:
+            yield self
+        finally:
+            self._in_session = False
+
+    def load(self, url: str, reload: bool = False):
+        """
+        Navigates the browser to the given URL. If the browser already shows
+        the same page and only the URL hash differs, the hash is changed in
+        place, so the page is not loaded from scratch.
+
+        :param url: a page URL to navigate to
+        :param reload: an indicator to load the page from scratch even if
+        only the URL hash differs
+        """
+
+        if self._driver is not None and self._num_pages >= self.max_pages and not self._in_session:
+            self.quit()
+
+        driver = self.driver
 
-    # save the screenshot as JPEG
-    png_screenshot = driver.get_screenshot_as_png()
-    screenshot = Image.open(io.BytesIO(png_screenshot)).convert('RGB')
-    screenshot.save(screenshot_path, format='JPEG', quality=100)
+        if not reload and self._loaded_url is not None and _is_same_page(self._loaded_url, url):
+            # forget previously loaded resources, so the limited resource
+            # timing buffer of a long-lived page never fills up
+            fragment = urllib.parse.urldefrag(url)[1]
+            driver.execute_script('performance.clearResourceTimings(); window.location.hash = arguments[0];', fragment)
+        else:
+            driver.get(url)
 
-    driver.quit()
+            # a page loaded from scratch does not show the previous flag
+            self.last_frame = None
 
+        self._loaded_url = url
+        self._num_pages += 1
 
-def convert_wikicommons_url_to_png_url(url: str, image_width: int = 1000) -> str:
+    def capture(self) -> bytes:
+        """
+        Captures the visible part of the page, either as PNG through
+        WebDriver, or as JPEG (with SCREENSHOT_QUALITY) straight from the
+        DevTools protocol of the browser, which skips decoding PNG and
+        encoding it as JPEG again.
+
+        :return: the captured frame as PNG or JPEG
+        """
+
+        if self.capture_format == 'jpeg':
+            result = self.driver.execute_cdp_cmd('Page.captureScreenshot', {
+                'format': 'jpeg',
+                'quality': config.SCREENSHOT_QUALITY
+            })
+            return base64.b64decode(result['data'])
+
+        return self.driver.get_screenshot_as_png()
+
+    def quit(self):
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+
+
+class DriverPool:
+    """
+    A fixed-size pool of long-lived browser instances. Every pooled driver is
+    used by a single worker thread at a time, so work items (e.g. countries)
+    can be processed in parallel.
     """
-    Generates a URL to a PNG version of the SVG file from Wikimedia Commons
-    file URL.
 
-    :param url: a URL to the SVG file from Wikimedia Commons
-    :param image_width: a width of the PNG image
-    :return: a URL to the PNG version of the given Wikimedia Commons URL
+    def __init__(self, size: int = config.NUM_SCREENSHOT_WORKERS,
+                 max_pages: int = config.SCREENSHOT_DRIVER_MAX_PAGES):
+        if size <= 0:
+            raise ValueError(f'Pool size has to be a positive number, passed {size}')
+
+        self.size = size
+        self._all_drivers = [PooledDriver(max_pages) for _ in range(size)]
+        self._idle_drivers = queue.Queue()
+
+        for driver in self._all_drivers:
+            self._idle_drivers.put(driver)
+
+    @contextlib.contextmanager
+    def acquire(self) -> PooledDriver:
+        """
+        Borrows an idle driver from the pool and returns it back when done.
+        """
+
+        driver = self._idle_drivers.get()
+
+        try:
+            yield driver
+        finally:
+            self._idle_drivers.put(driver)
+
+    def map(self, func, items):
+        """
+        Calls the given function for every item in parallel, with a pooled
+        driver as the first argument.
+
+        :param func: a function which takes a pooled driver and an item
+        :param items: items to process
+        :return: a generator of results in completion order
+        """
+
+        def run(item):
+            with self.acquire() as driver:
+                return func(driver, item)
+
+        with ThreadPool(self.size) as threads:
+            yield from threads.imap_unordered(run, items)
+
+    def close(self):
+        for driver in self._all_drivers:
+            driver.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _is_same_page(current_url: str, url: str) -> bool:
+    """
+    Checks whether two URLs point to the same page and differ (if at all)
+    only in the hash part.
     """
 
-    if image_width <= 0:
-        raise ValueError(f'Image width has to be a positive number, passed {image_width}')
+    return urllib.parse.urldefrag(current_url)[0].rstrip('/') == urllib.parse.urldefrag(url)[0].rstrip('/')
+
+
+def _frame_thumbnail(png_screenshot: bytes) -> Image.Image:
+    """
+    Decodes a PNG screenshot into a small grayscale image which is cheap to
+    compare with other frames.
+    """
 
-    match = re.match(r'https?://commons\.wikimedia\.org/wiki/(?:Special:FilePath/|File:)(.+)', url)
+    return Image.open(io.BytesIO(png_screenshot)).convert('L').resize(_FRAME_THUMBNAIL_SIZE)
+
+
+def _frame_difference(frame: Image.Image, other_frame: Image.Image) -> float:
+    return ImageStat.Stat(ImageChops.difference(frame, other_frame)).mean[0]
+
+
+def _wait_until_rendered(driver: PooledDriver, image_source: str, timeout: float) -> bytes:
+    """
+    Polls the page until the flag image has been loaded and two consecutive
+    frames do not differ, or until the timeout expires. Frames which still
+    show the flag the driver rendered last (e.g. right after the URL hash
+    changed, before the page reacted) are never taken as stable.
+
+    :param driver: a pooled browser instance which shows Flagwaver
+    :param image_source: a URL of the flag image shown by Flagwaver (if
+    None, only frames are compared)
+    :param timeout: maximum time in seconds to wait
+    :return: the last captured frame (see: PooledDriver.capture)
+    """
+
+    deadline = time.perf_counter() + timeout
+    stale_frame = driver.last_frame
+    previous_frame = None
+
+    while True:
+        # an image which has been loaded once by the browser is taken from
+        # its memory cache afterwards and does not show up in resource timings
+        if image_source is not None and image_source not in driver.loaded_images:
+            if driver.driver.execute_script(_FLAG_IMAGE_LOADED_SCRIPT, image_source):
+                driver.loaded_images.add(image_source)
+
+        if image_source is None or image_source in driver.loaded_images:
+            png_screenshot = driver.capture()
+            frame = _frame_thumbnail(png_screenshot)
+
+            if stale_frame is not None and _frame_difference(frame, stale_frame) <= _STABLE_FRAME_THRESHOLD:
+                # the page still shows the previous flag
+                frame = None
+            elif previous_frame is not None and _frame_difference(frame, previous_frame) <= _STABLE_FRAME_THRESHOLD:
+                driver.last_frame = frame
+                return png_screenshot
+
+            previous_frame = frame
+
+        if time.perf_counter() >= deadline:
+            break
+
+        time.sleep(_READY_POLL_INTERVAL)
+
+    # the flag has not settled in time, take whatever is rendered now
+    png_screenshot = driver.capture()
+    driver.last_frame = _frame_thumbnail(png_screenshot)
+
+    return png_screenshot
+
+
+def _wait_for_flag(driver: PooledDriver, timeout: float, wait_mode: str,
+                   image_source: str = None) -> Tuple[bytes, float]:
+    """
+    Waits for the loaded page to render the flag and captures it.
+
+    :param driver: a pooled browser instance which shows the page
+    :param timeout: time in seconds to wait (the maximum time to wait in
+    the 'ready' mode)
+    :param wait_mode: 'fixed' to always wait for the timeout, or 'ready' to
+    wait until the flag image is loaded and rendered frames stop changing
+    :param image_source: a URL of the flag image which has to be loaded in
+    the 'ready' mode
+    :return: the captured frame (see: PooledDriver.capture) and time in
+    seconds spent waiting
+    """
+
+    if wait_mode not in ('fixed', 'ready'):
+        raise ValueError(f'Invalid wait mode passed: {wait_mode}')
+
+    wait_start = time.perf_counter()
+
+    if wait_mode == 'ready':
+        png_screenshot = _wait_until_rendered(driver, image_source, timeout)
+    else:
+        # wait before taking a screenshot
+        time.sleep(timeout)
+        png_screenshot = driver.capture()
+
+    return png_screenshot, time.perf_counter() - wait_start
+
+
+@functools.lru_cache(maxsize=4)
+def _decode_background(png_background: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(png_background)).convert('RGB'))
+
+
+def _encode_screenshot(args) -> Tuple[str, int, Dict[str, float]]:
+    """
+    Encodes a captured screenshot and saves it, in a worker process of the
+    screenshot encoder.
+
+    :return: SHA-256 hash and size of the saved screenshot, and time in
+    seconds spent in every stage
+    """
+
+    screenshot, screenshot_path, image_format, quality = args
+    stage_times = {}
+    stage_start = time.perf_counter()
+
+    def finish_stage(stage: str):
+        nonlocal stage_start
+        stage_end = time.perf_counter()
+        stage_times[stage] = stage_end - stage_start
+        stage_start = stage_end
+
+    # a JPEG capture from the browser is saved as it is
+    if image_format == 'JPEG' and screenshot[:2] == b'\xff\xd8':
+        encoded_screenshot = screenshot
+    else:
+        image = Image.open(io.BytesIO(screenshot)).convert('RGB')
+        finish_stage('decode')
+
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality)
+        encoded_screenshot = output.getvalue()
+        finish_stage('encode')
+
+    with open(screenshot_path, 'wb') as file:
+        file.write(encoded_screenshot)
+
+    finish_stage('write')
+
+    return hashlib.sha256(encoded_screenshot).hexdigest(), len(encoded_screenshot), stage_times
+
+
+def _label_screenshots(args) -> Tuple[int, Dict[str, float]]:
+    """
+    Labels flags in a batch of saved screenshots in a single pass (see:
+    utils.autolabel), in a worker process of the screenshot encoder.
+
+    :return: number of written label files, and time in seconds spent
+    labeling
+    """
+
+    screenshot_paths, png_background = args
+    label_start = time.perf_counter()
+    num_labels = label_batch(screenshot_paths, _decode_background(png_background))
+
+    return num_labels, {'label': time.perf_counter() - label_start}
+
+
+class ScreenshotEncoder:
+    """
+    A pool of processes which encode, save and label screenshots, so browsers
+    keep capturing in the meantime. Capturing threads hand screenshots over
+    through a bounded queue, i.e. a thread blocks when the given number of
+    screenshots already wait for encoding, which keeps memory bounded.
+
+    Time spent in every stage (waiting for the queue, decoding, encoding,
+    writing and labeling) is summed up in stage_times.
+    """
 
-    if not match or url[-4:] != '.svg':
-        raise ValueError(f'Invalid Wikimedia Commons URL passed: {url}')
+    def __init__(self, num_workers: int = config.NUM_SCREENSHOT_ENCODERS,
+                 queue_size: int = config.SCREENSHOT_ENCODER_QUEUE_SIZE,
+                 image_format: str = 'JPEG', quality: int = config.SCREENSHOT_QUALITY):
+        """
+        :param num_workers: number of processes
+        :param queue_size: maximum number of screenshots waiting for
+        encoding
+        :param image_format: a PIL format screenshots are encoded in
+        :param quality: quality of encoded screenshots
+        """
 
-    file_name = match.group(1)
-    file_name = urllib.parse.unquote(file_name).replace(' ', '_')
-    md5_hash = hashlib.md5(file_name.encode('utf-8')).hexdigest()
+        if queue_size <= 0:
+            raise ValueError(f'Queue size has to be a positive number, passed {queue_size}')
 
-    return (f'https://upload.wikimedia.org/wikipedia/commons/thumb/'
-            f'{md5_hash[0]}/{md5_hash[:2]}/{file_name}/{image_width}px-{file_name}.png')
+        self.image_format = image_format
+        self.quality = quality
+        self.stage_times = defaultdict(float)
+        self._pool = Pool(num_workers)
+        self._queue_slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+
+    def _add_stage_times(self, stage_times: Dict[str, float]):
+        with self._lock:
+            for stage, stage_time in stage_times.items():
+                self.stage_times[stage] += stage_time
+
+    def submit(self, screenshot: bytes, screenshot_path: str) -> AsyncResult:
+        """
+        Queues a captured screenshot for encoding.
+
+        :param screenshot: a captured frame (see: PooledDriver.capture)
+        :param screenshot_path: a file path where the screenshot is saved
+        :return: an asynchronous result of SHA-256 hash and size of the saved
+        screenshot, and time in seconds spent in every stage
+        """
+
+        wait_start = time.perf_counter()
+        self._queue_slots.acquire()
+        self._add_stage_times({'queue': time.perf_counter() - wait_start})
+
+        def on_encoded(result):
+            self._queue_slots.release()
+            self._add_stage_times(result[2])
+
+        def on_error(_):
+            self._queue_slots.release()
+
+        args = (screenshot, screenshot_path, self.image_format, self.quality)
+
+        return self._pool.apply_async(_encode_screenshot, (args,), callback=on_encoded, error_callback=on_error)
+
+    def label(self, screenshot_paths: List[str], png_background: bytes,
+              batch_size: int = BATCH_SIZE) -> List[AsyncResult]:
+        """
+        Queues saved screenshots for labeling flags in them. Screenshots are
+        split into batches, and every batch is compared to the background at
+        once in a single worker process (see: utils.autolabel).
+
+        :param screenshot_paths: paths to saved screenshots
+        :param png_background: a capture of the page without the flag
+        :param batch_size: number of screenshots labeled at once
+        :return: asynchronous results of the number of written label files,
+        and time in seconds spent labeling, for every batch
+        """
+
+        def on_labeled(result):
+            self._add_stage_times(result[1])
+
+        batches = [screenshot_paths[start:start + batch_size] for start in range(0, len(screenshot_paths), batch_size)]
+
+        return [self._pool.apply_async(_label_screenshots, ((batch, png_background),), callback=on_labeled)
+                for batch in batches]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _create_flagwaver_url(image_source: str, direction: int, top_edge: str) -> str:
+    """
+    Creates a URL of Flagwaver website which shows the given flag image
+    waving in the fixed wind.
+
+    :param image_source: a URL of the flag image
+    :param direction: a wind direction in degrees
+    :param top_edge: a flag edge which is on top ('top', 'left', 'right' or
+    'bottom')
+    :return: a Flagwaver URL
+    """
+
+    return (f'{FLAGWAVER_URL}/#?hideui=true'
+            f'&direction={direction}&topedge={top_edge}&src={image_source}&windtype=fixed')
+
+
+def _capture_background(driver: PooledDriver, timeout: float, wait_mode: str) -> bytes:
+    """
+    Captures Flagwaver with a transparent flag image, i.e. the background of
+    all screenshots without the flag (see: utils.autolabel). The capture is
+    saved in the cache folder as well.
+
+    :param driver: a pooled browser instance used to load Flagwaver
+    :param timeout: time in seconds to wait for the page to be rendered
+    :param wait_mode: 'fixed' or 'ready' (see: _wait_for_flag)
+    :return: the captured background (see: PooledDriver.capture)
+    """
+
+    flagwaver_url = _create_flagwaver_url(urllib.parse.quote(_TRANSPARENT_IMAGE_SOURCE, safe=''),
+                                          config.SCREENSHOT_WIND_DIRECTIONS[0], config.SCREENSHOT_FLAG_TOP_EDGES[0])
+    driver.load(flagwaver_url)
+
+    # a data URL does not show up in resource timings, so only frames are
+    # compared in the 'ready' mode
+    png_background, _ = _wait_for_flag(driver, timeout, wait_mode)
+
+    os.makedirs(config.CACHE_FOLDER, exist_ok=True)
+
+    with open(f'{config.CACHE_FOLDER}/{_BACKGROUND_CACHE_FILE}', 'wb') as file:
+        file.write(png_background)
+
+    return png_background
+
+
+def _capture_flag_variants(driver: PooledDriver, image_source: str, variants, time_offsets,
+                           timeout: float, wait_mode: str, batch: bool = True):
+    """
+    Captures the flag image waving in every given wind direction and with
+    every given top edge. After the flag is rendered, a frame is captured at
+    every time offset.
+
+    In the batch mode, Flagwaver (and the flag image) is loaded once and
+    every variant is shown by changing the URL hash of the same page. Then
+    the browser is not restarted until all variants are captured. Otherwise,
+    the page is loaded from scratch for every variant.
+
+    :param driver: a pooled browser instance used to load Flagwaver
+    :param image_source: a URL of the flag image
+    :param variants: an iterable of (wind direction, top edge) pairs
+    :param time_offsets: times in seconds after the flag is rendered when
+    frames are captured
+    :param timeout: time in seconds to wait for the flag to be rendered
+    :param wait_mode: 'fixed' or 'ready' (see: _wait_for_flag)
+    :param batch: an indicator to capture all variants in a single page
+    session
+    :return: a generator of captured frames as PNG, with time in seconds
+    spent waiting since the previous frame
+    """
+
+    time_offsets = sorted(time_offsets)
+
+    if any(offset < 0 for offset in time_offsets):
+        raise ValueError(f'Time offsets have to be non-negative numbers, passed {time_offsets}')
+
+    with contextlib.ExitStack() as stack:
+        if batch:
+            stack.enter_context(driver.session())
+
+        for direction, top_edge in variants:
+            flagwaver_url = _create_flagwaver_url(image_source, direction, top_edge)
+
+            # print generated flagwaver URL
+            print(flagwaver_url)
+
+            driver.load(flagwaver_url, reload=not batch)
+            png_screenshot, wait_time = _wait_for_flag(driver, timeout, wait_mode, image_source)
+            rendered_at = time.perf_counter()
+
+            for offset in time_offsets:
+                if offset > 0:
+                    wait_start = time.perf_counter()
+                    time.sleep(max(0.0, rendered_at + offset - wait_start))
+                    png_screenshot = driver.capture()
+                    wait_time = time.perf_counter() - wait_start
+
+                yield png_screenshot, wait_time
+
+
+def _save_wait_times(wait_times: dict, timeout: float, wait_mode: str, stage_times: Dict[str, float] = None):
+    """
+    Prints a summary of time spent waiting for Flagwaver to render flags (and
+    of time spent in every stage of encoding screenshots) and saves waiting
+    time of every screenshot as a JSON file in the cache folder.
+
+    :param wait_times: a dictionary of waiting times in seconds by
+    screenshot file name
+    :param timeout: time in seconds the fixed wait mode waits for every
+    screenshot
+    :param wait_mode: the wait mode screenshots were taken with
+    :param stage_times: a dictionary of total time in seconds spent in every
+    stage of encoding (see: ScreenshotEncoder)
+    """
+
+    total_wait_time = sum(wait_times.values())
+    fixed_wait_time = timeout * len(wait_times)
+    stage_times = dict(stage_times or {})
+
+    print(f'Waited {total_wait_time:.1f}s for {len(wait_times)} screenshots in the {wait_mode} mode '
+          f'(fixed waiting would take {fixed_wait_time:.1f}s, saved {fixed_wait_time - total_wait_time:.1f}s)')
+
+    for stage, stage_time in sorted(stage_times.items()):
+        print(f'  {stage}: {stage_time:.1f}s ({stage_time / max(len(wait_times), 1) * 1000:.0f}ms per screenshot)')
+
+    os.makedirs(config.CACHE_FOLDER, exist_ok=True)
+
+    with open(f'{config.CACHE_FOLDER}/{_WAIT_TIMES_CACHE_FILE}', 'w') as file:
+        json.dump({
+            'wait_mode': wait_mode,
+            'timeout': timeout,
+            'total_wait_time': total_wait_time,
+            'wait_times': wait_times,
+            'stage_times': stage_times
+        }, file, indent=2, sort_keys=True)
+
+
+def _is_screenshot(photo: dict) -> bool:
+    """
+    Tells whether photo credits belong to a generated screenshot.
+    """
+
+    return is_screenshot(photo.get('url'), photo.get('author'))
+
+
+def _render_key(country: Country) -> str:
+    """
+    Creates a key of screenshots of the flag of the given country. The key
+    changes when the flag image or parameters of screenshots change, i.e.
+    when screenshots have to be taken again.
+    """
+
+    render_parameters = [country.flag_image, config.SCREENSHOT_IMAGE_SIZE, config.SCREENSHOT_WIND_DIRECTIONS,
+                         config.SCREENSHOT_FLAG_TOP_EDGES, config.SCREENSHOT_TIME_OFFSETS]
+
+    return hashlib.sha1(json.dumps(render_parameters).encode('utf-8')).hexdigest()
+
+
+def _load_render_keys() -> Dict[str, str]:
+    render_keys_path = f'{config.CACHE_FOLDER}/{_RENDER_KEYS_CACHE_FILE}'
+
+    if not os.path.isfile(render_keys_path):
+        return {}
+
+    with open(render_keys_path) as file:
+        return json.load(file)
+
+
+def _save_render_keys(render_keys: Dict[str, str]):
+    os.makedirs(config.CACHE_FOLDER, exist_ok=True)
+
+    with open(f'{config.CACHE_FOLDER}/{_RENDER_KEYS_CACHE_FILE}', 'w') as file:
+        json.dump(render_keys, file, indent=2, sort_keys=True)
+
+
+def _take_country_screenshots(driver: PooledDriver, encoder: ScreenshotEncoder, country: Country,
+                              hash_index: HashIndex = None) -> dict:
+    """
+    Takes screenshots of the waving flag of the given country for all wind
+    directions, flag top edges and time offsets, and replaces credits of the
+    previous screenshots of the country with credits for the taken
+    screenshots. Credits of other photos of the country are kept. Optionally,
+    flags in the screenshots are labeled by comparing them to the background
+    (see: utils.autolabel).
+
+    Screenshots are encoded by the encoder while the browser captures the
+    next ones.
+
+    :param driver: a pooled browser instance used to load Flagwaver
+    :param encoder: an encoder which saves captured screenshots
+    :param country: a country whose flag is captured
+    :param hash_index: an index of perceptual hashes screenshots are checked
+    against and added to (if None, they are not checked)
+    :return: a dictionary of time in seconds spent waiting for every
+    screenshot to be rendered, by screenshot file name
+    """
+
+    print(f'Taking screenshots of flags of {country.name}')
+    country_code = country.code.lower()
+    country_folder = f'{config.DATASET_FOLDER}/{country_code}'
+    credits_file_path = f'{country_folder}/credits.yml'
+    image_source = convert_wikicommons_url_to_png_url(country.flag_image)
+    variants = itertools.product(config.SCREENSHOT_WIND_DIRECTIONS, config.SCREENSHOT_FLAG_TOP_EDGES)
+    wait_times = {}
+    encoded_screenshots = []
+    photos = []
+
+    with open(credits_file_path) as credits_file:
+        credits_data = yaml.load(credits_file, Loader=yaml.Loader)
+        file_names = allocate_photo_filenames(country_folder, credits_data['photos'] or [], _is_screenshot)
+
+    png_background = None
+
+    if config.SCREENSHOT_AUTOLABEL:
+        png_background = _capture_background(driver, config.SCREENSHOT_TIMEOUT, config.SCREENSHOT_WAIT_MODE)
+
+    frames = _capture_flag_variants(driver=driver,
+                                    image_source=image_source,
+                                    variants=variants,
+                                    time_offsets=config.SCREENSHOT_TIME_OFFSETS,
+                                    timeout=config.SCREENSHOT_TIMEOUT,
+                                    wait_mode=config.SCREENSHOT_WAIT_MODE,
+                                    batch=config.SCREENSHOT_BATCH_CAPTURE)
+
+    for file_name, (screenshot, wait_time) in zip(file_names, frames):
+        wait_times[file_name] = wait_time
+
+        # a label of the previous screenshot with this file name labels
+        # another flag, so it is removed even if the new one is not labeled
+        if os.path.isfile(f'{country_folder}/{file_name[:-3]}xml'):
+            os.remove(f'{country_folder}/{file_name[:-3]}xml')
+
+        encoded_screenshot = encoder.submit(screenshot, f'{country_folder}/{file_name}')
+        encoded_screenshots.append((file_name, encoded_screenshot))
+
+    for file_name, encoded_screenshot in encoded_screenshots:
+        sha256, size, _ = encoded_screenshot.get()
+
+        # add credits for generated screenshots
+        photos.append({
+            'author': SCREENSHOTS_AUTHOR,
+            'download_url': f'https://raw.githubusercontent.com/iamvukasin/flagnet/master/dataset/'
+                            f'{country_code}/{file_name}',
+            'downloader': 'url_image',
+            'filename': file_name,
+            'license': _SCREENSHOTS_LICENSE,
+            'sha256': sha256,
+            'size': size,
+            'url': FLAGWAVER_URL
+        })
+
+    # flags are labeled in batches once all screenshots of the country are
+    # saved
+    if png_background is not None:
+        for labeled_batch in encoder.label([f'{country_folder}/{photo["filename"]}' for photo in photos],
+                                           png_background):
+            labeled_batch.get()
+
+    # write modified credits back, and remove previous screenshots (and their
+    # labels) which were not replaced
+    remove_photo_files(country_folder, merge_photo_credits(credits_file_path, photos, _is_screenshot))
+
+    if hash_index is not None:
+        print_near_duplicates(hash_index.add_images([f'{country_folder}/{photo["filename"]}' for photo in photos]))
+
+    return wait_times
 
 
 if __name__ == '__main__':
-    countries = load_countries()
-    wind_directions = [90, 270]
-    flag_top_edges = ['top', 'left', 'right']
-
-    for country in countries:
-        print(f'Taking screenshots of flags of {country.name}')
-        country_code = country.code.lower()
-        i = 0
-
-        with open(f'{config.DATASET_FOLDER}/{country_code}/credits.yml', 'r') as credits_file:
-            credits_data = yaml.load(credits_file, Loader=yaml.Loader)
-            credits_data.pop('photos', None)
-            credits_data['photos'] = []
-
-        with open(f'{config.DATASET_FOLDER}/{country_code}/credits.yml', 'w') as credits_file:
-            for direction in wind_directions:
-                for edge in flag_top_edges:
-                    image_source = convert_wikicommons_url_to_png_url(country.flag_image)
-                    flagwaver_url = (f'{_FLAGWAVER_URL}/#?hideui=true'
-                                     f'&direction={direction}&topedge={edge}&src={image_source}&windtype=fixed')
-                    file_name = f'{country_code}_{i:05}.jpg'
-                    screenshot_path = f'../{config.DATASET_FOLDER}/{country_code}/{file_name}'
-
-                    # print generated flagwaver URL
-                    print(flagwaver_url)
-
-                    _take_screenshot(url=flagwaver_url,
-                                     screenshot_path=screenshot_path,
-                                     timeout=6)
-
-                    # add credits for generated screenshots
-                    credits_data['photos'].append({
-                        'author': _SCREENSHOTS_AUTHOR,
-                        'download_url': f'https://raw.githubusercontent.com/iamvukasin/flagnet/master/dataset/'
-                                        f'{country_code}/{file_name}',
-                        'downloader': 'url_image',
-                        'filename': file_name,
-                        'license': _SCREENSHOTS_LICENSE,
-                        'url': _FLAGWAVER_URL
-                    })
-
-                    i += 1
-
-            # write modified credits back
-            yaml.dump(credits_data, credits_file, default_flow_style=False, allow_unicode=True)
+    parser = argparse.ArgumentParser(description='Takes screenshots of waving flags of all countries.')
+    parser.add_argument('--all', action='store_true',
+                        help='take screenshots of all countries, not only of those whose flag or screenshot '
+                             'parameters changed since the last run')
+    parser.add_argument('--mark-rendered', action='store_true',
+                        help='only mark screenshots of all countries as up to date, without taking them')
+    args = parser.parse_args()
+
+    # pick up changes of flags since the list of countries was requested
+    registry = get_registry()
+    registry.refresh()
+
+    render_keys = {} if args.all else _load_render_keys()
+    countries = [country for country in registry.countries if render_keys.get(country.code) != _render_key(country)]
+
+    if args.mark_rendered:
+        render_keys.update((country.code, _render_key(country)) for country in countries)
+        _save_render_keys(render_keys)
+        print(f'Marked screenshots of {len(countries)} countries as up to date')
+        sys.exit(0)
+
+    print(f'Taking screenshots of {len(countries)} countries ({len(registry) - len(countries)} are up to date)')
+    all_wait_times = {}
+    hash_index = HashIndex()
+
+    # encoders are started before browsers, so worker processes are not
+    # forked from a process with running threads
+    with ScreenshotEncoder() as screenshot_encoder, DriverPool() as pool:
+        def take_screenshots(driver: PooledDriver, country: Country) -> Tuple[Country, dict]:
+            return country, _take_country_screenshots(driver, screenshot_encoder, country, hash_index)
+
+        # take screenshots of multiple countries in parallel, every country
+        # with its own long-lived browser instance
+        for rendered_country, country_wait_times in pool.map(take_screenshots, countries):
+            all_wait_times.update(country_wait_times)
+
+            # remember every rendered country right away, so an interrupted
+            # run continues where it stopped
+            render_keys[rendered_country.code] = _render_key(rendered_country)
+            _save_render_keys(render_keys)
+
+    _save_wait_times(all_wait_times, config.SCREENSHOT_TIMEOUT, config.SCREENSHOT_WAIT_MODE,
+                     screenshot_encoder.stage_times)
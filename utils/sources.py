@@ -0,0 +1,23 @@
+# credits of generated photos, which tell them apart from real photos of
+# flags (the module imports nothing, so every tool can use it)
+
+FLAGWAVER_URL = 'https://iamvukasin.github.com/flagwaver'
+SCREENSHOTS_AUTHOR = 'Vukašin Manojlović'
+SYNTHETIC_AUTHOR = 'Flagnet synthesizer'
+
+
+def is_screenshot(url: str, author: str) -> bool:
+    """
+    Tells whether a photo is a screenshot of Flagwaver (see: utils.screenshot).
+    """
+
+    return url == FLAGWAVER_URL and author == SCREENSHOTS_AUTHOR
+
+
+def is_synthetic(author: str) -> bool:
+    """
+    Tells whether a photo is rendered by the synthesizer (see:
+    utils.synthesize).
+    """
+
+    return author == SYNTHETIC_AUTHOR
@@ -0,0 +1,271 @@
+import argparse
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import config
+from utils.manifest import Manifest, ManifestImage
+from utils.sources import is_screenshot, is_synthetic
+
+_SPLITS_FILE = 'splits.npz'
+
+SPLITS = ['train', 'val', 'test']
+
+# photos of the dataset are either real photos of flags, or generated
+# screenshots of Flagwaver and rendered images
+REAL = 'real'
+SYNTHETIC = 'synthetic'
+SOURCES = [REAL, SYNTHETIC]
+
+
+def image_source(image: ManifestImage) -> str:
+    """
+    Tells whether a photo is real or generated, from its credits.
+
+    :return: REAL or SYNTHETIC
+    """
+
+    return SYNTHETIC if is_screenshot(image.url, image.author) or is_synthetic(image.author) else REAL
+
+
+class AliasSampler:
+    """
+    A sampler of indices with given weights by Vose's alias method. The
+    table is built once in linear time, and then every index is drawn in
+    constant time: a uniformly drawn column either keeps its own index or
+    gives its alias, so any number of indices is drawn with a few
+    vectorized operations.
+    """
+
+    def __init__(self, weights: np.ndarray):
+        """
+        :param weights: non-negative weights of indices, which do not have
+        to sum to one
+        """
+
+        weights = np.asarray(weights, dtype=np.float64)
+
+        if weights.ndim != 1 or not len(weights) or (weights < 0).any() or not weights.sum() > 0:
+            raise ValueError('Weights have to be a non-empty list of non-negative numbers with a positive sum')
+
+        num_weights = len(weights)
+        scaled = (weights * num_weights / weights.sum()).tolist()
+        self.probabilities = np.ones(num_weights, dtype=np.float64)
+        self.aliases = np.arange(num_weights, dtype=np.int64)
+
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+        # columns left in either list are full up to rounding errors, so they
+        # keep the probability of one
+
+    def __len__(self) -> int:
+        return len(self.probabilities)
+
+    def sample(self, num_samples: int, random: np.random.RandomState = None) -> np.ndarray:
+        """
+        Draws indices with replacement.
+
+        :param num_samples: number of drawn indices
+        :param random: a random generator (if None, the global one of NumPy)
+        :return: an int64 array of drawn indices
+        """
+
+        if random is None:
+            random = np.random
+
+        columns = random.randint(0, len(self), num_samples)
+
+        return np.where(random.random_sample(num_samples) < self.probabilities[columns], columns,
+                        self.aliases[columns])
+
+
+def _split_counts(num_images: int, fractions: Tuple[float, float]) -> Tuple[int, int]:
+    """
+    Returns numbers of validation and test images of a stratum. A stratum
+    keeps at least one training image, and a stratum with at least three
+    images has an image in every split whose fraction is positive.
+    """
+
+    counts = [int(round(num_images * fraction)) for fraction in fractions]
+
+    for i, fraction in enumerate(fractions):
+        if fraction > 0 and num_images >= len(SPLITS):
+            counts[i] = max(counts[i], 1)
+
+    while counts[0] + counts[1] >= num_images and counts[0] + counts[1] > 0:
+        counts[int(counts[1] > counts[0])] -= 1
+
+    return counts[0], counts[1]
+
+
+class DatasetSplits:
+    """
+    Train, validation and test splits of the dataset, stratified by country
+    and by source (real or synthetic photos): every split gets the same
+    fraction of real and of synthetic photos of every country.
+
+    Splits are stored as arrays of indices of images, so they stay compact
+    and are saved to a single `.npz` file. Images are named by
+    country/filename, and every image has a label id and a source (an index
+    into SOURCES).
+    """
+
+    def __init__(self, image_names: np.ndarray, label_ids: np.ndarray, sources: np.ndarray,
+                 indices: Dict[str, np.ndarray]):
+        self.image_names = np.asarray(image_names, dtype=str)
+        self.label_ids = np.asarray(label_ids, dtype=np.int32)
+        self.sources = np.asarray(sources, dtype=np.int8)
+        self.indices = {split: np.asarray(indices[split], dtype=np.int32) for split in SPLITS}
+        self._samplers = {}
+
+    def __len__(self) -> int:
+        return len(self.image_names)
+
+    @property
+    def countries(self) -> np.ndarray:
+        return np.array([name.split('/')[0] for name in self.image_names], dtype=str)
+
+    @classmethod
+    def from_manifest(cls, manifest: Manifest, val_fraction: float = config.VALIDATION_SPLIT_FRACTION,
+                      test_fraction: float = config.TEST_SPLIT_FRACTION, seed: int = 0) -> 'DatasetSplits':
+        """
+        Splits all images of the manifest. Images of every country and source
+        are shuffled, and then divided by the fractions.
+
+        :param manifest: the manifest of the dataset
+        :param val_fraction: a fraction of validation images
+        :param test_fraction: a fraction of test images
+        :param seed: a seed of shuffling, the same seed and dataset give the
+        same splits
+        :return: splits of the dataset
+        """
+
+        if val_fraction < 0 or test_fraction < 0 or val_fraction + test_fraction >= 1:
+            raise ValueError(f'Fractions of validation and test images have to be non-negative with a sum below one, '
+                             f'passed {val_fraction} and {test_fraction}')
+
+        images = manifest.images
+        sources = np.array([SOURCES.index(image_source(image)) for image in images], dtype=np.int8)
+        strata = {}
+
+        for i, image in enumerate(images):
+            strata.setdefault((image.country, sources[i]), []).append(i)
+
+        random = np.random.RandomState(seed)
+        indices = {split: [] for split in SPLITS}
+
+        # strata are visited in a fixed order, so the seed alone decides splits
+        for stratum in sorted(strata):
+            stratum_indices = np.array(strata[stratum], dtype=np.int32)
+            random.shuffle(stratum_indices)
+            num_val, num_test = _split_counts(len(stratum_indices), (val_fraction, test_fraction))
+
+            indices['val'].append(stratum_indices[:num_val])
+            indices['test'].append(stratum_indices[num_val:num_val + num_test])
+            indices['train'].append(stratum_indices[num_val + num_test:])
+
+        return cls(image_names=[f'{image.country}/{image.filename}' for image in images],
+                   label_ids=[image.label_id for image in images],
+                   sources=sources,
+                   indices={split: np.sort(np.concatenate(split_indices)) if split_indices else []
+                            for split, split_indices in indices.items()})
+
+    @classmethod
+    def build(cls, dataset_folder: str = config.DATASET_FOLDER, seed: int = 0) -> 'DatasetSplits':
+        return cls.from_manifest(Manifest.load(dataset_folder), seed=seed)
+
+    def save(self, path: str = os.path.join(config.CACHE_FOLDER, _SPLITS_FILE)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(path, image_names=self.image_names, label_ids=self.label_ids, sources=self.sources,
+                 **{f'{split}_indices': self.indices[split] for split in SPLITS})
+
+    @classmethod
+    def load(cls, path: str = os.path.join(config.CACHE_FOLDER, _SPLITS_FILE)) -> 'DatasetSplits':
+        with np.load(path) as data:
+            return cls(data['image_names'], data['label_ids'], data['sources'],
+                       {split: data[f'{split}_indices'] for split in SPLITS})
+
+    def manifest(self, manifest: Manifest, split: str) -> Manifest:
+        """
+        Returns a manifest of images of a split, e.g. to load batches of the
+        split (see: utils.loader.BatchLoader).
+
+        :param manifest: the manifest of the dataset
+        :param split: 'train', 'val' or 'test'
+        """
+
+        names = set(self.image_names[self.indices[split]])
+
+        return Manifest([image for image in manifest if f'{image.country}/{image.filename}' in names],
+                        manifest.dataset_folder)
+
+    def balanced_sampler(self, split: str, by_source: bool = False) -> AliasSampler:
+        """
+        Returns a sampler of positions in the indices of a split, which draws
+        every country (and source) equally often, however many images it has.
+
+        :param split: 'train', 'val' or 'test'
+        :param by_source: an indicator to balance real and synthetic images
+        of every country as well
+        """
+
+        if (split, by_source) not in self._samplers:
+            split_indices = self.indices[split]
+            # countries are told apart by name, so splits do not depend on
+            # the label map they were made with
+            classes = np.unique(self.countries[split_indices], return_inverse=True)[1].astype(np.int64)
+
+            if by_source:
+                classes = classes * len(SOURCES) + self.sources[split_indices]
+
+            _, inverse, counts = np.unique(classes, return_inverse=True, return_counts=True)
+            self._samplers[split, by_source] = AliasSampler(1 / counts[inverse])
+
+        return self._samplers[split, by_source]
+
+    def sample(self, split: str, num_samples: int, seed: int = 0, by_source: bool = False) -> np.ndarray:
+        """
+        Draws class-balanced images of a split with replacement, e.g. to make
+        a training epoch.
+
+        :param split: 'train', 'val' or 'test'
+        :param num_samples: number of drawn images
+        :param seed: a seed of drawing
+        :param by_source: an indicator to balance real and synthetic images
+        of every country as well
+        :return: an int32 array of indices of drawn images
+        """
+
+        positions = self.balanced_sampler(split, by_source).sample(num_samples, np.random.RandomState(seed))
+        return self.indices[split][positions]
+
+    def counts(self) -> List[Tuple[str, str, int]]:
+        """
+        Counts images of every split by source.
+
+        :return: a list of splits, sources and numbers of images
+        """
+
+        return [(split, source, int(np.sum(self.sources[self.indices[split]] == i)))
+                for split in SPLITS for i, source in enumerate(SOURCES)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Splits the dataset into stratified train, val and test splits.')
+    parser.add_argument('--seed', type=int, default=0, help='a seed of shuffling')
+    args = parser.parse_args()
+
+    splits = DatasetSplits.build(seed=args.seed)
+    splits.save()
+
+    for split_name, source_name, num_images in splits.counts():
+        print(f'{split_name:>5} {source_name:>9}: {num_images} images')
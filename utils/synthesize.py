@@ -0,0 +1,328 @@
+import argparse
+import functools
+import os
+import time
+from collections import defaultdict
+from multiprocessing import Pool
+from typing import List, Optional, Tuple
+
+import numpy as np
+import ruamel.yaml as yaml
+from PIL import Image
+
+import config
+from download.image_dowloader import compute_sha256
+from download.url_image_downloader import UrlImageDownloader
+from utils.country import Country, get_registry
+from utils.credits import allocate_photo_filenames, merge_photo_credits, remove_photo_files
+from utils.phash import HashIndex, print_near_duplicates
+from utils.sources import SYNTHETIC_AUTHOR, is_synthetic
+from utils.voc import VocAnnotation, VocObject, write_voc_annotation
+from utils.wikimedia import convert_wikicommons_url_to_png_url
+
+_SYNTHETIC_LICENSE = 'CC0 Public Domain'
+
+# width of the waving flag relative to the image width
+_FLAG_WIDTH_RANGE = 0.3, 0.7
+
+# maximum height of the waving flag relative to the image height
+_MAX_FLAG_HEIGHT = 0.6
+
+# number of waves along the flag, and wave amplitude relative to the flag
+# height
+_WAVE_FREQUENCY_RANGE = 0.8, 2.5
+_WAVE_AMPLITUDE_RANGE = 0.02, 0.1
+
+# maximum sag of the free end of the flag, and maximum shrinking of the flag
+# height in folds, both relative to the flag height
+_MAX_SAG = 0.15
+_MAX_FOLD = 0.2
+
+# maximum change of brightness in folds, and maximum rotation in degrees
+_MAX_SHADING = 0.35
+_MAX_ROTATION = 10
+
+# width of the flag pole relative to the flag height
+_POLE_WIDTH = 0.04
+
+# number of times an image without any pixels of the flag (e.g. a flag
+# rotated out of the image) is drawn again with another seed
+_MAX_RENDER_ATTEMPTS = 10
+
+
+def download_flag_image(country: Country, flags_folder: str = config.FLAG_IMAGES_FOLDER) -> str:
+    """
+    Downloads the PNG version of the flag image of a country from Wikimedia
+    Commons, unless it is already in the flags folder.
+
+    :param country: a country whose flag image is downloaded
+    :param flags_folder: a path to the folder where flag images are cached
+    :return: a path to the flag image
+    """
+
+    os.makedirs(flags_folder, exist_ok=True)
+    flag_path = os.path.join(flags_folder, f'{country.code.lower()}.png')
+
+    if not os.path.isfile(flag_path):
+        UrlImageDownloader(convert_wikicommons_url_to_png_url(country.flag_image), flag_path).download()
+
+    return flag_path
+
+
+@functools.lru_cache(maxsize=8)
+def _load_flag(flag_path: str) -> Image.Image:
+    with Image.open(flag_path) as flag:
+        return flag.convert('RGBA')
+
+
+def _create_background(size: Tuple[int, int], random: np.random.RandomState) -> np.ndarray:
+    """
+    Creates a sky-like background, i.e. a vertical gradient between two
+    random colors with smooth random blotches.
+    """
+
+    width, height = size
+    top_color, bottom_color = random.uniform(40, 255, size=(2, 3)).astype(np.float32)
+    gradient = np.linspace(0, 1, height, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    background = top_color * (1 - gradient) + bottom_color * gradient
+
+    blotches = Image.fromarray(random.randint(0, 256, size=(4, 6, 3), dtype=np.uint8)).resize(size, Image.BICUBIC)
+    background = background * 0.75 + np.asarray(blotches, dtype=np.float32) * 0.25
+
+    return background
+
+
+def synthesize_flag(flag: Image.Image, size: Tuple[int, int],
+                    random: np.random.RandomState) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+    """
+    Renders a flag waving on a pole in front of a random background. The flag
+    is warped like cloth, i.e. it waves and sags more towards its free end,
+    gets shorter and darker in folds and is rotated a little.
+
+    Every pixel of the image is mapped back to a point of the flag (or of the
+    pole), so the whole image is rendered with vectorized operations, and the
+    bounding box of the flag follows exactly from the warp.
+
+    :param flag: an RGBA image of the flag
+    :param size: width and height of the rendered image
+    :param random: a random state which determines the rendered image
+    :return: the rendered image as a uint8 array of shape [height, width, 3],
+    and the bounding box (xmin, ymin, xmax, ymax) of the flag
+    """
+
+    width, height = size
+    flag_width = width * random.uniform(*_FLAG_WIDTH_RANGE)
+    flag_height = min(flag_width * flag.height / flag.width, height * _MAX_FLAG_HEIGHT)
+    flag_width = flag_height * flag.width / flag.height
+
+    # the flag is sampled by nearest neighbours, so it is resized to its
+    # rendered size first
+    flag_pixels = np.asarray(flag.resize((max(1, round(flag_width)), max(1, round(flag_height))), Image.BILINEAR))
+
+    frequency = random.uniform(*_WAVE_FREQUENCY_RANGE)
+    phase = random.uniform(0, 2 * np.pi)
+    amplitude = flag_height * random.uniform(*_WAVE_AMPLITUDE_RANGE)
+    sag = flag_height * random.uniform(0, _MAX_SAG)
+    fold = random.uniform(0, _MAX_FOLD)
+    shading = random.uniform(0.1, _MAX_SHADING)
+    rotation = np.radians(random.uniform(-_MAX_ROTATION, _MAX_ROTATION))
+    pole_width = max(2.0, flag_height * _POLE_WIDTH)
+
+    # the top of the flag at the pole
+    x0 = random.uniform(pole_width, max(pole_width, width - flag_width * 1.1))
+    y0 = random.uniform(amplitude, max(amplitude, height - flag_height - amplitude - sag))
+
+    cos, sin = np.cos(rotation), np.sin(rotation)
+
+    def flag_coordinates(left: int, top: int, right: int, bottom: int) -> Tuple[np.ndarray, np.ndarray]:
+        # rotate image coordinates of a region back to the coordinates of the
+        # flag, with the origin at the top of the flag at the pole
+        xs = np.arange(left, right, dtype=np.float32)[np.newaxis, :] - x0
+        ys = np.arange(top, bottom, dtype=np.float32)[:, np.newaxis] - y0
+        return xs * cos + ys * sin, ys * cos - xs * sin
+
+    image = _create_background(size, random)
+
+    xs, ys = flag_coordinates(0, 0, width, height)
+    pole_mask = (xs >= -pole_width) & (xs < 0) & (ys >= -pole_width)
+    pole_brightness = 1 - np.abs(xs[pole_mask] / pole_width + 0.5)
+    image[pole_mask] = np.array([150, 150, 150], dtype=np.float32) * pole_brightness[:, np.newaxis] + 60
+
+    # the flag is warped only within the image region which can contain it
+    corners_x, corners_y = np.meshgrid([0, flag_width], [-amplitude - 1, flag_height + amplitude + sag + 1])
+    corners_x, corners_y = x0 + corners_x * cos - corners_y * sin, y0 + corners_x * sin + corners_y * cos
+    left, top = max(0, int(corners_x.min())), max(0, int(corners_y.min()))
+    right, bottom = min(width, int(np.ceil(corners_x.max())) + 1), min(height, int(np.ceil(corners_y.max())) + 1)
+
+    if left >= right or top >= bottom:
+        return np.clip(image, 0, 255).astype(np.uint8), None
+
+    xs, ys = flag_coordinates(left, top, right, bottom)
+
+    # u runs along the flag from the pole (0) to the free end (1), and v from
+    # the top (0) to the bottom (1)
+    u = xs / flag_width
+    angle = 2 * np.pi * frequency * u + phase
+    wave = amplitude * u * np.sin(angle) + sag * u ** 2
+    rendered_height = flag_height * (1 - fold * u * (1 + np.cos(angle)) / 2)
+    v = (ys - wave - (flag_height - rendered_height) / 2) / rendered_height
+
+    flag_mask = (u >= 0) & (u < 1) & (v >= 0) & (v < 1)
+    flag_x = np.clip((u * flag_pixels.shape[1]).astype(np.int32), 0, flag_pixels.shape[1] - 1)
+    flag_y = np.clip((v * flag_pixels.shape[0]).astype(np.int32), 0, flag_pixels.shape[0] - 1)
+    flag_colors = flag_pixels[flag_y[flag_mask], flag_x[flag_mask]]
+
+    # transparent parts of the flag show the background
+    opaque = flag_colors[:, 3] >= 128
+    flag_mask[flag_mask] = opaque
+    flag_colors = flag_colors[opaque, :3]
+
+    # slopes of waves facing away from the light are darker
+    brightness = 1 + shading * np.cos(angle)[flag_mask] * np.minimum(u[flag_mask] * 4, 1)
+    image[top:bottom, left:right][flag_mask] = flag_colors * brightness[:, np.newaxis]
+
+    columns = np.flatnonzero(flag_mask.any(axis=0)) + left
+    rows = np.flatnonzero(flag_mask.any(axis=1)) + top
+    bounding_box = (int(columns[0]), int(rows[0]), int(columns[-1]), int(rows[-1])) if len(columns) else None
+
+    return np.clip(image, 0, 255).astype(np.uint8), bounding_box
+
+
+def _synthesize_image(args) -> Tuple[str, str, Optional[int]]:
+    """
+    Renders a single image in a worker process, and saves it as JPEG with a
+    Pascal VOC label file. An image without any pixels of the flag is drawn
+    again with another seed, and it is skipped if no attempt shows the flag.
+
+    :return: the country code, the file name and the size of the image (None
+    if the image was skipped)
+    """
+
+    flag_path, image_path, size, seed = args
+    country_code = os.path.basename(os.path.dirname(image_path))
+    file_name = os.path.basename(image_path)
+    flag = _load_flag(flag_path)
+
+    for attempt in range(_MAX_RENDER_ATTEMPTS):
+        # the first attempt keeps the seed, so images stay the same as before
+        image, bounding_box = synthesize_flag(flag, size, np.random.RandomState(seed + [attempt] if attempt else seed))
+
+        if bounding_box is not None:
+            break
+    else:
+        return country_code, file_name, None
+
+    Image.fromarray(image).save(image_path, format='JPEG', quality=95)
+
+    width, height = size
+    write_voc_annotation(VocAnnotation(country_code, file_name, width, height, 3,
+                                       [VocObject(country_code, *bounding_box)]),
+                         image_path[:-3] + 'xml')
+
+    return country_code, file_name, os.path.getsize(image_path)
+
+
+def _is_synthetic(photo: dict) -> bool:
+    return is_synthetic(photo.get('author'))
+
+
+def synthesize_dataset(countries: List[Country], num_images: int = config.NUM_SYNTHETIC_IMAGES,
+                       dataset_folder: str = config.DATASET_FOLDER, flags_folder: str = config.FLAG_IMAGES_FOLDER,
+                       size: Tuple[int, int] = config.SYNTHETIC_IMAGE_SIZE,
+                       num_workers: int = config.NUM_SYNTHESIS_WORKERS, seed: int = 0,
+                       hash_index: HashIndex = None) -> int:
+    """
+    Renders images of waving flags of the given countries on a pool of
+    processes, and saves them with their labels into the country folders.
+    Credits of previously synthesized images of the countries are replaced,
+    while credits of other photos are kept. Images are determined by the
+    seed, the country and the image number.
+
+    :param countries: a list of countries whose flags are rendered
+    :param num_images: number of images of every country
+    :param dataset_folder: a path to the dataset folder
+    :param flags_folder: a path to the folder where flag images are cached
+    :param size: width and height of rendered images
+    :param num_workers: number of processes
+    :param seed: a seed of rendered images
+    :param hash_index: an index of perceptual hashes rendered images are
+    checked against and added to (if None, they are not checked)
+    :return: number of rendered images, without images which were skipped
+    since none of their renderings showed the flag
+    """
+
+    flag_images = {country.code.lower(): country.flag_image for country in countries}
+    tasks = []
+
+    for country in countries:
+        country_code = country.code.lower()
+        country_folder = os.path.join(dataset_folder, country_code)
+        flag_path = download_flag_image(country, flags_folder)
+
+        with open(os.path.join(country_folder, 'credits.yml')) as credits_file:
+            photos = yaml.load(credits_file, Loader=yaml.Loader)['photos'] or []
+
+        file_names = allocate_photo_filenames(country_folder, photos, _is_synthetic)
+
+        for i, file_name in zip(range(num_images), file_names):
+            image_seed = [seed, ord(country_code[0]), ord(country_code[1]), i]
+            tasks.append((flag_path, os.path.join(country_folder, file_name), tuple(size), image_seed))
+
+    photos_by_country = defaultdict(list)
+    image_paths = []
+
+    with Pool(num_workers) as pool:
+        for country_code, file_name, file_size in pool.imap_unordered(_synthesize_image, tasks, chunksize=4):
+            image_path = os.path.join(dataset_folder, country_code, file_name)
+
+            if file_size is None:
+                print(f'Skipped {image_path}, since no rendering showed the flag')
+                continue
+
+            image_paths.append(image_path)
+            photos_by_country[country_code].append({
+                'author': SYNTHETIC_AUTHOR,
+                'download_url': f'https://raw.githubusercontent.com/iamvukasin/flagnet/master/dataset/'
+                                f'{country_code}/{file_name}',
+                'downloader': 'url_image',
+                'filename': file_name,
+                'license': _SYNTHETIC_LICENSE,
+                'sha256': compute_sha256(image_path),
+                'size': file_size,
+                'url': flag_images[country_code]
+            })
+
+    for country in countries:
+        country_code = country.code.lower()
+        country_folder = os.path.join(dataset_folder, country_code)
+        removed_photos = merge_photo_credits(os.path.join(country_folder, 'credits.yml'),
+                                             photos_by_country[country_code], _is_synthetic)
+        remove_photo_files(country_folder, removed_photos)
+
+    if hash_index is not None:
+        print_near_duplicates(hash_index.add_images(image_paths, num_workers=num_workers))
+
+    return len(image_paths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renders images of waving flags without a browser.')
+    parser.add_argument('countries', nargs='*', help='two-letter codes of countries (all countries by default)')
+    parser.add_argument('--images', type=int, default=config.NUM_SYNTHETIC_IMAGES,
+                        help='number of images of every country')
+    parser.add_argument('--workers', type=int, default=config.NUM_SYNTHESIS_WORKERS, help='number of processes')
+    parser.add_argument('--seed', type=int, default=0, help='a seed of rendered images')
+    args = parser.parse_args()
+
+    registry = get_registry()
+    selected_countries = [registry.by_code(code) for code in args.countries] or registry.countries
+
+    if None in selected_countries:
+        parser.error(f'Unknown country codes: {args.countries}')
+
+    start_time = time.perf_counter()
+    num_rendered = synthesize_dataset(selected_countries, num_images=args.images, num_workers=args.workers,
+                                      seed=args.seed, hash_index=HashIndex())
+    duration = time.perf_counter() - start_time
+
+    print(f'Rendered {num_rendered} images in {duration:.1f} s ({num_rendered / duration * 60:.0f} images/min)')
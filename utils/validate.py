@@ -0,0 +1,352 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+import ruamel.yaml as yaml
+
+import config
+from utils.voc import InvalidAnnotationException, read_voc_annotation
+
+_VALIDATION_CACHE_FILE = 'validation.json'
+_VALIDATION_CACHE_VERSION = 1
+
+REQUIRED_CREDITS_FIELDS = ['author', 'download_url', 'downloader', 'filename', 'license', 'url']
+
+# all problem types the validation reports, each with a list of paths
+PROBLEM_TYPES = [
+    'invalid_image_size',
+    'invalid_credits',
+    'images_not_found',
+    'images_without_credits',
+    'images_without_labels',
+    'images_with_invalid_labels'
+]
+
+# start of frame markers of all JPEG coding processes (baseline, progressive,
+# lossless, arithmetic...), which hold the image size and number of channels
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# markers which are not followed by a segment length
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+
+
+class InvalidImageException(Exception):
+    """
+    Simple exception class to indicate a file which is not a valid JPEG
+    image.
+    """
+    pass
+
+
+def read_jpeg_size(path: str) -> Tuple[int, int, int]:
+    """
+    Reads the size of a JPEG image from its start of frame header, without
+    decoding the image.
+
+    :param path: a path to the JPEG image
+    :return: width, height and number of channels of the image
+    """
+
+    with open(path, 'rb') as file:
+        if file.read(2) != b'\xff\xd8':
+            raise InvalidImageException(f'{path} is not a JPEG image')
+
+        while True:
+            byte = file.read(1)
+
+            if not byte:
+                raise InvalidImageException(f'{path} has no start of frame header')
+
+            # skip anything which is not a marker
+            if byte != b'\xff':
+                continue
+
+            marker = file.read(1)
+
+            # skip fill bytes before the marker
+            while marker == b'\xff':
+                marker = file.read(1)
+
+            if not marker:
+                raise InvalidImageException(f'{path} has no start of frame header')
+
+            marker = marker[0]
+
+            if marker in _JPEG_STANDALONE_MARKERS:
+                continue
+
+            # the end of image or the image data is reached before the size
+            if marker in (0xD9, 0xDA):
+                raise InvalidImageException(f'{path} has no start of frame header')
+
+            segment_length = struct.unpack('>H', file.read(2))[0]
+
+            if marker in _JPEG_SOF_MARKERS:
+                _, height, width, channels = struct.unpack('>BHHB', file.read(6))
+                return width, height, channels
+
+            file.seek(segment_length - 2, os.SEEK_CUR)
+
+
+def _read_image_size(image_path: str) -> List[int]:
+    try:
+        return list(read_jpeg_size(image_path))
+    except (InvalidImageException, struct.error):
+        return None
+
+
+def _is_valid_image_size(image_size: List[int]) -> bool:
+    min_width, min_height = config.MIN_IMAGE_SIZE
+
+    if image_size is None:
+        return False
+
+    width, height, channels = image_size
+
+    return width >= min_width and height >= min_height and channels == 3
+
+
+def _read_credited_images(credits_file_path: str) -> Tuple[List[str], bool]:
+    """
+    Reads file names of all images with credits.
+
+    :return: file names of images with valid credits, and an indicator
+    whether all credits are valid
+    """
+
+    with open(credits_file_path) as yaml_file:
+        data = yaml.load(yaml_file, Loader=yaml.Loader)
+
+    images_with_credits = []
+
+    for photo_data in data['photos'] or []:
+        if not all(field in photo_data and photo_data[field] is not None for field in REQUIRED_CREDITS_FIELDS):
+            return images_with_credits, False
+
+        images_with_credits.append(photo_data['filename'])
+
+    return images_with_credits, True
+
+
+def _validate_label(image_path: str) -> str:
+    """
+    Checks whether a Pascal VOC label file of an image exists and labels all
+    objects as the flag of the country the image belongs to.
+
+    :return: None if the label is valid, or a problem type otherwise
+    """
+
+    folder_name = os.path.basename(os.path.dirname(image_path))
+
+    try:
+        annotation = read_voc_annotation(image_path[:-3] + 'xml')
+    except IOError:
+        return 'images_without_labels'
+    except InvalidAnnotationException:
+        return 'images_with_invalid_labels'
+
+    if annotation.folder != folder_name or annotation.filename != os.path.basename(image_path):
+        return 'images_with_invalid_labels'
+
+    if any(obj.name != folder_name for obj in annotation.objects):
+        return 'images_with_invalid_labels'
+
+    return None
+
+
+class _FolderCache:
+    """
+    Validation results of files in a single folder from a previous run, with
+    fingerprints of the files they were computed from. A cached result is
+    reused if the file has the same modification time and size, or (for
+    small text files) the same content hash.
+    """
+
+    def __init__(self, entries: dict = None):
+        self.entries = entries or {}
+        self.updated_entries = {}
+
+    def get(self, entry: os.DirEntry, compute, hash_content: bool = False):
+        """
+        Returns the cached result for the given file, or computes it if the
+        file was added or modified since it was cached.
+
+        :param entry: a directory entry of the file
+        :param compute: a function without arguments which computes the
+        result
+        :param hash_content: an indicator to fall back to content hashes when
+        the modification time or size of the file differs
+        :return: the validation result
+        """
+
+        stat = entry.stat()
+        fingerprint = [stat.st_mtime_ns, stat.st_size]
+        cached_entry = self.entries.get(entry.name)
+        content_hash = None
+
+        if cached_entry is not None and cached_entry['fingerprint'] == fingerprint:
+            result = cached_entry['result']
+            content_hash = cached_entry['hash']
+        else:
+            if hash_content:
+                with open(entry.path, 'rb') as file:
+                    content_hash = hashlib.sha1(file.read()).hexdigest()
+
+            if cached_entry is not None and content_hash is not None and cached_entry['hash'] == content_hash:
+                result = cached_entry['result']
+            else:
+                result = compute()
+
+        self.updated_entries[entry.name] = {'fingerprint': fingerprint, 'hash': content_hash, 'result': result}
+
+        return result
+
+
+def _validate_country_folder(country_folder: str, cache: _FolderCache) -> Dict[str, List[str]]:
+    problems = {problem_type: [] for problem_type in PROBLEM_TYPES}
+    entries = {entry.name: entry for entry in os.scandir(country_folder) if not entry.name.startswith('.')}
+    images = {name for name in entries if name.endswith('.jpg')}
+
+    for image in images:
+        image_path = os.path.join(country_folder, image)
+        image_size = cache.get(entries[image], lambda: _read_image_size(image_path))
+
+        if not _is_valid_image_size(image_size):
+            problems['invalid_image_size'].append(image_path)
+
+        label_entry = entries.get(image[:-3] + 'xml')
+
+        if label_entry is None:
+            problems['images_without_labels'].append(image_path)
+            continue
+
+        label_problem = cache.get(label_entry, lambda: _validate_label(image_path), hash_content=True)
+
+        if label_problem is not None:
+            problems[label_problem].append(image_path)
+
+    credits_file_path = os.path.join(country_folder, 'credits.yml')
+    images_with_credits, valid_credits = cache.get(entries['credits.yml'],
+                                                   lambda: _read_credited_images(credits_file_path),
+                                                   hash_content=True)
+    images_with_credits = set(images_with_credits)
+
+    if not valid_credits:
+        problems['invalid_credits'].append(credits_file_path)
+
+    problems['images_not_found'].extend(os.path.join(country_folder, image)
+                                        for image in images_with_credits.difference(images))
+    problems['images_without_credits'].extend(os.path.join(country_folder, image)
+                                              for image in images.difference(images_with_credits))
+
+    return problems
+
+
+def validate_country_folder(country_folder: str) -> Dict[str, List[str]]:
+    """
+    Validates credits, labels and sizes of all images of a single country,
+    listing the folder only once.
+
+    :param country_folder: a path to the country folder
+    :return: a dictionary of paths with problems by problem type
+    """
+
+    return _validate_country_folder(country_folder, _FolderCache())
+
+
+def _validate_country_folder_with_cache(args) -> Tuple[str, Dict[str, List[str]], dict]:
+    country_folder, cache_entries = args
+    cache = _FolderCache(cache_entries)
+    problems = _validate_country_folder(country_folder, cache)
+
+    return os.path.basename(country_folder), problems, cache.updated_entries
+
+
+def _load_validation_cache(cache_path: str, dataset_folder: str) -> dict:
+    """
+    Loads cached validation results of all country folders. The cache is
+    discarded if it was made for another dataset folder or by another
+    version of the validator.
+
+    :return: a dictionary of cache entries by file name, by folder name
+    """
+
+    if cache_path is None or not os.path.isfile(cache_path):
+        return {}
+
+    with open(cache_path) as file:
+        cache = json.load(file)
+
+    if cache.get('version') != _VALIDATION_CACHE_VERSION or cache.get('dataset_folder') != dataset_folder:
+        return {}
+
+    return cache['folders']
+
+
+def validate_dataset(dataset_folder: str = config.DATASET_FOLDER,
+                     num_workers: int = config.NUM_VALIDATION_WORKERS,
+                     cache_path: str = os.path.join(config.CACHE_FOLDER, _VALIDATION_CACHE_FILE)
+                     ) -> Dict[str, List[str]]:
+    """
+    Validates all country folders of the dataset in parallel on a pool of
+    processes. Validation results of every file are cached, so later runs
+    check only files which were added or modified in the meantime.
+
+    :param dataset_folder: a path to the dataset folder
+    :param num_workers: number of processes
+    :param cache_path: a path to the validation cache file (if None,
+    every file is validated)
+    :return: a dictionary of sorted paths with problems by problem type
+    """
+
+    cached_folders = _load_validation_cache(cache_path, os.path.abspath(dataset_folder))
+    country_folders = [entry.path for entry in os.scandir(dataset_folder)
+                       if entry.is_dir() and not entry.name.startswith('.')]
+    problems = {problem_type: [] for problem_type in PROBLEM_TYPES}
+    updated_folders = {}
+
+    with Pool(num_workers) as pool:
+        tasks = [(folder, cached_folders.get(os.path.basename(folder))) for folder in country_folders]
+        results = pool.imap_unordered(_validate_country_folder_with_cache, tasks, chunksize=4)
+
+        for folder_name, folder_problems, cache_entries in results:
+            updated_folders[folder_name] = cache_entries
+
+            for problem_type, paths in folder_problems.items():
+                problems[problem_type].extend(paths)
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        with open(cache_path, 'w') as file:
+            json.dump({
+                'version': _VALIDATION_CACHE_VERSION,
+                'dataset_folder': os.path.abspath(dataset_folder),
+                'folders': updated_folders
+            }, file)
+
+    for paths in problems.values():
+        paths.sort()
+
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validates credits, labels and image sizes of the dataset.')
+    parser.add_argument('--workers', type=int, default=config.NUM_VALIDATION_WORKERS, help='number of processes')
+    parser.add_argument('--no-cache', action='store_true', help='validate every file, ignoring cached results')
+    args = parser.parse_args()
+
+    if args.no_cache:
+        report = validate_dataset(num_workers=args.workers, cache_path=None)
+    else:
+        report = validate_dataset(num_workers=args.workers)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    sys.exit(1 if any(report.values()) else 0)
@@ -0,0 +1,121 @@
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+VocObject = namedtuple('VocObject', ['name', 'xmin', 'ymin', 'xmax', 'ymax'])
+VocAnnotation = namedtuple('VocAnnotation', ['folder', 'filename', 'width', 'height', 'depth', 'objects'])
+
+
+_ANNOTATION_TEMPLATE = """\
+<annotation>
+    <folder>{folder}</folder>
+    <filename>{filename}</filename>
+    <size>
+        <width>{width}</width>
+        <height>{height}</height>
+        <depth>{depth}</depth>
+    </size>
+    <segmented>0</segmented>
+{objects}</annotation>
+"""
+
+_OBJECT_TEMPLATE = """\
+    <object>
+        <name>{name}</name>
+        <pose>Unspecified</pose>
+        <truncated>0</truncated>
+        <occluded>0</occluded>
+        <difficult>0</difficult>
+        <bndbox>
+            <xmin>{xmin}</xmin>
+            <ymin>{ymin}</ymin>
+            <xmax>{xmax}</xmax>
+            <ymax>{ymax}</ymax>
+        </bndbox>
+    </object>
+"""
+
+
+class InvalidAnnotationException(Exception):
+    """
+    Simple exception class to indicate a label file which is not a valid
+    Pascal VOC annotation.
+    """
+    pass
+
+
+def _find_text(element: ET.Element, path: str) -> str:
+    node = element.find(path)
+
+    if node is None or node.text is None:
+        raise InvalidAnnotationException(f'Missing <{path}> element')
+
+    return node.text.strip()
+
+
+def _find_int(element: ET.Element, path: str) -> int:
+    text = _find_text(element, path)
+
+    try:
+        return int(float(text))
+    except ValueError:
+        raise InvalidAnnotationException(f'Invalid value of <{path}> element: {text}')
+
+
+def read_voc_annotation(path: str) -> VocAnnotation:
+    """
+    Reads a label file in Pascal VOC format.
+
+    :param path: a path to the XML label file
+    :return: a folder, file name, image size and a list of labeled objects
+    with their bounding boxes
+    """
+
+    try:
+        root = ET.parse(path).getroot()
+    except ET.ParseError as err:
+        raise InvalidAnnotationException(f'Invalid XML: {err}')
+
+    size = root.find('size')
+    objects = []
+
+    for element in root.iter('object'):
+        bounding_box = element.find('bndbox')
+
+        if bounding_box is None:
+            raise InvalidAnnotationException('Missing <bndbox> element')
+
+        objects.append(VocObject(name=_find_text(element, 'name'),
+                                 xmin=_find_int(bounding_box, 'xmin'),
+                                 ymin=_find_int(bounding_box, 'ymin'),
+                                 xmax=_find_int(bounding_box, 'xmax'),
+                                 ymax=_find_int(bounding_box, 'ymax')))
+
+    return VocAnnotation(folder=_find_text(root, 'folder'),
+                         filename=_find_text(root, 'filename'),
+                         width=_find_int(size, 'width') if size is not None else None,
+                         height=_find_int(size, 'height') if size is not None else None,
+                         depth=_find_int(size, 'depth') if size is not None else None,
+                         objects=objects)
+
+
+def write_voc_annotation(annotation: VocAnnotation, path: str):
+    """
+    Writes a label file in Pascal VOC format, laid out like the label files
+    of the dataset.
+
+    :param annotation: a folder, file name, image size and a list of labeled
+    objects with their bounding boxes
+    :param path: a path to the XML label file
+    """
+
+    objects = ''.join(_OBJECT_TEMPLATE.format(**{field: escape(str(value)) for field, value in obj._asdict().items()})
+                      for obj in annotation.objects)
+
+    with open(path, 'w') as file:
+        file.write(_ANNOTATION_TEMPLATE.format(folder=escape(annotation.folder),
+                                               filename=escape(annotation.filename),
+                                               width=annotation.width,
+                                               height=annotation.height,
+                                               depth=annotation.depth,
+                                               objects=objects))
@@ -0,0 +1,29 @@
+import hashlib
+import re
+import urllib.parse
+
+
+def convert_wikicommons_url_to_png_url(url: str, image_width: int = 1000) -> str:
+    """
+    Generates a URL to a PNG version of the SVG file from Wikimedia Commons
+    file URL.
+
+    :param url: a URL to the SVG file from Wikimedia Commons
+    :param image_width: a width of the PNG image
+    :return: a URL to the PNG version of the given Wikimedia Commons URL
+    """
+
+    if image_width <= 0:
+        raise ValueError(f'Image width has to be a positive number, passed {image_width}')
+
+    match = re.match(r'https?://commons\.wikimedia\.org/wiki/(?:Special:FilePath/|File:)(.+)', url)
+
+    if not match or url[-4:] != '.svg':
+        raise ValueError(f'Invalid Wikimedia Commons URL passed: {url}')
+
+    file_name = match.group(1)
+    file_name = urllib.parse.unquote(file_name).replace(' ', '_')
+    md5_hash = hashlib.md5(file_name.encode('utf-8')).hexdigest()
+
+    return (f'https://upload.wikimedia.org/wikipedia/commons/thumb/'
+            f'{md5_hash[0]}/{md5_hash[:2]}/{file_name}/{image_width}px-{file_name}.png')